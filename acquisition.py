@@ -0,0 +1,369 @@
+"""
+Reading the pressure pads in a separate acquisition process.
+
+The acquisition process owns the MCP3008 and runs the PressurePads sampling loop. It writes every sample, and every
+change of the pressed pad (a detection event), into a ring buffer in shared memory. The experiment process uses
+RemotePressurePads, which offers the same interface as PressurePads but reads the detection events from the ring. It
+blocks on a semaphore while waiting, instead of sampling itself. This way logging, writing results or any other work
+in the experiment process cannot delay reading the pressure pads.
+
+Neither side ever waits for the other: the acquisition process releases the semaphore once for every event, which
+never blocks (unlike notifying a condition, which needs its lock), and when the experiment process falls behind by
+more than the capacity of a ring, the oldest entries are overwritten and counted as overruns.
+"""
+import time
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import chipmunk as cm
+
+logger = logging.getLogger("chipmunk.acquisition")
+
+SAMPLE_CAPACITY = 2 ** 16  # About 11 minutes at 100 Hz
+EVENT_CAPACITY = 1024
+
+# Fields of the header
+SAMPLES_WRITTEN = 0
+EVENTS_WRITTEN = 1
+EVENTS_READ = 2  # Published by the experiment process, so the acquisition process can report its backlog
+EVENT_OVERRUNS = 3  # Counted by the acquisition process, when it overwrites events that were not read yet
+STATUS = 4
+HEADER_SIZE = 8
+
+# Values of the status field
+STARTING = 0
+RUNNING = 1
+STOPPED = 2
+EXIT_REQUESTED = 3
+FAILED = 4
+
+# Columns of the sample ring, followed by the value of every channel
+SAMPLE_TIME = 0
+SAMPLE_LATENESS = 1
+SAMPLE_PUSH = 2  # The index of the pressed channel, or -1
+SAMPLE_COLUMNS = 3
+
+# Columns of the event ring
+EVENT_TIME = 0
+EVENT_SAMPLE = 1
+EVENT_PUSH = 2
+EVENT_COLUMNS = 3
+
+# Sampling metrics published by the acquisition process, followed by the baseline of every channel
+METRIC_FIELDS = ["samples", "achieved_rate", "burst_rate", "idle_rate", "idle_fraction", "deadline_misses",
+                 "max_lateness", "idle"]
+METRICS_INTERVAL = 1.0  # Seconds between updates of the published metrics
+
+
+class AcquisitionExitRequest(Exception):
+    def __init__(self):
+        super().__init__("exit request")
+
+
+class AcquisitionRing:
+    """The shared memory of the acquisition process: a header, the metrics, and the sample and event rings."""
+
+    def __init__(self, channel_count, sample_capacity=SAMPLE_CAPACITY, event_capacity=EVENT_CAPACITY, name=None):
+        self.channel_count = channel_count
+        self.sample_capacity = sample_capacity
+        self.event_capacity = event_capacity
+        shapes = [(HEADER_SIZE,),
+                  (len(METRIC_FIELDS) + channel_count,),
+                  (sample_capacity, SAMPLE_COLUMNS + channel_count),
+                  (event_capacity, EVENT_COLUMNS)]
+        size = sum(int(np.prod(shape)) for shape in shapes) * 8
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # The spawned acquisition process shares the resource tracker of the experiment process, which unlinks the
+            # memory when it is closed (or when the experiment process dies)
+            self.owner = False
+        arrays = []
+        offset = 0
+        for shape, dtype in zip(shapes, [np.int64, np.float64, np.float64, np.float64]):
+            arrays.append(np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset))
+            offset += int(np.prod(shape)) * 8
+        self.header, self.metrics, self.samples, self.events = arrays
+        if self.owner:
+            self.header[:] = 0
+        self.name = self.shm.name
+
+    def close(self):
+        # The arrays have to be released before the shared memory can be closed
+        del self.header, self.metrics, self.samples, self.events
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_acquisition(ring_name, channels, pad_settings, sample_capacity, event_capacity, event_semaphore, stop_event,
+                    test_mode=False, keyboard_input=False, realtime_settings=None, verbose=False, log_file=None):
+    """The main function of the acquisition process."""
+    log_listener = cm.setup_logging(verbose, log_file)
+    ring = AcquisitionRing(len(channels), sample_capacity, event_capacity, name=ring_name)
+    try:
+        if keyboard_input:
+            import tests.utilities
+            tests.utilities.init(channels)
+        pads = cm.PressurePads(channels, test_mode=test_mode, verbose=verbose, **pad_settings)
+        if realtime_settings is not None:
+            cm.enable_realtime(**realtime_settings)
+            cm.freeze_garbage_collector()
+        ring.header[STATUS] = RUNNING
+        logger.info("Acquisition process started")
+
+        channel_indices = {name: i for i, name in enumerate(pads.names)}
+        push = None
+        sample = 0
+        metrics_time = 0.0
+        pads.push_init()
+        while not stop_event.is_set():
+            pads.push_poll()
+            row = ring.samples[sample % sample_capacity]
+            row[SAMPLE_TIME] = pads.last_sample_time
+            row[SAMPLE_LATENESS] = pads.lateness
+            row[SAMPLE_PUSH] = channel_indices.get(pads.push, -1)
+            row[SAMPLE_COLUMNS:] = pads.values
+            sample += 1
+            ring.header[SAMPLES_WRITTEN] = sample
+
+            if pads.push != push:
+                push = pads.push
+                events_written = ring.header[EVENTS_WRITTEN]
+                if events_written - ring.header[EVENTS_READ] >= event_capacity:
+                    ring.header[EVENT_OVERRUNS] += 1
+                ring.events[events_written % event_capacity] = (pads.last_sample_time, sample - 1,
+                                                                channel_indices.get(push, -1))
+                ring.header[EVENTS_WRITTEN] = events_written + 1
+                event_semaphore.release()
+
+            if pads.last_sample_time - metrics_time > METRICS_INTERVAL:
+                metrics_time = pads.last_sample_time
+                metrics = pads.metrics()
+                for i, field in enumerate(METRIC_FIELDS):
+                    ring.metrics[i] = metrics[field]
+                ring.metrics[len(METRIC_FIELDS):] = pads.baselines
+        ring.header[STATUS] = STOPPED
+    except Exception as err:
+        if err.args and err.args[0] == "exit request":
+            ring.header[STATUS] = EXIT_REQUESTED
+        else:
+            ring.header[STATUS] = FAILED
+            logger.exception("The acquisition process failed")
+    finally:
+        event_semaphore.release()  # Wakes up the experiment process, to notice that the acquisition stopped
+        ring.close()
+        cm.stop_logging(log_listener)
+
+
+class RemotePressurePads:
+    """Offers the interface of PressurePads, for pressure pads read by an acquisition process."""
+
+    def __init__(self, channels, pad_settings, test_mode=False, keyboard_input=False, realtime_settings=None,
+                 verbose=False, log_file=None, sample_capacity=SAMPLE_CAPACITY, event_capacity=EVENT_CAPACITY,
+                 start_timeout=30.0):
+        self.names = [channel.name for channel in channels]
+        self.verbose = verbose
+        self.push = None
+        self.prev_push = None
+        self.interrupted = False
+        self.waveforms = None  # A RingWaveforms, to record the pressure curve of every press
+        self.event_sample = 0  # The sample of the last detection event that was read
+        self.profiler = None  # A Profiler, whose requests are handled while waiting (see PressurePads.profiler)
+
+        self.ring = AcquisitionRing(len(channels), sample_capacity, event_capacity)
+        self.events_read = 0
+        self.samples_read = 0
+        self.sample_overruns = 0
+
+        # Spawn a fresh interpreter, rather than forking this one with its threads (such as the log writer)
+        context = multiprocessing.get_context("spawn")
+        self.event_semaphore = context.Semaphore(0)  # Released once for every event
+        self.stop_event = context.Event()
+        self.process = context.Process(target=run_acquisition,
+                                       name="acquisition",
+                                       args=(self.ring.name, channels, pad_settings, sample_capacity, event_capacity,
+                                             self.event_semaphore, self.stop_event),
+                                       kwargs=dict(test_mode=test_mode,
+                                                   keyboard_input=keyboard_input,
+                                                   realtime_settings=realtime_settings,
+                                                   verbose=verbose,
+                                                   log_file=log_file),
+                                       daemon=True)
+        self.process.start()
+        deadline = time.monotonic() + start_timeout
+        while self.ring.header[STATUS] == STARTING:
+            self.check_process()
+            if time.monotonic() > deadline:
+                raise RuntimeError("The acquisition process did not start")
+            time.sleep(0.01)
+
+    def check_process(self):
+        status = self.ring.header[STATUS]
+        if status == EXIT_REQUESTED:
+            raise AcquisitionExitRequest()
+        if status == FAILED or (status != STOPPED and not self.process.is_alive()):
+            raise RuntimeError("The acquisition process stopped unexpectedly")
+
+    def close(self):
+        if self.waveforms is not None:
+            self.waveforms.close()
+        self.stop_event.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
+
+    # Sampling metrics
+    def metrics(self):
+        metrics = {field: float(value) for field, value in zip(METRIC_FIELDS, self.ring.metrics)}
+        metrics["samples"] = int(self.ring.header[SAMPLES_WRITTEN])
+        metrics["baselines"] = dict(zip(self.names, self.ring.metrics[len(METRIC_FIELDS):].tolist()))
+        metrics["event_backlog"] = int(self.ring.header[EVENTS_WRITTEN]) - self.events_read
+        metrics["event_overruns"] = int(self.ring.header[EVENT_OVERRUNS])
+        metrics["sample_overruns"] = self.sample_overruns
+        return metrics
+
+    @property
+    def deadline_misses(self):
+        return int(self.ring.metrics[METRIC_FIELDS.index("deadline_misses")])
+
+    @property
+    def max_lateness(self):
+        return float(self.ring.metrics[METRIC_FIELDS.index("max_lateness")])
+
+    def read_samples(self):
+        """Returns a copy of the samples written since the previous call, as an array with the columns time,
+        lateness, pressed channel (or -1) and the value of every channel."""
+        written = int(self.ring.header[SAMPLES_WRITTEN])
+        if written - self.samples_read > self.ring.sample_capacity:
+            overrun = written - self.samples_read - self.ring.sample_capacity
+            self.sample_overruns += overrun
+            logger.warning("%s samples were overwritten before they were read", overrun)
+            self.samples_read = written - self.ring.sample_capacity
+        indices = np.arange(self.samples_read, written) % self.ring.sample_capacity
+        self.samples_read = written
+        return self.ring.samples[indices]
+
+    # Detection events
+    def next_event(self, timeout=None):
+        """Returns the push of the next detection event (a channel name or None). Raises TimeoutError when the timeout
+        passes, or InterruptedError after interrupt()."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # The semaphore was also released for the events that were read (or skipped) without waiting, so it is
+            # emptied before checking for new events. An event written after this check releases it again.
+            while self.event_semaphore.acquire(block=False):
+                pass
+            if self.ring.header[EVENTS_WRITTEN] != self.events_read:
+                break
+            self.check_process()
+            if self.interrupted:
+                raise InterruptedError()
+            if self.profiler is not None:
+                self.profiler.handle_requests()
+            # Wake up regularly to notice when the acquisition process stopped
+            remaining = 1.0 if deadline is None else min(1.0, deadline - time.monotonic())
+            if remaining <= 0:
+                raise TimeoutError()
+            self.event_semaphore.acquire(timeout=remaining)
+        written = int(self.ring.header[EVENTS_WRITTEN])
+        if written - self.events_read > self.ring.event_capacity:
+            logger.warning("%s detection events were overwritten before they were read",
+                           written - self.events_read - self.ring.event_capacity)
+            self.events_read = written - self.ring.event_capacity
+        event = self.ring.events[self.events_read % self.ring.event_capacity]
+        push_index = int(event[EVENT_PUSH])
+        self.event_sample = int(event[EVENT_SAMPLE])
+        self.events_read += 1
+        self.ring.header[EVENTS_READ] = self.events_read
+        return self.names[push_index] if push_index >= 0 else None
+
+    def push_init(self):
+        # Skip events that happened while we were not waiting (for example during feeding), like PressurePads, which
+        # does not read the pads at all in the meantime. Only the current state is kept.
+        self.prev_push = self.push
+        written = int(self.ring.header[EVENTS_WRITTEN])
+        if written > self.events_read:
+            push_index = int(self.ring.events[(written - 1) % self.ring.event_capacity, EVENT_PUSH])
+            self.push = self.names[push_index] if push_index >= 0 else None
+            self.events_read = written
+            self.ring.header[EVENTS_READ] = written
+
+    def push_poll(self):
+        # Process the events that are waiting, without blocking
+        while self.ring.header[EVENTS_WRITTEN] > self.events_read:
+            self.push = self.next_event()
+        self.check_process()
+        return self.push is None
+
+    def wait_for_event(self, deadline):
+        # Blocks until the next detection event, or returns False when the deadline (a time.monotonic() value) passes
+        timeout = None if deadline is None else deadline - time.monotonic()
+        try:
+            self.push = self.next_event(timeout)
+        except (TimeoutError, InterruptedError):
+            return False
+        return True
+
+    def interrupt(self):
+        # Makes the current (or next) wait return as if its deadline passed, until interrupted is cleared again
+        self.interrupted = True
+        self.event_semaphore.release()
+
+    def wait_release(self, deadline=None):
+        self.push_init()
+        while self.push is not None:
+            if not self.wait_for_event(deadline):
+                return False
+        return True
+
+    def push_wait(self, deadline=None):
+        self.push_init()
+        # First wait until no pressure pads are pressed
+        if not self.wait_release(deadline):
+            return None
+        # Then wait until one of pressure pads are pressed
+        while self.push is None:
+            if not self.wait_for_event(deadline):
+                return None
+        if self.waveforms is not None:
+            self.waveforms.trigger(self.event_sample)
+        logger.info("push = %s", self.push)
+        return self.push
+
+    def sample_during(self, function):
+        # The acquisition process keeps sampling anyway
+        return function()
+
+
+class RingWaveforms:
+    """Records the pressure curve of every press (see waveforms.py) from the sample ring of the acquisition process,
+    which holds every sample, also the ones read while the experiment process was feeding."""
+
+    def __init__(self, ring, recorder):
+        self.ring = ring
+        self.recorder = recorder
+        self.sample = None  # The sample in which the last press was detected, until its snippet is written
+
+    def trigger(self, sample):
+        self.sample = sample
+
+    def finish(self):
+        # Copies the snippet of the last press from the sample ring, writes it and returns its key for the results.
+        # Samples that were not read yet, or were already overwritten, are NaN.
+        if self.sample is not None:
+            written = int(self.ring.header[SAMPLES_WRITTEN])
+            first = max(self.sample - self.recorder.pre_samples + 1, written - self.ring.sample_capacity, 0)
+            end = min(self.sample + self.recorder.post_samples + 1, written)
+            if first <= self.sample:
+                rows = self.ring.samples[np.arange(first, end) % self.ring.sample_capacity]
+                self.recorder.capture(rows[:, SAMPLE_TIME], rows[:, SAMPLE_COLUMNS:], self.sample - first)
+            self.sample = None
+        return self.recorder.finish()
+
+    def close(self):
+        self.recorder.close()
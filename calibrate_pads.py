@@ -1,42 +1,32 @@
-import time
 import os
 import toml
-import busio
-import digitalio
-import board
-import adafruit_mcp3xxx.mcp3008 as MCP
-from adafruit_mcp3xxx.analog_in import AnalogIn
 import numpy as np
-from chipmunk import DEVICE_CONFIGURATION_FILE
+from chipmunk import DEVICE_CONFIGURATION_FILE, PressurePads, read_channel_table, pressure_pad_settings
 
 with open(os.path.join(os.path.dirname(__file__), DEVICE_CONFIGURATION_FILE)) as fh:
-    pin_settings = toml.load(fh)
+    device_configuration = toml.load(fh)
 
-# create the spi bus
-spi = busio.SPI(clock=board.SCK, MISO=board.MISO, MOSI=board.MOSI)
-cs = digitalio.DigitalInOut(board.D22)
-mcp = MCP.MCP3008(spi, cs)
-left_pressure_pad = AnalogIn(mcp, pin_settings["left_pressure_pad_pin"])
-middle_pressure_pad = AnalogIn(mcp, pin_settings["middle_pressure_pad_pin"])
-right_pressure_pad = AnalogIn(mcp, pin_settings["right_pressure_pad_pin"])
+# The pads are read as in an experiment, so that the baselines are tracked the same way
+pads = PressurePads(read_channel_table(device_configuration), **pressure_pad_settings(device_configuration))
 
-left_values = []
-middle_values = []
-right_values = []
+values = []
+baselines = []
 
+# values.csv holds the raw value of every channel, followed by its tracked baseline
 with open(os.path.join(os.path.dirname(__file__), "values.csv"), 'w') as fh:
+    fh.write(",".join(pads.names + [f"{name} baseline" for name in pads.names]) + "\n")
+    pads.push_init()
     for i in range(1000):
-        right_value = right_pressure_pad.value
-        middle_value = middle_pressure_pad.value
-        left_value = left_pressure_pad.value
-        left_values.append(left_value)
-        middle_values.append(middle_value)
-        right_values.append(right_value)
-        fh.write(f"{left_value},{middle_value},{right_value}\n")
-        print(f"{i} registered values; left: {left_value}, middle {middle_value}, right {right_value}")
+        pads.push_poll()  # Sleeps until the next sample is due
+        values.append(pads.values.copy())
+        baselines.append(pads.baselines.copy())
+        fh.write(",".join([f"{value:.0f}" for value in pads.values] +
+                          [f"{baseline:.1f}" for baseline in pads.baselines]) + "\n")
+        readings = ", ".join(f"{name}: {value:.0f} (baseline {baseline:.1f})"
+                             for name, value, baseline in zip(pads.names, pads.values, pads.baselines))
+        print(f"{i} registered values; {readings}")
 
-        time.sleep(0.01)
-
-print("Left mean:", np.mean(np.array(left_values)), "var:", np.var(np.array(left_values)))
-print("Middle mean:", np.mean(np.array(middle_values)), "var:", np.var(np.array(middle_values)))
-print("Right mean:", np.mean(np.array(right_values)), "var:", np.var(np.array(right_values)))
+values = np.array(values)
+baselines = np.array(baselines)
+for i, name in enumerate(pads.names):
+    print(f"{name} mean:", np.mean(values[:, i]), "var:", np.var(values[:, i]), "final baseline:", baselines[-1, i])
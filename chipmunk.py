@@ -4,7 +4,22 @@ import traceback  # For logging when the program crashes
 import os  # For file reading
 from typing import List, Dict, Any
 import time
-import collections
+import heapq
+import gc
+import sys
+import queue
+import logging
+import logging.handlers
+import atexit
+import threading
+import contextlib
+import signal
+import cProfile
+import pstats
+import tracemalloc
+import json
+import re
+from collections import OrderedDict
 import numpy as np
 import argparse
 import toml
@@ -18,39 +33,102 @@ FOLDER = "./"
 DEFAULT_CONFIG_FILE = "config_any_pad.toml"
 DEVICE_CONFIGURATION_FILE = "device_configuration.toml"
 RESULTS_FILE = "results.csv"
+PROGRESSION_FILE = "progression.csv"
 ERROR_LOG_FILE = "error.txt"
+LOG_FILE = "chipmunk.log"
+TRACE_FILE = "chipmunk_trace.json"
+SUMMARY_FILE = "session_summary.json"
 
 # Logging constants
-LOG_ENTRIES = ["Animal ID",  # The ID of the animal (currently just a placeholder)
-               "Waiting for press",  # Time when we started waiting for a press
-               "Press start",  # Time when the press started
-               "Press end",  # Time when the press ended
-               "Test",  # The number of the test (if there is only one test, this will always be 0)
-               "Test repeat",  # The number of times this test has been repeated
-               "Answer index",  # For a test consisting of a sequence of pads, how far in the sequence we are
-               "Provided answer",  # The answer (pressure pads pressed) given
-               "Correct answer",  # The correct answer
-               "Result",  # Result of the press
-               "Incorrect answers",  # Total number of incorrect answers since the program was started
-               "Correct answers",  # Total number of correct answers since the program was started
-               "Left reward count",  # Number of rewards provided by the left conveyor
-               "Middle reward count",  # Number of rewards provided by the middle conveyor
-               "Right reward count",  # Number of rewards provided by the right conveyor
-               "Total reward count"]  # Total number of rewards provided
+TRIAL_LOG_ENTRIES = ["Animal ID",  # The ID of the animal (a placeholder on rigs without an RFID reader)
+                     "Waiting for press",  # Time when we started waiting for a press
+                     "Press start",  # Time when the press started
+                     "Press end",  # Time when the press ended
+                     "Test",  # The number of the test (if there is only one test, this will always be 0)
+                     "Test repeat",  # The number of times this test has been repeated
+                     "Answer index",  # For a test consisting of a sequence of pads, how far in the sequence we are
+                     "Provided answer",  # The answer (pressure pads pressed) given
+                     "Correct answer",  # The correct answer
+                     "Result",  # Result of the press
+                     "Incorrect answers",  # Total number of incorrect answers since the program was started
+                     "Correct answers"]  # Total number of correct answers since the program was started
+REWARD_COUNT_ENTRY = "{} reward count"  # Number of rewards provided by the conveyor of each channel
+TOTAL_REWARD_COUNT_ENTRY = "Total reward count"  # Total number of rewards provided
+# The recorded pressure curve of the press (see waveforms.py), if any. It is the last column, so that the columns of
+# results files written before it was added keep their positions.
+WAVEFORM_ENTRY = "Waveform"
+PROGRESSION_LOG_ENTRIES = ["Time",
+                           "Animal ID",
+                           "From test",
+                           "To test",
+                           "Reason",  # The criterion that was met
+                           "Trials",  # The number of completed trials in the window of the criterion
+                           "Accuracy",  # The fraction of correct trials in the window of the criterion
+                           "Streak"]  # The number of consecutive correct trials
 
 ANIMAL_ID_PLACEHOLDER = "ANIMALXXXX"
 CORRECT = "Correct"
 INCORRECT = "Incorrect"
+TIMEOUT = "Timeout"  # No pressure pad was pressed within the response timeout of the test
 LEFT = "Left"
 MIDDLE = "Middle"
 RIGHT = "Right"
 ANY = "Any"
 
+# Channels
+# Every channel combines a pressure pad, an LED and a conveyor. Without a channel table in the device configuration,
+# the rig has the three default channels below.
+DEFAULT_CHANNELS = [LEFT, MIDDLE, RIGHT]
+MAX_CHANNELS = 8  # The number of channels of the MCP3008
+CHANNEL_SETTINGS = ["pressure_pad_pin", "pressure_pad_threshold", "led_pin", "conveyor_kit", "conveyor_stepper"]
+CONVEYOR_STEPPERS = ["stepper1", "stepper2"]  # The steppers of a motor kit
+
 # Other constants
 TEST_PREFIX = 'test'
+LOG_QUEUE_SIZE = 10000  # The maximum number of log messages waiting to be written
+
+logger = logging.getLogger("chipmunk")
 
 
 # Functions
+def log_entries(channel_names):
+    return (TRIAL_LOG_ENTRIES +
+            [REWARD_COUNT_ENTRY.format(name) for name in channel_names] +
+            [TOTAL_REWARD_COUNT_ENTRY, WAVEFORM_ENTRY])
+
+
+LOG_ENTRIES = log_entries(DEFAULT_CHANNELS)
+
+
+def channel_key(channel_name, setting):
+    # For example, the pressure_pad_pin of the "Left" channel is configured with left_pressure_pad_pin
+    return f"{channel_name.lower().replace(' ', '_')}_{setting}"
+
+
+def motor_kit_key(kit):
+    # The conveyor_kit of a channel refers to the motor kit with the address motor_kit_<kit>_address
+    return f"motor_kit_{kit}_address"
+
+
+def read_channel_table(device_configuration):
+    names = device_configuration.get("channels", DEFAULT_CHANNELS)
+    if len(names) > MAX_CHANNELS:
+        raise ValueError(f"At most {MAX_CHANNELS} channels are supported, but {len(names)} are configured")
+    channels = []
+    for name in names:
+        settings = {setting: device_configuration[channel_key(name, setting)] for setting in CHANNEL_SETTINGS}
+        disabled = device_configuration.get(channel_key(name, "pressure_pad_disabled"), False)
+        kit = settings["conveyor_kit"]
+        if isinstance(kit, bool) or not isinstance(kit, int) or motor_kit_key(kit) not in device_configuration:
+            raise ValueError(f"The conveyor of channel {name} is on motor kit {kit!r}, but {motor_kit_key(kit)} is "
+                             f"not configured")
+        if settings["conveyor_stepper"] not in CONVEYOR_STEPPERS:
+            raise ValueError(f"The conveyor of channel {name} is on stepper {settings['conveyor_stepper']!r}, which "
+                             f"is not one of {', '.join(CONVEYOR_STEPPERS)}")
+        channels.append(Channel(name, pressure_pad_disabled=disabled, **settings))
+    return channels
+
+
 def log_error():
     print("WRITING ERROR LOG...")
     data_text = open(ERROR_LOG_FILE, 'w')  # open for appending
@@ -59,22 +137,244 @@ def log_error():
     print("WRITING ERROR LOG DONE")
 
 
+def detector_options(device_configuration):
+    # Only pass on the detector settings that are actually present, so older device configurations keep working
+    options = {}
+    for key in ["release_fraction", "debounce_samples", "cusum_drift", "cusum_decision", "cusum_max_step"]:
+        if f"pressure_pad_{key}" in device_configuration:
+            options[key] = device_configuration[f"pressure_pad_{key}"]
+    return options
+
+
+def pressure_pad_settings(device_configuration):
+    # The keyword arguments of PressurePads (besides the channels) from the device configuration
+    return dict(
+        read_frequency=device_configuration["pressure_pad_read_frequency"],
+        read_window=device_configuration["pressure_pad_read_window"],
+        detector=device_configuration.get("pressure_pad_detector", MOVING_AVERAGE),
+        detector_options=detector_options(device_configuration),
+        idle_frequency=device_configuration.get("pressure_pad_idle_frequency"),
+        idle_margin=device_configuration.get("pressure_pad_idle_margin", 0.5),
+        baseline_rise_time=device_configuration.get("pressure_pad_baseline_rise_time"),
+        baseline_fall_time=device_configuration.get("pressure_pad_baseline_fall_time"),
+        deadline_tolerance=device_configuration.get("pressure_pad_deadline_tolerance", 0.002),
+        log_rate=device_configuration.get("verbose_log_rate"))
+
+
+def setup_logging(verbose=False, log_file=LOG_FILE, terminal=True):
+    # Log messages are put on a bounded queue, and written to the terminal and the log file by a background thread,
+    # so that logging never makes the program wait for the terminal or the disk. Messages are only formatted by that
+    # thread. Returns the listener, which has to be stopped to write the remaining messages before exiting.
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    handlers = []
+    if terminal:
+        terminal_handler = logging.StreamHandler(sys.stdout)
+        terminal_handler.setLevel(logging.DEBUG if verbose else logging.INFO)
+        handlers.append(terminal_handler)
+    if log_file is not None:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    return listener
+
+
+def stop_logging(listener):
+    for handler in logger.handlers:
+        if isinstance(handler, DroppingQueueHandler) and handler.dropped > 0:
+            logger.warning("%s log messages were dropped because the log queue was full", handler.dropped)
+    listener.stop()
+
+
+def enable_realtime(cpu=None, priority=50, niceness=-10):
+    # Pin the calling thread (the sampling loop) to a single core and ask for real-time scheduling. Each step is
+    # optional: when it is not permitted (for example when not running as root) or not supported on this platform, we
+    # log a warning and continue with what we have.
+    if hasattr(os, "sched_setaffinity"):
+        if cpu is None:
+            cpu = max(os.sched_getaffinity(0))
+        try:
+            os.sched_setaffinity(0, {cpu})
+            logger.info("REALTIME: Pinned to CPU %s", cpu)
+        except OSError as err:
+            logger.warning("REALTIME: Could not pin to CPU %s: %s", cpu, err)
+    else:
+        logger.warning("REALTIME: CPU pinning is not supported on this platform")
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        logger.info("REALTIME: Using SCHED_FIFO with priority %s", priority)
+    except (AttributeError, OSError) as err:
+        logger.warning("REALTIME: Could not use SCHED_FIFO: %s", err)
+        try:
+            os.nice(niceness)
+            logger.info("REALTIME: Changed niceness by %s", niceness)
+        except (AttributeError, OSError) as err:
+            logger.warning("REALTIME: Could not change niceness: %s", err)
+
+
+def freeze_garbage_collector():
+    # Move everything allocated during startup into the permanent generation, so that collections only have to look
+    # at objects created since, and disable automatic collections. Collections are then triggered explicitly between
+    # trials (see Experiment.testing_phase), so that they never interrupt the sampling loop.
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+
+
 # Classes
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Puts log records on the queue without waiting. When the queue is full, the record is dropped and counted."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Unlike the QueueHandler, leave formatting the message to the thread that writes it
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimiter:
+    """Allows at most `rate` events per second (any number if rate is None), and counts the events it suppressed."""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_time = 0.0
+        self.suppressed = 0
+
+    def allow(self):
+        now = time.monotonic()
+        if now < self.next_time:
+            self.suppressed += 1
+            return False
+        self.next_time = now + self.interval
+        return True
+
+
+class ChannelValues:
+    """A copy of one value per channel, which is only formatted when the log message is written."""
+
+    def __init__(self, names, values, baselines=None):
+        self.names = names
+        self.values = values.tolist()
+        self.baselines = baselines.tolist() if baselines is not None else None
+
+    def __str__(self):
+        if self.baselines is None:
+            return ", ".join(f"{name}: {value}" for name, value in zip(self.names, self.values))
+        return ", ".join(f"{name}: {value} (baseline {baseline:.1f})"
+                         for name, value, baseline in zip(self.names, self.values, self.baselines))
+
+
 class Test:
-    def __init__(self, answer, repeat=float('inf')):
+    def __init__(self, answer, repeat=float('inf'), response_timeout=float('inf'), inter_trial_interval=0.0,
+                 punishment_delay=0.0, promotion_accuracy=None, promotion_window=None, promotion_streak=None,
+                 demotion_accuracy=None, demotion_window=None, trial_cue=None, reward_cue=None):
         if isinstance(answer, str):
             answer = [answer]
         self.answer = answer
         self.repeat = repeat
+        # Trial timing, in seconds
+        self.response_timeout = response_timeout  # Time to press a pad, before the trial ends as a time-out
+        self.inter_trial_interval = inter_trial_interval  # Time between the end of a trial and the start of the next
+        self.punishment_delay = punishment_delay  # Added to the inter-trial interval after an incorrect answer
+        # Progression criteria (see ProgressionEngine); None disables a criterion
+        self.promotion_accuracy = promotion_accuracy  # Fraction correct over the last promotion_window trials
+        self.promotion_window = promotion_window
+        self.promotion_streak = promotion_streak  # Number of consecutive correct trials
+        self.demotion_accuracy = demotion_accuracy  # Fraction correct over the last demotion_window trials
+        self.demotion_window = demotion_window
+        # LED cues (see CueEngine), each a list of Cue or of their dictionaries; None keeps the LEDs off during the
+        # trial, and lights the LED of the rewarded channel while feeding
+        self.trial_cue = read_cues(trial_cue)  # Played from the start of the trial
+        self.reward_cue = read_cues(reward_cue)  # Played when the animal is rewarded
 
     def to_dict(self):
+        # Disabled criteria are None, which is left out of the TOML file
         return {'answer': self.answer,
-                'repeat': self.repeat}
+                'repeat': self.repeat,
+                'response_timeout': self.response_timeout,
+                'inter_trial_interval': self.inter_trial_interval,
+                'punishment_delay': self.punishment_delay,
+                'promotion_accuracy': self.promotion_accuracy,
+                'promotion_window': self.promotion_window,
+                'promotion_streak': self.promotion_streak,
+                'demotion_accuracy': self.demotion_accuracy,
+                'demotion_window': self.demotion_window,
+                'trial_cue': None if self.trial_cue is None else [cue.to_dict() for cue in self.trial_cue],
+                'reward_cue': None if self.reward_cue is None else [cue.to_dict() for cue in self.reward_cue]}
 
     def __repr__(self):
         return f'Test({str(self.to_dict())})'
 
 
+# LED cues
+# A cue lights an LED for a duration, starting at an offset from the start of the cue pattern, and can repeat with a
+# period to flash. The LED is the name of a channel, ANSWER_LED for the expected answer (in a trial cue) or the pressed
+# pad (in a reward cue), or ALL_LEDS.
+ANSWER_LED = "Answer"
+ALL_LEDS = "All"
+
+
+class Cue:
+    def __init__(self, led, duration, start=0.0, count=1, period=None):
+        self.led = led
+        self.duration = duration
+        self.start = start
+        self.count = count
+        self.period = period if period is not None else 2 * duration
+
+    def edges(self):
+        # The times at which the LED turns on (1) and off (0), relative to the start of the pattern
+        for i in range(self.count):
+            onset = self.start + i * self.period
+            yield onset, 1
+            yield onset + self.duration, 0
+
+    def to_dict(self):
+        return {'led': self.led,
+                'duration': self.duration,
+                'start': self.start,
+                'count': self.count,
+                'period': self.period}
+
+    def __repr__(self):
+        return f'Cue({str(self.to_dict())})'
+
+
+def read_cues(cues):
+    if cues is None:
+        return None
+    return [cue if isinstance(cue, Cue) else Cue(**cue) for cue in cues]
+
+
+class Channel:
+    def __init__(self, name, pressure_pad_pin, pressure_pad_threshold, led_pin, conveyor_kit, conveyor_stepper,
+                 pressure_pad_disabled=False):
+        self.name = name
+        self.pressure_pad_pin = pressure_pad_pin
+        self.pressure_pad_threshold = pressure_pad_threshold
+        self.pressure_pad_disabled = pressure_pad_disabled
+        self.led_pin = led_pin
+        self.conveyor_kit = conveyor_kit
+        self.conveyor_stepper = conveyor_stepper
+
+    def __repr__(self):
+        return f'Channel({self.name}, pad pin {self.pressure_pad_pin}, threshold {self.pressure_pad_threshold}, ' \
+               f'led pin {self.led_pin}, conveyor {self.conveyor_kit}.{self.conveyor_stepper})'
+
+
 class Parameters:
     def __init__(self, config_file):
         self.parameter_dict: Dict[str, Any] = {}
@@ -104,7 +404,7 @@ class Parameters:
         self.write_current_params()
 
     def read_from_file(self):
-        print("Reading configuration file:", self.config_file, flush=True)
+        logger.info("Reading configuration file: %s", self.config_file)
         try:
             with open(self.config_file, 'r') as fh:
                 self.parameter_dict = toml.load(fh)
@@ -120,42 +420,389 @@ class Parameters:
             self.tests = []
             for i in sorted(tests.keys()):
                 self.tests.append(Test(**tests[i]))
-            print(self.parameter_dict)
+            logger.info("%s", self.parameter_dict)
 
         except FileNotFoundError:
-            print("ERROR: Configuration file", self.config_file, "not found.")
-            print("Creating new configuration file.")
-            print("Please check the configuration and restart.")
+            logger.error("ERROR: Configuration file %s not found.", self.config_file)
+            logger.error("Creating new configuration file.")
+            logger.error("Please check the configuration and restart.")
             self.write_current_params()
             exit()
 
 
+# Progression
+# A trial is complete when the whole answer of a test was given (correct), or when an incorrect pad was pressed or the
+# response timed out (incorrect). The outcomes of the completed trials of every test are kept in fixed-size rolling
+# windows, so each trial updates the statistics in constant time.
+PROMOTION = "promotion"
+DEMOTION = "demotion"
+
+
+class RollingWindow:
+    def __init__(self, size):
+        self.outcomes = [False] * size
+        self.index = 0
+        self.count = 0
+        self.correct = 0
+
+    def add(self, correct):
+        if self.count == len(self.outcomes):
+            self.correct -= self.outcomes[self.index]
+        else:
+            self.count += 1
+        self.outcomes[self.index] = correct
+        self.correct += correct
+        self.index = (self.index + 1) % len(self.outcomes)
+
+    def reset(self):
+        self.index = 0
+        self.count = 0
+        self.correct = 0
+
+    @property
+    def full(self):
+        return self.count == len(self.outcomes)
+
+    @property
+    def accuracy(self):
+        return self.correct / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {'outcomes': self.outcomes, 'index': self.index, 'count': self.count}
+
+    def load(self, data):
+        # A window saved with another size (the configuration changed) is not used
+        if len(data['outcomes']) == len(self.outcomes):
+            self.outcomes = [bool(outcome) for outcome in data['outcomes']]
+            self.index = data['index']
+            self.count = data['count']
+            self.correct = sum(self.outcomes[i % len(self.outcomes)]
+                               for i in range(self.index - self.count, self.index))
+
+
+class TestStatistics:
+    def __init__(self, test: Test):
+        self.promotion_window = RollingWindow(test.promotion_window) if test.promotion_window else None
+        self.demotion_window = RollingWindow(test.demotion_window) if test.demotion_window else None
+        self.streak = 0
+
+    def add(self, correct):
+        for window in (self.promotion_window, self.demotion_window):
+            if window is not None:
+                window.add(correct)
+        self.streak = self.streak + 1 if correct else 0
+
+    def reset(self):
+        for window in (self.promotion_window, self.demotion_window):
+            if window is not None:
+                window.reset()
+        self.streak = 0
+
+    def to_dict(self):
+        data = {'streak': self.streak}
+        for name, window in [('promotion_window', self.promotion_window), ('demotion_window', self.demotion_window)]:
+            if window is not None:
+                data[name] = window.to_dict()
+        return data
+
+    def load(self, data):
+        self.streak = data.get('streak', 0)
+        for name, window in [('promotion_window', self.promotion_window), ('demotion_window', self.demotion_window)]:
+            if window is not None and name in data:
+                window.load(data[name])
+
+
+class ProgressionEngine:
+    def __init__(self, tests: List[Test], progression_file=PROGRESSION_FILE):
+        self.tests = tests
+        self.statistics = [TestStatistics(test) for test in tests]  # Replaced by those of the current animal
+        self.progression_file = progression_file
+        self.animal_id = ANIMAL_ID_PLACEHOLDER
+
+    def record(self, test_index, correct, test_repeat):
+        """Adds the outcome of a completed trial of a test, and returns the index of the test to continue with."""
+        test = self.tests[test_index]
+        statistics = self.statistics[test_index]
+        statistics.add(correct)
+
+        promotion = statistics.promotion_window
+        demotion = statistics.demotion_window
+        if test_repeat >= test.repeat:
+            return self.change(test_index, test_index + 1, PROMOTION, f"{test_repeat} repeats", promotion)
+        if test.promotion_streak is not None and statistics.streak >= test.promotion_streak:
+            return self.change(test_index, test_index + 1, PROMOTION, f"{statistics.streak} consecutive correct",
+                               promotion)
+        if test.promotion_accuracy is not None and promotion is not None and promotion.full \
+                and promotion.accuracy >= test.promotion_accuracy:
+            return self.change(test_index, test_index + 1, PROMOTION,
+                               f"accuracy {promotion.accuracy:.2f} >= {test.promotion_accuracy}", promotion)
+        if test.demotion_accuracy is not None and demotion is not None and demotion.full \
+                and demotion.accuracy < test.demotion_accuracy and test_index > 0:
+            return self.change(test_index, test_index - 1, DEMOTION,
+                               f"accuracy {demotion.accuracy:.2f} < {test.demotion_accuracy}", demotion)
+        return test_index
+
+    def change(self, from_test, to_test, kind, reason, window):
+        statistics = self.statistics[from_test]
+        trials = window.count if window is not None else ""
+        accuracy = round(window.accuracy, 3) if window is not None else ""
+        logger.info("%s: test %s %s to test %s: %s", self.animal_id, from_test, kind, to_test, reason)
+        if to_test < len(self.statistics):
+            # The test starts over, so that earlier performance does not promote or demote it again immediately
+            self.statistics[to_test].reset()
+        if self.progression_file is not None:
+            data = [datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), self.animal_id, from_test, to_test,
+                    f"{kind}: {reason}", trials, accuracy, statistics.streak]
+            if not os.path.exists(self.progression_file):
+                with open(self.progression_file, 'w') as fh:
+                    fh.write(','.join(PROGRESSION_LOG_ENTRIES) + "\n")
+            with open(self.progression_file, 'a') as fh:
+                fh.write(','.join(map(str, data)) + "\n")
+        return to_test
+
+
+# Animals
+# On a rig shared by several animals, every animal has its own progress through the tests. The animals are identified
+# by a reader (such as SerialRfidReader) whose read method returns the ID of the animal at the rig, or None if no new
+# animal was identified. The states of the animals are kept in an AnimalStateStore: the recently identified animals
+# stay in memory (the least recently used are dropped), and a state is written to its file after every trial, so that
+# switching between animals takes constant time and no progress is lost when the program stops.
+ANIMAL_STATE_FIELDS = ["curr_test", "test_repeat", "answer_index", "nb_correct_answers", "nb_incorrect_answers",
+                       "rew_cnt"]
+
+
+class AnimalState:
+    def __init__(self, animal_id, tests: List[Test]):
+        self.animal_id = animal_id
+        self.curr_test = 0
+        self.test_repeat = 0
+        self.answer_index = 0
+        self.nb_correct_answers = 0
+        self.nb_incorrect_answers = 0
+        self.rew_cnt = 0
+        self.statistics = [TestStatistics(test) for test in tests]
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in ANIMAL_STATE_FIELDS}
+        data['animal_id'] = self.animal_id
+        data['statistics'] = [statistics.to_dict() for statistics in self.statistics]
+        return data
+
+    def load(self, data):
+        for field in ANIMAL_STATE_FIELDS:
+            setattr(self, field, data.get(field, 0))
+        for statistics, statistics_data in zip(self.statistics, data.get('statistics', [])):
+            statistics.load(statistics_data)
+
+
+class AnimalStateStore:
+    def __init__(self, folder, tests: List[Test], cache_size=32):
+        self.folder = folder  # None to keep the states in memory only
+        self.tests = tests
+        self.cache_size = cache_size
+        self.cache: OrderedDict = OrderedDict()
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def path(self, animal_id):
+        # Only letters, digits, - and _ are kept, so that an ID cannot name a file outside the folder
+        return os.path.join(self.folder, re.sub(r'[^A-Za-z0-9_-]', '_', str(animal_id)) + '.json')
+
+    def get(self, animal_id) -> AnimalState:
+        state = self.cache.get(animal_id)
+        if state is not None:
+            self.cache.move_to_end(animal_id)
+            return state
+        state = AnimalState(animal_id, self.tests)
+        if self.folder is not None and os.path.exists(self.path(animal_id)):
+            with open(self.path(animal_id)) as fh:
+                state.load(json.load(fh))
+            logger.info("Loaded the state of animal %s", animal_id)
+        self.cache[animal_id] = state
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)  # Already written to its file
+        return state
+
+    def save(self, state: AnimalState):
+        if self.folder is None:
+            return
+        # Written to a temporary file first, so that a crash cannot leave a partially written state behind
+        path = self.path(state.animal_id)
+        with open(path + '.tmp', 'w') as fh:
+            json.dump(state.to_dict(), fh)
+        os.replace(path + '.tmp', path)
+
+
+class SerialRfidReader:
+    """Reads animal IDs from an RFID reader that sends every tag it reads as a line of text over a serial port."""
+
+    def __init__(self, port, baudrate=9600):
+        # noinspection PyPackageRequirements
+        import serial  # pyserial, only needed on rigs with an RFID reader
+        self.serial = serial.Serial(port, baudrate, timeout=0)
+        self.buffer = b""
+
+    def read(self):
+        # Returns the last complete tag received since the previous call, or None; never blocks
+        self.buffer += self.serial.read(self.serial.in_waiting or 1)
+        *lines, self.buffer = self.buffer.split(b"\n")
+        tags = [line.strip().decode('ascii', errors='replace') for line in lines if line.strip()]
+        return tags[-1] if tags else None
+
+
+# Press detectors
+# A detector receives the readings of all pressure pads as one array per sample, and decides for every pad at once
+# whether it is currently pressed. The update method returns a boolean array (owned by the detector, so copy it if it
+# has to be kept), or None as long as the detector has not seen enough values to decide.
+class MovingAverageDetector:
+    """A pad is pressed while the mean of its last `window` values exceeds its threshold."""
+
+    def __init__(self, thresholds, window):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.window = window
+        self.values = np.zeros((window, len(self.thresholds)))
+        self.index = 0
+        self.count = 0
+        self.total = np.zeros(len(self.thresholds))
+        self.level = np.zeros(len(self.thresholds))
+        self.pressed = np.zeros(len(self.thresholds), dtype=bool)
+
+    def reset(self):
+        self.values[:] = 0
+        self.index = 0
+        self.count = 0
+        self.total[:] = 0
+        self.level[:] = 0
+        self.pressed[:] = False
+
+    def update(self, values):
+        self.total -= self.values[self.index]
+        self.values[self.index] = values
+        self.total += values
+        self.index = (self.index + 1) % self.window
+        if self.count < self.window:
+            self.count += 1
+            if self.count < self.window:
+                return None
+        np.divide(self.total, self.window, out=self.level)
+        np.greater(self.level, self.thresholds, out=self.pressed)
+        return self.pressed
+
+
+class HysteresisDetector:
+    """A press starts after `debounce_samples` consecutive values above the onset threshold, and ends after
+    `debounce_samples` consecutive values below the (lower) offset threshold."""
+
+    def __init__(self, onset_thresholds, offset_thresholds, debounce_samples=1):
+        self.onset_thresholds = np.asarray(onset_thresholds, dtype=float)
+        self.offset_thresholds = np.asarray(offset_thresholds, dtype=float)
+        self.debounce_samples = debounce_samples
+        self.count = np.zeros(len(self.onset_thresholds), dtype=int)
+        self.pressed = np.zeros(len(self.onset_thresholds), dtype=bool)
+        self.level = np.zeros(len(self.onset_thresholds))
+
+    def reset(self):
+        self.count[:] = 0
+        self.pressed[:] = False
+        self.level[:] = 0
+
+    def update(self, values):
+        self.level[:] = values
+        counting = np.where(self.pressed, values < self.offset_thresholds, values > self.onset_thresholds)
+        self.count += 1
+        self.count[~counting] = 0
+        switch = self.count >= self.debounce_samples
+        self.pressed ^= switch
+        self.count[switch] = 0
+        return self.pressed
+
+
+class CusumDetector:
+    """Two-sided CUSUM change-point detector around the threshold of each pad.
+
+    While released, the amount by which values exceed `threshold + drift` is accumulated, and a press is detected when
+    the sum exceeds `decision`. While pressed, the amount by which values fall below `threshold - drift` is accumulated
+    in the same way to detect the release. A single value adds at most `max_step` to the sum, so that one noise spike
+    cannot trigger a detection on its own, while strong presses are still detected after a couple of values.
+    """
+
+    def __init__(self, thresholds, drift, decision, max_step):
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.drift = np.asarray(drift, dtype=float)
+        self.decision = np.asarray(decision, dtype=float)
+        self.max_step = np.asarray(max_step, dtype=float)
+        self.cusum = np.zeros(len(self.thresholds))
+        self.pressed = np.zeros(len(self.thresholds), dtype=bool)
+        self.level = self.cusum
+
+    def reset(self):
+        self.cusum[:] = 0
+        self.pressed[:] = False
+
+    def update(self, values):
+        step = np.where(self.pressed,
+                        (self.thresholds - self.drift) - values,
+                        values - (self.thresholds + self.drift))
+        np.minimum(step, self.max_step, out=step)
+        self.cusum += step
+        np.maximum(self.cusum, 0, out=self.cusum)
+        switch = self.cusum > self.decision
+        self.pressed ^= switch
+        self.cusum[switch] = 0
+        return self.pressed
+
+
+MOVING_AVERAGE = "moving_average"
+HYSTERESIS = "hysteresis"
+CUSUM = "cusum"
+DETECTORS = [MOVING_AVERAGE, HYSTERESIS, CUSUM]
+
+
+def create_detector(detector, thresholds, read_window,
+                    release_fraction=0.5,
+                    debounce_samples=2,
+                    cusum_drift=0.05,
+                    cusum_decision=1.0,
+                    cusum_max_step=0.6):
+    # The hysteresis and CUSUM settings are relative to the threshold of each pad, so that the same settings can be
+    # used for pads with very different sensitivities.
+    thresholds = np.asarray(thresholds, dtype=float)
+    if detector == MOVING_AVERAGE:
+        return MovingAverageDetector(thresholds, read_window)
+    elif detector == HYSTERESIS:
+        return HysteresisDetector(thresholds, thresholds * release_fraction, debounce_samples)
+    elif detector == CUSUM:
+        return CusumDetector(thresholds, thresholds * cusum_drift, thresholds * cusum_decision,
+                             thresholds * cusum_max_step)
+    raise ValueError(f"Unknown pressure pad detector: {detector}, expected one of {DETECTORS}")
+
+
 class PressurePads:
     def __init__(self,
-                 left_pressure_pad_pin,
-                 middle_pressure_pad_pin,
-                 right_pressure_pad_pin,
-                 left_pressure_pad_threshold,
-                 middle_pressure_pad_threshold,
-                 right_pressure_pad_threshold,
+                 channels,
                  read_frequency,
                  read_window,
                  test_mode=False,
                  verbose=False,
-                 disable_left_pressure_pad=False,
-                 disable_middle_pressure_pad=False,
-                 disable_right_pressure_pad=False):
+                 detector=MOVING_AVERAGE,
+                 detector_options=None,
+                 idle_frequency=None,
+                 idle_margin=0.5,
+                 baseline_rise_time=None,
+                 baseline_fall_time=None,
+                 deadline_tolerance=0.002,
+                 log_rate=None):
         self.push = None
         self.prev_push = None
+        self.interrupted = False  # Set from another thread to end a wait early, see interrupt()
         self.listen = False
         self.verbose = verbose
-        self.right_pressure_pad_pin = right_pressure_pad_pin
-        self.middle_pressure_pad_pin = middle_pressure_pad_pin
-        self.left_pressure_pad_pin = left_pressure_pad_pin
-
-        self.left_window = collections.deque(maxlen=read_window)
-        self.middle_window = collections.deque(maxlen=read_window)
-        self.right_window = collections.deque(maxlen=read_window)
+        self.sample_log_limiter = RateLimiter(log_rate)  # In verbose mode, limits how many samples are logged
+        self.channels: List[Channel] = channels
+        self.names = [channel.name for channel in channels]
+        self.waveforms = None  # A WaveformRecorder (see waveforms.py) to record the pressure curve of every press
+        self.monitor = None  # A SignalMonitor (see signal_monitor.py) to check the quality of the signals
+        self.profiler = None  # A Profiler, whose requests are handled once per sample while waiting
 
         # create the spi bus
         if test_mode:
@@ -171,88 +818,222 @@ class PressurePads:
             cs = digitalio.DigitalInOut(board.D22)
             mcp_3008 = mcp.MCP3008(spi, cs)
 
-        if not disable_right_pressure_pad:
-            self.right_pressure_pad_channel = AnalogIn(mcp_3008, self.right_pressure_pad_pin)
-        else:
-            self.right_pressure_pad_channel = None
-        if not disable_middle_pressure_pad:
-            self.middle_pressure_pad_channel = AnalogIn(mcp_3008, self.middle_pressure_pad_pin)
-        else:
-            self.middle_pressure_pad_channel = None
-        if not disable_left_pressure_pad:
-            self.left_pressure_pad_channel = AnalogIn(mcp_3008, self.left_pressure_pad_pin)
-        else:
-            self.left_pressure_pad_channel = None
-
-        self.left_threshold = left_pressure_pad_threshold
-        self.middle_threshold = middle_pressure_pad_threshold
-        self.right_threshold = right_pressure_pad_threshold
+        self.pressure_pad_channels = []
+        for channel in channels:
+            if channel.pressure_pad_disabled:
+                self.pressure_pad_channels.append(None)
+            else:
+                self.pressure_pad_channels.append(AnalogIn(mcp_3008, channel.pressure_pad_pin))
+
+        # All values and thresholds are stored as arrays with one entry per channel, in the order of the channel table
+        self.thresholds = np.array([channel.pressure_pad_threshold for channel in channels], dtype=float)
+        self.values = np.zeros(len(channels))
+
+        # Baseline tracking: the thresholds are relative to the baseline of each pad, which is the value it reads when
+        # released. The baseline follows the values of a released pad with a time constant of baseline_rise_time
+        # seconds when the values are above it, and baseline_fall_time seconds when they are below it, so that it
+        # behaves like a running minimum that slowly follows drift (temperature, debris, a replaced motor).
+        self.baselines = np.zeros(len(channels))
+        self.relative_values = np.zeros(len(channels))
+        self.baseline_mask = np.zeros(len(channels), dtype=bool)
+        self.baseline_rise_time = baseline_rise_time
+        self.baseline_fall_time = baseline_fall_time if baseline_fall_time is not None else baseline_rise_time
 
         self.read_frequency = read_frequency
         self.read_window = read_window
 
+        if detector_options is None:
+            detector_options = {}
+        self.detector_name = detector
+        self.detector = create_detector(detector, self.thresholds, read_window, **detector_options)
+
+        # Adaptive sampling: while every pad reads well below its threshold (above its baseline), the pads are read at
+        # the (lower) idle frequency. As soon as any pad rises above its idle level, the pads are read at the full read
+        # frequency again. The detector is not reset when switching, as it only ever sees idle values below the
+        # thresholds.
+        if idle_frequency is None:
+            idle_frequency = read_frequency
+        self.idle_frequency = idle_frequency
+        self.idle_levels = self.thresholds * idle_margin
+        self.idle = False
+        self.next_sample_time = None
+
+        # A sample is counted as a deadline miss when it is read more than deadline_tolerance seconds after it was due
+        self.deadline_tolerance = deadline_tolerance
+        self.lateness = 0.0
+
+        # Sampling metrics
+        self.metrics_start = time.monotonic()
+        self.last_sample_time = None
+        self.sample_period = 1.0 / read_frequency
+        self.sample_idle = False
+        self.samples = 0
+        self.burst_samples = 0
+        self.idle_samples = 0
+        self.burst_time = 0.0
+        self.idle_time = 0.0
+        self.deadline_misses = 0
+        self.max_lateness = 0.0
+
+    def metrics(self):
+        elapsed = time.monotonic() - self.metrics_start
+        return {"samples": self.samples,
+                "achieved_rate": self.samples / elapsed if elapsed > 0 else 0.0,
+                "burst_rate": self.burst_samples / self.burst_time if self.burst_time > 0 else 0.0,
+                "idle_rate": self.idle_samples / self.idle_time if self.idle_time > 0 else 0.0,
+                "idle_fraction": self.idle_time / elapsed if elapsed > 0 else 0.0,
+                "deadline_misses": self.deadline_misses,
+                "max_lateness": self.max_lateness,
+                "idle": self.idle,
+                "baselines": dict(zip(self.names, self.baselines.tolist())),
+                "signal_quality": self.monitor.metrics() if self.monitor is not None else None}
+
+    def reset_metrics(self):
+        self.metrics_start = time.monotonic()
+        self.samples = 0
+        self.burst_samples = 0
+        self.idle_samples = 0
+        self.burst_time = 0.0
+        self.idle_time = 0.0
+        self.deadline_misses = 0
+        self.max_lateness = 0.0
+
+    def wait_for_next_sample(self):
+        # Sleep until the next sample is due. The next sample is due one period after the current sample was due, so
+        # that the time spent reading and processing does not lower the sampling rate. The schedule starts over at
+        # the start of every wait (see push_init), and whenever we are more than a period behind, instead of trying
+        # to catch up.
+        now = time.monotonic()
+        self.samples += 1
+        if self.next_sample_time is not None:
+            self.lateness = now - self.next_sample_time
+            self.max_lateness = max(self.max_lateness, self.lateness)
+            if self.lateness > self.deadline_tolerance:
+                self.deadline_misses += 1
+            # Count the time since the previous sample towards the rate it was scheduled at
+            if self.sample_idle:
+                self.idle_samples += 1
+                self.idle_time += now - self.last_sample_time
+            else:
+                self.burst_samples += 1
+                self.burst_time += now - self.last_sample_time
+        if self.next_sample_time is None or now - self.next_sample_time > self.sample_period:
+            self.next_sample_time = now
+        self.last_sample_time = now
+        self.sample_idle = self.idle
+        self.sample_period = 1.0 / (self.idle_frequency if self.idle else self.read_frequency)
+        self.next_sample_time += self.sample_period
+        if self.next_sample_time > now:
+            time.sleep(self.next_sample_time - now)
+
+    def update_baselines(self, pressed):
+        if self.baseline_rise_time is None:
+            return
+        # Only update the baselines of pads that are released and read close to their baseline
+        np.less(self.relative_values, self.idle_levels, out=self.baseline_mask)
+        if pressed is not None:
+            self.baseline_mask &= ~pressed
+        # The rates are scaled with the time since the previous sample, so they do not depend on the sampling rate
+        rise_rate = min(1.0, self.sample_period / self.baseline_rise_time)
+        fall_rate = min(1.0, self.sample_period / self.baseline_fall_time)
+        rates = np.where(self.relative_values < 0, fall_rate, rise_rate)
+        self.baselines += self.baseline_mask * rates * self.relative_values
+
     def push_init(self):
         self.prev_push = self.push
+        self.next_sample_time = None
 
     def push_poll(self):
-        if self.right_pressure_pad_channel is not None:
-            right_value = self.right_pressure_pad_channel.value
-        else:
-            right_value = 0
-        if self.middle_pressure_pad_channel is not None:
-            middle_value = self.middle_pressure_pad_channel.value
-        else:
-            middle_value = 0
-        if self.left_pressure_pad_channel is not None:
-            left_value = self.left_pressure_pad_channel.value
-        else:
-            left_value = 0
-        self.left_window.append(left_value)
-        self.middle_window.append(middle_value)
-        self.right_window.append(right_value)
-        if self.verbose:
-            print(f"registered values; left: {left_value}, middle {middle_value}, right {right_value}")
-
-        time.sleep(1.0/self.read_frequency)
-        if len(self.left_window) < self.read_window:
+        sample_time = time.monotonic()
+        for i, pressure_pad_channel in enumerate(self.pressure_pad_channels):
+            self.values[i] = pressure_pad_channel.value if pressure_pad_channel is not None else 0
+        if self.waveforms is not None:
+            self.waveforms.add(sample_time, self.values)
+        if self.monitor is not None:
+            self.monitor.add(sample_time, self.values)
+        np.subtract(self.values, self.baselines, out=self.relative_values)
+        log_sample = self.verbose and self.sample_log_limiter.allow()
+        if log_sample:
+            logger.debug("registered values; %s", ChannelValues(self.names, self.values, self.baselines))
+
+        pressed = self.detector.update(self.relative_values)
+        self.update_baselines(pressed)
+
+        self.idle = bool(np.all(self.relative_values < self.idle_levels)) and (pressed is None or not pressed.any())
+        self.wait_for_next_sample()
+        if pressed is None:
             self.push = None
             return False
 
-        if self.verbose:
-            print(f"mean values; left: {np.mean(self.left_window)}, "
-                  f"middle {np.mean(self.middle_window)}, "
-                  f"right {np.mean(self.right_window)}")
-
-        left_pressure_pad_pressed = np.mean(self.left_window) > self.left_threshold
-        middle_pressure_pad_pressed = np.mean(self.middle_window) > self.middle_threshold
-        right_pressure_pad_pressed = np.mean(self.right_window) > self.right_threshold
-
-        if right_pressure_pad_pressed:
-            self.push = RIGHT
-        elif middle_pressure_pad_pressed:
-            self.push = MIDDLE
-        elif left_pressure_pad_pressed:
-            self.push = LEFT
+        if log_sample:
+            logger.debug("%s values; %s", self.detector_name, ChannelValues(self.names, self.detector.level))
+
+        # When several pads are pressed at once, the channel listed last in the channel table takes precedence
+        pressed_channels = np.flatnonzero(pressed)
+        if len(pressed_channels) > 0:
+            self.push = self.names[pressed_channels[-1]]
         else:
             self.push = None
 
         return self.push is None
 
-    def wait_release(self):
+    def wait_release(self, deadline=None):
+        # Returns False if the pads were not released before the deadline (a time.monotonic() value)
         self.push_init()
         while not self.push_poll():
-            pass
-
-    def push_wait(self):  # Monitor buttons and presence/absence
+            if self.profiler is not None:
+                self.profiler.handle_requests()
+            if self.interrupted or (deadline is not None and time.monotonic() >= deadline):
+                return False
+        return True
+
+    def push_wait(self, deadline=None):  # Monitor buttons and presence/absence
+        # Returns the pressed pad, or None if no pad was pressed before the deadline. Between samples push_poll
+        # sleeps until the next sample is due, so the deadline is checked once per sample.
         self.push_init()
         # First wait until no pressure pads are pressed
-        self.wait_release()
+        if not self.wait_release(deadline):
+            return None
         # Then wait until one of pressure pads are pressed
         while self.push_poll():
-            pass
-        print("push = ", self.push)
+            if self.profiler is not None:
+                self.profiler.handle_requests()
+            if self.interrupted or (deadline is not None and time.monotonic() >= deadline):
+                return None
+        if self.waveforms is not None:
+            self.waveforms.trigger()
+        logger.info("push = %s", self.push)
         return self.push
 
+    def sample_during(self, function):
+        # Calls function (such as a feed), while reading the pads on another thread until the snippet of the last press
+        # is complete. This way the samples that follow a correct press are recorded, although feeding comes first.
+        if self.waveforms is None or not self.waveforms.capturing:
+            return function()
+        done = threading.Event()
+
+        def sample():
+            while self.waveforms.capturing and not done.is_set():
+                self.push_poll()
+
+        thread = threading.Thread(target=sample, name="waveform sampling", daemon=True)
+        thread.start()
+        try:
+            return function()
+        finally:
+            done.set()
+            thread.join()
+
+    def interrupt(self):
+        # Makes the current (or next) wait return as if its deadline passed, until interrupted is cleared again
+        self.interrupted = True
+
+    def close(self):
+        if self.waveforms is not None:
+            self.waveforms.close()
+        if self.monitor is not None:
+            self.monitor.close()
+
 
 class Conveyor:
     def __init__(self, stepper, steps_to_feed, name):
@@ -260,25 +1041,285 @@ class Conveyor:
         self.steps_to_feed = steps_to_feed
         self.name = name
         self.times_fed = 0
+        self.manual_feeds = 0  # Feeds requested through the control socket, which are not rewards
+        self.lock = threading.Lock()  # Manual feeds run on another thread
+
+    def feed(self, manual=False):
+        with self.lock:
+            logger.info("Feeding from %s conveyor%s", self.name, " (manual)" if manual else "")
+            for i in range(self.steps_to_feed):
+                self.stepper.onestep(direction=stepper.BACKWARD, style=stepper.DOUBLE)
+            if manual:
+                self.manual_feeds += 1
+            else:
+                self.times_fed += 1
+
+
+# Tracing
+# With --trace, the phases of every trial are recorded as spans, and presses as instant events, in a buffer of a
+# fixed size. At the end of a trial in which the buffer became more than half full, it is written to a file in the
+# Chrome trace-event format, which can be opened with https://ui.perfetto.dev or chrome://tracing. Every file holds
+# complete events, and only the last max_files files of a session are kept. The file names start with the start time
+# of the session, so that the next session does not overwrite them. Without --trace, a NullTracer does nothing.
+class TraceSpan:
+    __slots__ = ("tracer", "name", "arg", "start")
+
+    def __init__(self, tracer, name, arg):
+        self.tracer = tracer
+        self.name = name
+        self.arg = arg
 
-    def feed(self):
-        print(f"Feeding from {self.name} conveyor")
-        for i in range(self.steps_to_feed):
-            self.stepper.onestep(direction=stepper.BACKWARD, style=stepper.DOUBLE)
-        self.times_fed += 1
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exit_type, value, exit_traceback):
+        self.tracer.record(self.name, self.start, time.monotonic() - self.start, self.arg)
+
+
+class Tracer:
+    def __init__(self, trace_file=TRACE_FILE, buffer_size=65536, max_files=10):
+        self.trace_file = trace_file
+        self.max_files = max_files
+        self.session = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.file_index = 0
+        self.pid = os.getpid()
+        # The buffer: one entry per event, an instant event has no duration (None)
+        self.names = [""] * buffer_size
+        self.starts = [0.0] * buffer_size
+        self.durations = [None] * buffer_size
+        self.args = [None] * buffer_size
+        self.count = 0
+        self.dropped = 0
+
+    def span(self, name, arg=None):
+        return TraceSpan(self, name, arg)
+
+    def instant(self, name, arg=None):
+        self.record(name, time.monotonic(), None, arg)
+
+    def record(self, name, start, duration, arg=None):
+        i = self.count
+        if i == len(self.names):
+            self.dropped += 1
+            return
+        self.names[i] = name
+        self.starts[i] = start
+        self.durations[i] = duration
+        self.args[i] = arg
+        self.count = i + 1
+
+    def end_trial(self):
+        if self.count > len(self.names) // 2:
+            self.flush()
+
+    def file_name(self, index):
+        base, extension = os.path.splitext(self.trace_file)
+        return f"{base}_{self.session}_{index:04d}{extension}"
+
+    def flush(self):
+        if self.count == 0:
+            return
+        events = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "chipmunk"}}]
+        for i in range(self.count):
+            event = {"name": self.names[i], "pid": self.pid, "tid": 0, "ts": self.starts[i] * 1e6}
+            if self.durations[i] is None:
+                event.update(ph="i", s="p")
+            else:
+                event.update(ph="X", dur=self.durations[i] * 1e6)
+            if self.args[i] is not None:
+                event["args"] = {"value": self.args[i]}
+            events.append(event)
+        with open(self.file_name(self.file_index), 'w') as fh:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh)
+        old_file = self.file_name(self.file_index - self.max_files)
+        if self.file_index >= self.max_files and os.path.exists(old_file):
+            os.remove(old_file)
+        self.file_index += 1
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        if self.dropped:
+            logger.warning("%s trace events were dropped, because the trace buffer was full", self.dropped)
+
+
+class NullTracer:
+    NULL_SPAN = contextlib.nullcontext()
+
+    def span(self, name, arg=None):
+        return self.NULL_SPAN
+
+    def instant(self, name, arg=None):
+        pass
+
+    def end_trial(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Profiling
+# A running session can be profiled without stopping it: SIGUSR1 (kill -USR1 <pid>) starts cProfile, and the next
+# SIGUSR1 stops it and writes the statistics to a timestamped .prof file (open it with pstats or snakeviz), with a
+# summary of the slowest functions in a .txt file next to it. The first SIGUSR2 starts tracing memory allocations, and
+# every next SIGUSR2 writes the allocations that grew most since the previous one to a timestamped .txt file.
+# The signal handlers only set a flag, because a handler runs in the main thread between two of its instructions,
+# possibly while it holds the lock of the logging queue. The experiment loop acts on the flags after every trial, and
+# the pressure pads while waiting for a press (see PressurePads.profiler), so that an idle rig also responds.
+# Only the main thread is profiled; with --acquisition-process, the pressure pads are read in another process.
+class Profiler:
+    def __init__(self, folder=FOLDER, memory_frames=10, summary_lines=50):
+        self.folder = folder
+        self.memory_frames = memory_frames  # The number of frames stored per memory allocation
+        self.summary_lines = summary_lines
+        self.profile = None
+        self.snapshot = None
+        self.toggle_requested = False
+        self.memory_dump_requested = False
+
+    def file_name(self, kind, extension):
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        return os.path.join(self.folder, f"chipmunk_{kind}_{timestamp}{extension}")
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        logger.info("Profiling started")
+
+    def stop(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        path = self.file_name("profile", ".prof")
+        self.profile.dump_stats(path)
+        with open(os.path.splitext(path)[0] + ".txt", 'w') as fh:
+            stats = pstats.Stats(self.profile, stream=fh)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.summary_lines)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(self.summary_lines)
+        self.profile = None
+        logger.info("Profiling stopped, statistics written to %s", path)
+
+    def toggle(self, signal_number=None, frame=None):
+        if self.profile is None:
+            self.start()
+        else:
+            self.stop()
+
+    def dump_memory(self, signal_number=None, frame=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+            self.snapshot = tracemalloc.take_snapshot()
+            logger.info("Memory tracing started")
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        differences = snapshot.compare_to(self.snapshot, 'lineno')
+        path = self.file_name("memory", ".txt")
+        with open(path, 'w') as fh:
+            current, peak = tracemalloc.get_traced_memory()
+            fh.write(f"Traced memory: {current / 1e6:.1f} MB (peak {peak / 1e6:.1f} MB)\n")
+            fh.write("Largest changes since the previous snapshot:\n")
+            for difference in differences[:self.summary_lines]:
+                fh.write(f"{difference}\n")
+        self.snapshot = snapshot
+        logger.info("Memory snapshot difference written to %s", path)
+
+    def request_toggle(self, signal_number=None, frame=None):
+        self.toggle_requested = True
+
+    def request_memory_dump(self, signal_number=None, frame=None):
+        self.memory_dump_requested = True
+
+    def handle_requests(self):
+        # Called by the experiment loop
+        if self.toggle_requested:
+            self.toggle_requested = False
+            self.toggle()
+        if self.memory_dump_requested:
+            self.memory_dump_requested = False
+            self.dump_memory()
+
+    def install_signal_handlers(self):
+        if hasattr(signal, "SIGUSR1"):  # Not available on Windows
+            signal.signal(signal.SIGUSR1, self.request_toggle)
+            signal.signal(signal.SIGUSR2, self.request_memory_dump)
+
+
+# Trial timing
+# The deadlines of the trials are kept on a heap ordered by time.monotonic(), so that the experiment can block until
+# the earliest one, instead of checking each of them in turn.
+NEXT_TRIAL = "next trial"  # End of the inter-trial interval (and punishment delay)
+RESPONSE_TIMEOUT = "response timeout"  # End of the response window
+
+
+class DeadlineScheduler:
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        # The clock and sleep functions can be replaced by a virtual clock, as in simulation.py
+        self.clock = clock
+        self.sleep = sleep
+        self.heap = []
+        self.deadlines = {}  # The current deadline of every name; entries on the heap that differ are cancelled
+
+    def schedule(self, name, delay):
+        # Schedules (or reschedules) the named deadline, delay seconds from now
+        deadline = self.clock() + delay
+        self.deadlines[name] = deadline
+        heapq.heappush(self.heap, (deadline, name))
+        self.prune()
+        return deadline
+
+    def cancel(self, name):
+        self.deadlines.pop(name, None)
+        self.prune()
+
+    def prune(self):
+        # Cancelled and rescheduled entries only leave the heap when they reach its top, so the heap is rebuilt from
+        # the current deadlines once they are outnumbered, which keeps it as small as the number of names
+        if len(self.heap) > 2 * len(self.deadlines):
+            self.heap = [(deadline, name) for name, deadline in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def deadline(self, name):
+        return self.deadlines.get(name)
+
+    def next(self):
+        # Returns the earliest (deadline, name), or None if nothing is scheduled
+        while self.heap:
+            deadline, name = self.heap[0]
+            if self.deadlines.get(name) == deadline:
+                return deadline, name
+            heapq.heappop(self.heap)  # Cancelled or rescheduled
+        return None
+
+    def pop_expired(self, now=None):
+        # Removes and returns the names of all deadlines that have passed, earliest first
+        if now is None:
+            now = self.clock()
+        expired = []
+        entry = self.next()
+        while entry is not None and entry[0] <= now:
+            heapq.heappop(self.heap)
+            del self.deadlines[entry[1]]
+            expired.append(entry[1])
+            entry = self.next()
+        return expired
+
+    def sleep_until(self, name):
+        # Blocks until the named deadline has passed, and removes it. Returns immediately if it is not scheduled.
+        deadline = self.deadlines.get(name)
+        if deadline is None:
+            return
+        remaining = deadline - self.clock()
+        if remaining > 0:
+            self.sleep(remaining)
+        self.cancel(name)
 
 
 # JH: Class for keeping track of the LED status
 class Leds:
-    def __init__(self, left_led_pin, middle_led_pin, right_led_pin, test_mode=False):
-        self.left_led_pin = left_led_pin
-        self.middle_led_pin = middle_led_pin
-        self.right_led_pin = right_led_pin
-        self.id_to_pin = {
-            LEFT: self.left_led_pin,
-            MIDDLE: self.middle_led_pin,
-            RIGHT: self.right_led_pin,
-        }
+    def __init__(self, channels, test_mode=False):
+        self.id_to_pin = {channel.name: channel.led_pin for channel in channels}
 
         if test_mode:
             # noinspection PyPep8Naming
@@ -305,31 +1346,262 @@ class Leds:
 
     def setup(self):
         self.gpio.setmode(self.gpio.BCM)
-        self.gpio.setup(self.left_led_pin, self.gpio.OUT)
-        self.gpio.setup(self.middle_led_pin, self.gpio.OUT)
-        self.gpio.setup(self.right_led_pin, self.gpio.OUT)
+        for pin in self.id_to_pin.values():
+            self.gpio.setup(pin, self.gpio.OUT)
 
     def cleanup(self):
         self.turn_all_off()
         self.gpio.cleanup()
 
 
+class CueEngine:
+    # Switches the LEDs of cue patterns on a background thread, so that the pressure pads are sampled meanwhile. The
+    # edges are kept on a heap ordered by time.monotonic(); the thread waits on a condition until shortly before the
+    # earliest edge, and then yields until it is due, which is more precise than one long wait. The time at which every
+    # edge was actually switched is logged with its deviation from the schedule. The thread is started with the engine.
+    def __init__(self, leds, spin_time=0.001, tolerance=0.002, clock=time.monotonic):
+        self.leds = leds
+        self.spin_time = spin_time  # The last part of a wait, in which the thread yields instead of waiting
+        self.tolerance = tolerance  # Deviations larger than this are logged as warnings
+        self.clock = clock
+        self.heap = []  # (time, sequence number, LED, value)
+        self.sequence = 0
+        self.lit = set()
+        self.condition = threading.Condition()
+        self.closed = False
+        # Statistics of the deviations, in seconds
+        self.edges = 0
+        self.late_edges = 0
+        self.max_deviation = 0.0
+        self.total_deviation = 0.0
+        self.thread = threading.Thread(target=self.run, name="cues", daemon=True)
+        self.thread.start()
+
+    def play(self, cues, answer=None, origin=None):
+        # Schedules the cues relative to origin (by default now); returns the origin
+        if origin is None:
+            origin = self.clock()
+        with self.condition:
+            for cue in cues:
+                for led in self.resolve(cue.led, answer):
+                    for offset, value in cue.edges():
+                        heapq.heappush(self.heap, (origin + offset, self.sequence, led, value))
+                        self.sequence += 1
+            self.condition.notify()
+        return origin
+
+    def resolve(self, led, answer):
+        if led == ANSWER_LED:
+            led = answer
+        if led == ALL_LEDS or led == ANY:
+            return list(self.leds.id_to_pin)
+        if led not in self.leds.id_to_pin:
+            logger.warning("No LED for cue: %s", led)
+            return []
+        return [led]
+
+    def cancel(self):
+        # Drops the remaining edges, and turns off the LEDs that are on
+        with self.condition:
+            self.heap.clear()
+            for led in self.lit:
+                self.leds.turn_off(led)
+            self.lit.clear()
+            self.condition.notify()
+
+    def close(self):
+        self.closed = True
+        self.cancel()
+        self.thread.join(1.0)
+        if self.edges:
+            logger.info("Cue timing: %s", self.metrics())
+
+    def metrics(self):
+        return {"edges": self.edges,
+                "late_edges": self.late_edges,
+                "mean_deviation": self.total_deviation / self.edges if self.edges else 0.0,
+                "max_deviation": self.max_deviation}
+
+    def run(self):
+        while not self.closed:
+            with self.condition:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                due = self.heap[0][0]
+                remaining = due - self.clock()
+                if remaining > self.spin_time:
+                    # Woken up early when cues are played or cancelled
+                    self.condition.wait(remaining - self.spin_time)
+                    continue
+            while self.clock() < due:
+                time.sleep(0)
+            with self.condition:
+                if not self.heap or self.heap[0][0] != due:
+                    continue  # Cancelled or rescheduled meanwhile
+                _, _, led, value = heapq.heappop(self.heap)
+                if value:
+                    self.leds.turn_on(led)
+                    self.lit.add(led)
+                else:
+                    self.leds.turn_off(led)
+                    self.lit.discard(led)
+                actual = self.clock()
+            self.record(led, value, due, actual)
+
+    def record(self, led, value, due, actual):
+        deviation = actual - due
+        self.edges += 1
+        self.total_deviation += deviation
+        self.max_deviation = max(self.max_deviation, deviation)
+        message = "Cue %s %s: scheduled %.6f, actual %.6f, deviation %.3f ms"
+        if deviation > self.tolerance:
+            self.late_edges += 1
+            logger.warning(message, led, "on" if value else "off", due, actual, deviation * 1000)
+        else:
+            logger.info(message, led, "on" if value else "off", due, actual, deviation * 1000)
+
+
+class NullCueEngine:
+    # Does not play any cues, and starts no thread; used when the experiment is not given a CueEngine, as in
+    # simulations and tests
+    def play(self, cues, answer=None, origin=None):
+        return origin
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+    def metrics(self):
+        return {"edges": 0, "late_edges": 0, "mean_deviation": 0.0, "max_deviation": 0.0}
+
+
+# Session summary
+# Running totals of the session, updated in constant time for every logged result, so that the state of a session can
+# be read without parsing the whole results file. A background thread writes them to a small JSON file every few
+# seconds, through a temporary file that replaces the previous one, so a reader never sees a partially written file.
+class SessionSummary:
+    def __init__(self, conveyors, summary_file=SUMMARY_FILE, interval=5.0, clock=time.monotonic):
+        self.conveyors = conveyors
+        self.summary_file = summary_file
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()  # The totals are written by the experiment, and read by the writer thread
+        self.start_time = datetime.datetime.now()
+        self.start = clock()
+        self.results = 0
+        self.correct = 0
+        self.incorrect = 0
+        self.timeouts = 0
+        self.tests = {}  # Per test: [results, correct answers]
+        self.streak = 0  # Consecutive correct answers
+        self.longest_streak = 0
+        self.last_press = None
+        self.last_press_time = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="summary", daemon=True)
+
+    def record(self, result, test, pressed):
+        with self.lock:
+            self.results += 1
+            counts = self.tests.setdefault(test, [0, 0])
+            counts[0] += 1
+            if result == CORRECT:
+                self.correct += 1
+                counts[1] += 1
+                self.streak += 1
+                self.longest_streak = max(self.longest_streak, self.streak)
+            else:
+                if result == TIMEOUT:
+                    self.timeouts += 1
+                else:
+                    self.incorrect += 1
+                self.streak = 0
+            if pressed:
+                self.last_press = self.clock()
+                self.last_press_time = datetime.datetime.now()
+
+    def to_dict(self):
+        now = self.clock()
+        with self.lock:
+            hours = (now - self.start) / 3600
+            return {"start": self.start_time.isoformat(timespec='seconds'),
+                    "updated": datetime.datetime.now().isoformat(timespec='seconds'),
+                    "results": self.results,
+                    "correct": self.correct,
+                    "incorrect": self.incorrect,
+                    "timeouts": self.timeouts,
+                    "accuracy": self.correct / self.results if self.results else None,
+                    "tests": {str(test): {"results": results,
+                                          "correct": correct,
+                                          "accuracy": correct / results}
+                              for test, (results, correct) in self.tests.items()},
+                    "results_per_hour": self.results / hours if hours > 0 else 0.0,
+                    "rewards": {name: conveyor.times_fed for name, conveyor in self.conveyors.items()},
+                    "streak": self.streak,
+                    "longest_streak": self.longest_streak,
+                    "last_press": (self.last_press_time.isoformat(timespec='seconds')
+                                   if self.last_press_time is not None else None),
+                    "seconds_since_last_press": now - self.last_press if self.last_press is not None else None}
+
+    def write(self):
+        with open(self.summary_file + '.tmp', 'w') as fh:
+            json.dump(self.to_dict(), fh, indent=2)
+        os.replace(self.summary_file + '.tmp', self.summary_file)
+
+    def start_writing(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError as err:
+                logger.warning("Writing the session summary failed: %s", err)
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write()
+
+
 class Experiment:
     def __init__(self,
                  parameters: Parameters,
                  pressure_pads: PressurePads,
                  conveyors: Dict[str, Conveyor],
-                 leds: Leds):
+                 leds: Leds,
+                 realtime: bool = False,
+                 progression_file=PROGRESSION_FILE,
+                 results_file=RESULTS_FILE,
+                 scheduler: DeadlineScheduler = None,
+                 animals: AnimalStateStore = None,
+                 animal_reader=None,
+                 tracer=None,
+                 uploader=None,
+                 cues: CueEngine = None,
+                 summary: SessionSummary = None):
         self.par: Parameters = parameters
         self.pads: PressurePads = pressure_pads
         self.conveyors: Dict[str, Conveyor] = conveyors
         self.leds = leds
+        self.cues = cues if cues is not None else NullCueEngine()
+        self.log_entries = log_entries(self.conveyors)
+        self.results_file = results_file  # None to not write the results, for example in simulations
+        self.tracer = tracer if tracer is not None else NullTracer()
+        self.uploader = uploader  # See uploader.py, None to not upload the results
+        self.summary = summary  # None to not keep a session summary, for example in simulations
 
         # Test parameters
         self.curr_test: int = 0
         self.test_repeat: int = 0
+        self.progression = ProgressionEngine(self.par.get_tests(), progression_file)
 
         # Trial data
+        self.scheduler = scheduler if scheduler is not None else DeadlineScheduler()
         self.answer_index: int = 0
         self.nb_correct_answers: int = 0
         self.nb_incorrect_answers: int = 0
@@ -338,11 +1610,129 @@ class Experiment:
         self.rew_cnt: int = 0
         self.running: bool = True
 
+        # Real-time mode: garbage is only collected between trials
+        self.realtime: bool = realtime
+        self.reported_deadline_misses: int = 0
+
+        # Animals: the test parameters, trial data and counters above belong to the current animal
+        self.animals = animals if animals is not None else AnimalStateStore(None, self.par.get_tests())
+        self.animal_reader = animal_reader  # None on a rig with a single, unidentified animal
+        self.animal: AnimalState = None
+        self.switch_animal(ANIMAL_ID_PLACEHOLDER)
+
+        # Control (see control.py): pausing or stopping ends the wait for a press, without logging the trial
+        self.paused: bool = False
+        self.resumed = threading.Event()
+        self.resumed.set()
+
+    def pause(self):
+        self.paused = True
+        self.resumed.clear()
+        self.pads.interrupt()
+        logger.info("Pausing")
+
+    def resume(self):
+        self.paused = False
+        self.resumed.set()
+        logger.info("Resuming")
+
+    def stop(self):
+        self.running = False
+        self.resumed.set()
+        self.pads.interrupt()
+        logger.info("Stopping")
+
+    def status(self):
+        status = {"running": self.running,
+                  "paused": self.paused,
+                  "animal": self.animal.animal_id,
+                  "test": self.curr_test,
+                  "test_repeat": self.test_repeat,
+                  "answer_index": self.answer_index,
+                  "correct_answers": self.nb_correct_answers,
+                  "incorrect_answers": self.nb_incorrect_answers,
+                  "rewards": self.rew_cnt,
+                  "reward_counts": {name: conveyor.times_fed for name, conveyor in self.conveyors.items()}}
+        metrics = self.pads.metrics()
+        for key in ["achieved_rate", "burst_rate", "idle_rate", "deadline_misses", "max_lateness", "signal_quality"]:
+            if key in metrics:
+                status[key] = metrics[key]
+        status["cue_timing"] = self.cues.metrics()
+        if self.summary is not None:
+            status["summary"] = self.summary.to_dict()
+        return status
+
+    def switch_animal(self, animal_id):
+        self.animal = self.animals.get(animal_id)
+        for field in ANIMAL_STATE_FIELDS:
+            setattr(self, field, getattr(self.animal, field))
+        self.progression.statistics = self.animal.statistics
+        self.progression.animal_id = animal_id
+
+    def save_animal(self):
+        for field in ANIMAL_STATE_FIELDS:
+            setattr(self.animal, field, getattr(self, field))
+        # Without identification every run starts from the first test, as the animal may have been replaced
+        if self.animal.animal_id != ANIMAL_ID_PLACEHOLDER:
+            self.animals.save(self.animal)
+
+    def identify_animal(self):
+        # Switches to the animal identified by the reader, and returns whether it is another animal than before
+        if self.animal_reader is None:
+            return False
+        animal_id = self.animal_reader.read()
+        if animal_id is None or animal_id == self.animal.animal_id:
+            return False
+        logger.info("Animal %s identified", animal_id)
+        self.switch_animal(animal_id)
+        return True
+
+    def wait_for_training_animal(self):
+        # The current animal completed all tests, so its presses are ignored. Returns a press that was made by another
+        # animal that still trains, which is identified after the press like in a normal trial, or None.
+        logger.info("Animal %s completed all tests", self.animal.animal_id)
+        provided_answer = self.pads.push_wait()
+        if provided_answer is None:
+            return None  # Interrupted by a pause or stop
+        if self.identify_animal() and self.curr_test < len(self.par.get_tests()):
+            self.tracer.instant("detection", provided_answer)
+            return provided_answer
+        self.pads.wait_release()
+        return None
+
     def testing_phase(self):
+        # Runs one trial, and returns its result
+        with self.tracer.span("trial"):
+            result = self.trial()
+        self.tracer.end_trial()
+        return result
+
+    def trial(self):
+        # Cleared before checking for a pause, so that a pause after the check still ends the wait for a press
+        self.pads.interrupted = False
+        if self.paused:
+            logger.info("Paused")
+            with self.tracer.span("paused"):
+                self.resumed.wait()
+        if not self.running:
+            return None
+        # Wait for the end of the inter-trial interval of the previous trial
+        with self.tracer.span("inter-trial interval"):
+            self.scheduler.sleep_until(NEXT_TRIAL)
+        with self.tracer.span("identify animal"):
+            self.identify_animal()
+        early_press = None  # The press of an animal that entered while an animal that completed all tests was current
         if self.curr_test >= len(self.par.get_tests()):
-            self.running = False
-            return
-        answer_list = self.par.get_tests()[self.curr_test].answer
+            if self.animal_reader is None:
+                self.running = False
+                return None
+            time_start = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            with self.tracer.span("wait for press"):
+                early_press = self.wait_for_training_animal()
+            if early_press is None:
+                return None
+        test = self.par.get_tests()[self.curr_test]
+        answer_list = test.answer
         answer = answer_list[self.answer_index]
 
         # Store for logging
@@ -350,57 +1740,140 @@ class Experiment:
         test_repeat = self.test_repeat
         answer_index = self.answer_index
 
-        print("Test:", self.curr_test, " ", answer)
+        logger.info("Test: %s   %s", self.curr_test, answer)
 
-        time_start = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        provided_answer = self.pads.push_wait()  # Wait until one of the pressure pads is selected
+        # The cues of the previous trial end when the next trial starts
+        self.cues.cancel()
+        if early_press is not None:
+            provided_answer = early_press
+        else:
+            time_start = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            if test.trial_cue is not None:
+                self.cues.play(test.trial_cue, answer)
+            if test.response_timeout != float('inf'):
+                self.scheduler.schedule(RESPONSE_TIMEOUT, test.response_timeout)
+            # Wait until one of the pressure pads is selected, or the response window ends
+            with self.tracer.span("wait for press"):
+                provided_answer = self.pads.push_wait(self.scheduler.deadline(RESPONSE_TIMEOUT))
+            self.tracer.instant("detection" if provided_answer is not None else "timeout", provided_answer)
+            self.scheduler.cancel(RESPONSE_TIMEOUT)
+            if provided_answer is None and (self.paused or not self.running):
+                # Interrupted by a pause or stop; the trial is started again after resuming
+                return None
         time_end = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+        if early_press is None and provided_answer is not None and self.identify_animal():
+            # Another animal entered the rig while waiting, and made the press
+            if self.curr_test >= len(self.par.get_tests()):
+                self.pads.wait_release()
+                return None
+            test = self.par.get_tests()[self.curr_test]
+            answer_list = test.answer
+            answer = answer_list[self.answer_index]
+            curr_test = self.curr_test
+            test_repeat = self.test_repeat
+            answer_index = self.answer_index
+
         result = None
-        if provided_answer == answer or answer == ANY:
+        if provided_answer is None:
+            logger.info("No pad pressed within %s seconds", test.response_timeout)
+            result = TIMEOUT
+            self.answer_index = 0
+        elif provided_answer == answer or answer == ANY:
             # if the animal got it right..
-            print("Correct pad pressed", flush=True)
+            logger.info("Correct pad pressed")
             result = CORRECT
             self.nb_correct_answers += 1
             self.answer_index += 1
         elif provided_answer != answer:
-            print("Incorrect pad pressed", flush=True)
+            logger.info("Incorrect pad pressed")
             result = INCORRECT
             self.nb_incorrect_answers += 1
             self.answer_index = 0
 
         if self.answer_index >= len(answer_list):
-            self.test_success(provided_answer)
-        self.pads.wait_release()
+            with self.tracer.span("test success"):
+                self.test_success(provided_answer)
+        elif result != CORRECT:
+            self.progress(False)
+        if provided_answer is not None:
+            with self.tracer.span("wait release"):
+                self.pads.wait_release()
         time_left_pad = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        self.log_result(result,
-                        time_start,
-                        time_end,
-                        time_left_pad,
-                        provided_answer,
-                        answer,
-                        curr_test,
-                        answer_index,
-                        test_repeat)
+        # The next trial starts after the inter-trial interval, which is longer after an incorrect answer
+        delay = test.inter_trial_interval
+        if result == INCORRECT:
+            delay += test.punishment_delay
+        if delay > 0:
+            self.scheduler.schedule(NEXT_TRIAL, delay)
+
+        if self.pads.verbose:
+            logger.debug("Sampling metrics: %s", self.pads.metrics())
+        if self.pads.deadline_misses > self.reported_deadline_misses:
+            logger.warning("%s pressure pad samples were read late during this trial (max. %.1f ms late)",
+                           self.pads.deadline_misses - self.reported_deadline_misses, self.pads.max_lateness * 1000)
+            self.reported_deadline_misses = self.pads.deadline_misses
+
+        with self.tracer.span("log result"):
+            self.log_result(result,
+                            time_start,
+                            time_end,
+                            time_left_pad,
+                            provided_answer,
+                            answer,
+                            curr_test,
+                            answer_index,
+                            test_repeat,
+                            self.pads.waveforms.finish() if self.pads.waveforms is not None else "")
+        if self.summary is not None:
+            self.summary.record(result, curr_test, provided_answer is not None)
+        with self.tracer.span("save animal"):
+            self.save_animal()
+
+        if self.realtime:
+            with self.tracer.span("garbage collection"):
+                gc.collect()
+        return result
 
     def test_success(self, provided_answer):
-        print("Test was successful")
-        self.leds.turn_on(provided_answer)
-        self.conveyors[provided_answer].feed()
-        self.leds.turn_off(provided_answer)
+        logger.info("Test was successful")
+        reward_cue = self.par.get_tests()[self.curr_test].reward_cue
+        if reward_cue is not None:
+            self.cues.cancel()
+            self.cues.play(reward_cue, provided_answer)
+            with self.tracer.span("feed", provided_answer):
+                self.pads.sample_during(self.conveyors[provided_answer].feed)
+        else:
+            with self.tracer.span("led on", provided_answer):
+                self.leds.turn_on(provided_answer)
+            with self.tracer.span("feed", provided_answer):
+                self.pads.sample_during(self.conveyors[provided_answer].feed)
+            with self.tracer.span("led off", provided_answer):
+                self.leds.turn_off(provided_answer)
         self.rew_cnt += 1
         self.answer_index = 0
         self.test_repeat += 1
-        if self.test_repeat >= self.par.get_tests()[self.curr_test].repeat:
-            self.curr_test += 1
+        with self.tracer.span("progression"):
+            self.progress(True)
+
+    def progress(self, correct):
+        # Records a completed trial, and moves to another test when one of the criteria of the test is met
+        next_test = self.progression.record(self.curr_test, correct, self.test_repeat)
+        if next_test != self.curr_test:
+            self.curr_test = next_test
             self.test_repeat = 0
-        if self.curr_test > len(self.par.get_tests()):
+            self.answer_index = 0
+        if self.curr_test >= len(self.par.get_tests()) and self.animal_reader is None:
+            # With an animal reader, the other animals keep training (see trial)
             self.running = False
 
-    def log_result(self, event, time1, time2, time_left_pad, push, correct, curr_test, answer_index, test_repeat):
+    def log_result(self, event, time1, time2, time_left_pad, push, correct, curr_test, answer_index, test_repeat,
+                   waveform=""):
+        if self.results_file is None:
+            return
         # Build a data line and write it to memory
-        data = {"Animal ID": ANIMAL_ID_PLACEHOLDER,
+        data = {"Animal ID": self.animal.animal_id,
                 "Result": event,
                 "Waiting for press": time1,
                 "Press start": time2,
@@ -412,24 +1885,29 @@ class Experiment:
                 "Correct answers": self.nb_correct_answers,
                 "Provided answer": push,
                 "Correct answer": correct,
-                "Left reward count": self.conveyors[LEFT].times_fed,
-                "Middle reward count": self.conveyors[MIDDLE].times_fed,
-                "Right reward count": self.conveyors[RIGHT].times_fed,
-                "Total reward count": self.rew_cnt}
-        data_list = [data[entry] for entry in LOG_ENTRIES]
+                WAVEFORM_ENTRY: waveform,
+                TOTAL_REWARD_COUNT_ENTRY: self.rew_cnt}
+        for name, conveyor in self.conveyors.items():
+            data[REWARD_COUNT_ENTRY.format(name)] = conveyor.times_fed
+        data_list = [data[entry] for entry in self.log_entries]
         data_line = ','.join(map(str, data_list))  # transform list into a comma delineates string of values
-        if not os.path.exists(RESULTS_FILE):
-            header = ','.join(LOG_ENTRIES)
-            with open(RESULTS_FILE, 'w') as fh:
+        if not os.path.exists(self.results_file):
+            header = ','.join(self.log_entries)
+            with open(self.results_file, 'w') as fh:
                 fh.write(header + "\n")
-        with open(RESULTS_FILE, 'a') as fh:
+        with open(self.results_file, 'a') as fh:
             fh.write(data_line + "\n")
+        if self.uploader is not None:
+            self.uploader.add_result(data)  # Only queues the row
 
     def __enter__(self):
         self.leds.setup()
 
     def __exit__(self, exit_type, value, exit_traceback):
+        self.cues.close()
         self.leds.cleanup()
+        self.pads.close()
+        self.tracer.close()
 
 
 def main():
@@ -448,62 +1926,220 @@ def main():
                         default=False,
                         dest='verbose',
                         help='Print additional information to the terminal')
+    parser.add_argument('--log-file',
+                        type=str,
+                        default=LOG_FILE,
+                        help='The file to write the log to')
+    parser.add_argument('--realtime',
+                        action='store_true',
+                        default=False,
+                        help='Pin the program to a single core, request real-time scheduling, and only collect '
+                             'garbage between trials, to reduce the timing jitter of reading the pressure pads')
+    parser.add_argument('--acquisition-process',
+                        action='store_true',
+                        default=False,
+                        dest='acquisition_process',
+                        help='Read the pressure pads in a separate process, so that nothing else the program does '
+                             'can delay reading them')
+    parser.add_argument('--trace',
+                        type=str,
+                        nargs='?',
+                        const=TRACE_FILE,
+                        default=None,
+                        metavar='FILE',
+                        help='Record the timeline of every trial in Chrome trace-event files, which can be opened '
+                             f'with https://ui.perfetto.dev (default file name: {TRACE_FILE})')
+    parser.add_argument('--profile',
+                        action='store_true',
+                        default=False,
+                        help='Profile the whole run, and write the statistics to a file when the program stops. '
+                             'Without it, profiling can be started and stopped with SIGUSR1 (kill -USR1 <pid>)')
+    parser.add_argument('--emulate-hardware',
+                        type=str,
+                        nargs='?',
+                        const='',
+                        default=None,
+                        dest='emulate_hardware',
+                        metavar='FILE',
+                        help='In test mode, make the fake devices take as long as the real ones (see '
+                             'tests/fake/emulator.py), optionally with the latency models of a TOML file')
+    parser.add_argument('--fake-animal-ids',
+                        action='store_true',
+                        default=False,
+                        dest='fake_animal_ids',
+                        help='In test mode, identify animals with the number keys 1-9, like an RFID reader')
     args = parser.parse_args()
+    if args.fake_animal_ids and args.acquisition_process:
+        # The keys are read in the acquisition process, which does not pass the tags on
+        parser.error("--fake-animal-ids cannot be combined with --acquisition-process")
+    log_listener = setup_logging(args.verbose, args.log_file)
+    atexit.register(stop_logging, log_listener)
+
+    profiler = Profiler()
+    profiler.install_signal_handlers()
+    if args.profile:
+        profiler.start()
+    # Writes the statistics when the program stops while profiling (registered last, so it runs before logging stops)
+    atexit.register(profiler.stop)
 
     with open(os.path.join(os.path.dirname(__file__), DEVICE_CONFIGURATION_FILE)) as fh:
         device_configuration = toml.load(fh)
 
-    print('Device configuration:')
+    logger.info('Device configuration:')
     for key, value in device_configuration.items():
-        print(f'- {key}: {value}')
+        logger.info('- %s: %s', key, value)
+
+    channels = read_channel_table(device_configuration)
+    logger.info('Channels:')
+    for channel in channels:
+        logger.info('- %s', channel)
 
     parameters = Parameters(args.configuration)
     parameters.read_from_file()
 
+    animal_reader = None
     if args.test_mode:
         import tests.utilities
         from tests.fake import FakeMotorKit as MotorKit
-        tests.utilities.init(DEVICE_CONFIGURATION_FILE)
+        if args.fake_animal_ids:
+            from tests.fake import FakeRfidReader
+            animal_reader = FakeRfidReader()
+        if args.emulate_hardware is not None:
+            from tests.fake import emulator
+            if args.emulate_hardware:
+                hardware_emulator = emulator.HardwareEmulator.from_file(args.emulate_hardware, quiet=not args.verbose)
+            else:
+                hardware_emulator = emulator.HardwareEmulator(quiet=not args.verbose)
+            emulator.install(hardware_emulator)
+            atexit.register(lambda: logger.info("Emulated hardware: %s", hardware_emulator.metrics()))
+            if args.acquisition_process:
+                logger.warning("The pressure pads are not emulated in the acquisition process")
+        if not args.acquisition_process:
+            tests.utilities.init(channels, animal_keys=args.fake_animal_ids)
     else:
         from adafruit_motorkit import MotorKit
         from adafruit_motor import stepper_prop
-    kit1 = MotorKit(address=device_configuration["motor_kit_1_address"])
-    kit2 = MotorKit(address=device_configuration["motor_kit_2_address"])
-    kits = [kit1, kit2]
+        if "rfid_reader_port" in device_configuration:
+            animal_reader = SerialRfidReader(device_configuration["rfid_reader_port"],
+                                             device_configuration.get("rfid_reader_baudrate", 9600))
+    # Only the motor kits that the channel table refers to
+    kits = {kit: MotorKit(address=device_configuration[motor_kit_key(kit)])
+            for kit in sorted({channel.conveyor_kit for channel in channels})}
 
     conveyors = {
-        LEFT: Conveyor(getattr(kits[device_configuration["left_conveyor_kit"] - 1],
-                               device_configuration["left_conveyor_stepper"]),
-                       steps_to_feed=device_configuration["motor_steps"],
-                       name="left"),
-        MIDDLE: Conveyor(getattr(kits[device_configuration["middle_conveyor_kit"] - 1],
-                                 device_configuration["middle_conveyor_stepper"]),
-                         steps_to_feed=device_configuration["motor_steps"],
-                         name="middle"),
-        RIGHT: Conveyor(getattr(kits[device_configuration["right_conveyor_kit"] - 1],
-                                device_configuration["right_conveyor_stepper"]),
-                        steps_to_feed=device_configuration["motor_steps"],
-                        name="right"),
+        channel.name: Conveyor(getattr(kits[channel.conveyor_kit], channel.conveyor_stepper),
+                               steps_to_feed=device_configuration["motor_steps"],
+                               name=channel.name.lower())
+        for channel in channels
     }
-    pressure_pads = PressurePads(
-        left_pressure_pad_pin=device_configuration["left_pressure_pad_pin"],
-        middle_pressure_pad_pin=device_configuration["middle_pressure_pad_pin"],
-        right_pressure_pad_pin=device_configuration["right_pressure_pad_pin"],
-        left_pressure_pad_threshold=device_configuration["left_pressure_pad_threshold"],
-        middle_pressure_pad_threshold=device_configuration["middle_pressure_pad_threshold"],
-        right_pressure_pad_threshold=device_configuration["right_pressure_pad_threshold"],
-        read_frequency=device_configuration["pressure_pad_read_frequency"],
-        read_window=device_configuration["pressure_pad_read_window"],
-        test_mode=args.test_mode,
-        verbose=args.verbose)
-    leds = Leds(device_configuration["left_led_pin"],
-                device_configuration["middle_led_pin"],
-                device_configuration["right_led_pin"])
-    experiment = Experiment(parameters, pressure_pads, conveyors, leds)
+    pad_settings = pressure_pad_settings(device_configuration)
+    realtime_settings = dict(cpu=device_configuration.get("realtime_cpu"),
+                             priority=device_configuration.get("realtime_priority", 50),
+                             niceness=device_configuration.get("realtime_niceness", -10))
+    if args.acquisition_process:
+        # The acquisition process reads the pressure pads, and is the one that runs in real-time mode
+        from acquisition import RemotePressurePads
+        pressure_pads = RemotePressurePads(channels,
+                                           pad_settings,
+                                           test_mode=args.test_mode,
+                                           keyboard_input=args.test_mode,
+                                           realtime_settings=realtime_settings if args.realtime else None,
+                                           verbose=args.verbose,
+                                           log_file=args.log_file)
+    else:
+        pressure_pads = PressurePads(channels, test_mode=args.test_mode, verbose=args.verbose, **pad_settings)
+    pressure_pads.profiler = profiler
+    if "waveform_folder" in device_configuration:
+        from waveforms import WaveformRecorder
+        recorder = WaveformRecorder(
+            pressure_pads.names,
+            device_configuration["waveform_folder"],
+            pre_samples=device_configuration.get("waveform_pre_samples", 20),
+            post_samples=device_configuration.get("waveform_post_samples", 40))
+        if args.acquisition_process:
+            from acquisition import RingWaveforms
+            pressure_pads.waveforms = RingWaveforms(pressure_pads.ring, recorder)
+        else:
+            pressure_pads.waveforms = recorder
+    if device_configuration.get("signal_monitor", False):
+        if args.acquisition_process:
+            logger.warning("The signal quality is not monitored with --acquisition-process")
+        else:
+            from signal_monitor import SignalMonitor
+            pressure_pads.monitor = SignalMonitor(
+                pressure_pads.names,
+                block_size=device_configuration.get("signal_monitor_block_size", 1024),
+                decimation=device_configuration.get("signal_monitor_decimation", 4),
+                max_noise=device_configuration.get("signal_monitor_max_noise"),
+                saturation_level=device_configuration.get("signal_monitor_saturation_level", 65000),
+                saturation_fraction=device_configuration.get("signal_monitor_saturation_fraction", 0.5),
+                flat_range=device_configuration.get("signal_monitor_flat_range", 0.0),
+                flat_time=device_configuration.get("signal_monitor_flat_time", 300.0),
+                noise_cutoff=device_configuration.get("signal_monitor_noise_cutoff", 0.25),
+                noise_peak_ratio=device_configuration.get("signal_monitor_noise_peak_ratio", 30.0),
+                disabled_channels=[channel.name for channel in channels if channel.pressure_pad_disabled])
+            pressure_pads.monitor.start()
+    leds = Leds(channels, test_mode=args.test_mode)
+    if args.trace is not None:
+        tracer = Tracer(args.trace,
+                        buffer_size=device_configuration.get("trace_buffer_size", 65536),
+                        max_files=device_configuration.get("trace_max_files", 10))
+    else:
+        tracer = NullTracer()
+    animals = AnimalStateStore(device_configuration.get("animal_state_folder"),
+                               parameters.get_tests(),
+                               cache_size=device_configuration.get("animal_state_cache_size", 32))
+    cues = CueEngine(leds,
+                     spin_time=device_configuration.get("cue_spin_time", 0.001),
+                     tolerance=device_configuration.get("cue_tolerance", 0.002))
+    experiment = Experiment(parameters, pressure_pads, conveyors, leds,
+                            realtime=args.realtime,
+                            animals=animals,
+                            animal_reader=animal_reader,
+                            tracer=tracer,
+                            cues=cues)
+
+    if "summary_file" in device_configuration:
+        summary = SessionSummary(conveyors,
+                                 device_configuration["summary_file"],
+                                 interval=device_configuration.get("summary_interval", 5.0))
+        summary.start_writing()
+        atexit.register(summary.close)
+        experiment.summary = summary
+
+    if "upload_url" in device_configuration:
+        from uploader import ResultUploader
+        uploader = ResultUploader(device_configuration["upload_url"],
+                                  spool_folder=device_configuration.get("upload_spool_folder", "upload_spool"),
+                                  rig_id=device_configuration.get("upload_rig_id"),
+                                  batch_size=device_configuration.get("upload_batch_size", 100),
+                                  interval=device_configuration.get("upload_interval", 60.0),
+                                  max_backoff=device_configuration.get("upload_max_backoff", 600.0),
+                                  max_attempts=device_configuration.get("upload_max_attempts", 10))
+        uploader.add_session({"configuration": args.configuration,
+                              "tests": [test.to_dict() for test in parameters.get_tests()],
+                              "channels": [channel.name for channel in channels],
+                              "test_mode": args.test_mode})
+        uploader.start()
+        atexit.register(uploader.close)
+        experiment.uploader = uploader
+
+    if "control_socket" in device_configuration:
+        from control import ControlServer
+        control_server = ControlServer(experiment, device_configuration["control_socket"])
+        control_server.start()
+        atexit.register(control_server.close)
+
+    # All helper threads must be started before this point: threads inherit the scheduling of the thread that starts
+    # them, and only the sampling loop should run with real-time priority on the pinned core
+    if args.realtime and not args.acquisition_process:
+        enable_realtime(**realtime_settings)
+        freeze_garbage_collector()
 
     with experiment:
         while experiment.running:
             experiment.testing_phase()
+            profiler.handle_requests()
 
 
 if __name__ == "__main__":
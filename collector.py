@@ -0,0 +1,103 @@
+"""
+A minimal collector for the results uploaded by rigs (see uploader.py), to test uploading on one machine, or to
+collect the results of a few rigs on a lab computer.
+
+Every batch is stored as <folder>/<rig>/<batch>.json, so a batch that is sent again (for example because the
+response to the first attempt was lost) is only stored once. The result rows of new batches are also appended to
+<folder>/<rig>/results.jsonl. A batch that does not have the expected shape is rejected with status 400 before anything
+is written, which the uploader does not retry.
+
+Usage: python collector.py [--port 8080] [--folder collected]
+"""
+import os
+import re
+import gzip
+import json
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("chipmunk.collector")
+
+
+def safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(name))
+
+
+def check_records(records):
+    # Raises ValueError when the records are not as sent by ResultUploader
+    if not isinstance(records, list):
+        raise ValueError("records is not a list")
+    for record in records:
+        if not isinstance(record, dict) or not isinstance(record.get("type"), str):
+            raise ValueError(f"record without a type: {record!r:.100}")
+        if record["type"] == "result" and not isinstance(record.get("data"), dict):
+            raise ValueError(f"result without data: {record!r:.100}")
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+            rig, batch_id, records = batch["rig"], batch["batch"], batch["records"]
+            check_records(records)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            self.reply(400, {"error": f"invalid batch: {err}"})
+            return
+        new = self.server.store(rig, batch_id, batch)
+        self.reply(200, {"received": len(records), "new": new})
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, message_format, *args):
+        logger.debug(message_format, *args)
+
+
+class Collector(ThreadingHTTPServer):
+    def __init__(self, address=("", 8080), folder="collected"):
+        super().__init__(address, CollectorHandler)
+        self.folder = folder
+        self.lock = threading.Lock()
+
+    def store(self, rig, batch_id, batch):
+        # Returns whether the batch was new
+        folder = os.path.join(self.folder, safe_name(rig))
+        path = os.path.join(folder, safe_name(batch_id) + ".json")
+        rows = "".join(json.dumps(record["data"]) + "\n" for record in batch["records"] if record["type"] == "result")
+        with self.lock:
+            if os.path.exists(path):
+                return False
+            os.makedirs(folder, exist_ok=True)
+            # The batch is stored first, so that a batch sent again never appends its rows twice
+            with open(path + ".tmp", 'w') as fh:
+                json.dump(batch, fh)
+            os.replace(path + ".tmp", path)
+            with open(os.path.join(folder, "results.jsonl"), 'a') as fh:
+                fh.write(rows)
+        logger.info("Received %s records from %s", len(batch["records"]), rig)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--folder', type=str, default="collected")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    collector = Collector(("", args.port), args.folder)
+    logger.info("Collecting results in %s on port %s", args.folder, args.port)
+    collector.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
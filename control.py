@@ -0,0 +1,153 @@
+"""
+Controlling a running experiment through a Unix domain socket.
+
+chipmunk.py serves the socket configured as control_socket in the device configuration. Every request is one line of
+text with a command, and is answered with one line of JSON. The commands are:
+
+- status: the current animal, test and counters, and the achieved pressure pad sampling rate
+- pause: ends the wait for a press (without logging the trial), and waits until resume
+- resume
+- feed <channel>: feeds once from the conveyor of the channel, without counting it as a reward
+- led <channel> [seconds]: turns the LED of the channel on for a while (1 second by default)
+- stop: ends the wait for a press (without logging the trial), and stops the experiment
+
+The socket is served by its own threads, which only read the state of the experiment, or set flags that the
+experiment checks. Feeding and LED tests run on a separate thread, so the reply does not wait for them.
+
+A socket left behind by a previous run is replaced, but only if nothing answers on it: a second instance does not
+take over the socket of a running experiment.
+
+Usage: python control.py [--socket /tmp/chipmunk.sock] status
+"""
+import os
+import json
+import math
+import stat
+import time
+import socket
+import logging
+import argparse
+import threading
+import socketserver
+import toml
+
+logger = logging.getLogger("chipmunk.control")
+
+DEFAULT_SOCKET = "/tmp/chipmunk.sock"
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.execute(line.decode('utf-8', errors='replace').split())
+            self.wfile.write(json.dumps(reply, default=str).encode('utf-8') + b"\n")
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, experiment, socket_path=DEFAULT_SOCKET):
+        self.experiment = experiment
+        self.socket_path = socket_path
+        remove_stale_socket(socket_path)
+        super().__init__(socket_path, ControlHandler)
+        self.thread = threading.Thread(target=self.serve_forever, name="control", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logger.info("Control socket: %s", self.socket_path)
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def execute(self, words):
+        if not words:
+            return {"error": "no command"}
+        command, arguments = words[0], words[1:]
+        try:
+            if command == "status":
+                return self.experiment.status()
+            if command == "pause":
+                self.experiment.pause()
+            elif command == "resume":
+                self.experiment.resume()
+            elif command == "stop":
+                self.experiment.stop()
+            elif command == "feed":
+                conveyor = self.experiment.conveyors[self.channel(arguments)]
+                self.run_in_background(conveyor.feed, manual=True)
+            elif command == "led":
+                channel = self.channel(arguments)
+                duration = float(arguments[1]) if len(arguments) > 1 else 1.0
+                if not 0 <= duration < math.inf:  # Also rejects NaN
+                    raise ValueError(f"the duration must be a finite number of seconds, not {arguments[1]}")
+                self.run_in_background(self.led_test, channel, duration)
+            else:
+                return {"error": f"unknown command: {command}"}
+        except (KeyError, IndexError, ValueError) as err:
+            return {"error": f"invalid arguments for {command}: {err}"}
+        return {"ok": command}
+
+    def channel(self, arguments):
+        # Channel names are matched without regard to case, as they are written in the configuration
+        names = {name.lower(): name for name in self.experiment.conveyors}
+        return names[arguments[0].lower()]
+
+    def led_test(self, channel, duration):
+        self.experiment.leds.turn_on(channel)
+        try:
+            time.sleep(duration)
+        finally:
+            self.experiment.leds.turn_off(channel)
+
+    @staticmethod
+    def run_in_background(function, *args, **kwargs):
+        threading.Thread(target=function, args=args, kwargs=kwargs, daemon=True).start()
+
+
+def remove_stale_socket(socket_path):
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError(f"{socket_path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)  # Left behind by a previous run
+            return
+    raise RuntimeError(f"Another experiment is serving the control socket {socket_path}")
+
+
+def send_command(command, socket_path=DEFAULT_SOCKET, timeout=5.0):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(command.encode('utf-8') + b"\n")
+        with connection.makefile('rb') as reply:
+            return json.loads(reply.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', nargs='+', help='status, pause, resume, feed <channel>, led <channel> [seconds] '
+                                                   'or stop')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='The control socket (by default control_socket from the device configuration)')
+    args = parser.parse_args()
+
+    socket_path = args.socket
+    if socket_path is None:
+        import chipmunk as cm
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), cm.DEVICE_CONFIGURATION_FILE)) as fh:
+            socket_path = toml.load(fh).get("control_socket", DEFAULT_SOCKET)
+    print(json.dumps(send_command(" ".join(args.command), socket_path), indent=2))
+
+
+if __name__ == "__main__":
+    main()
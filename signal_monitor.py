@@ -0,0 +1,200 @@
+"""
+Monitoring the quality of the pressure pad signals, to notice faulty pads before the animals do.
+
+PressurePads hands every sample to SignalMonitor.add, which only copies it into a preallocated block. When a block is
+full, it is swapped with a second block and analysed on a background thread, so the analysis never delays sampling
+(if the thread is still busy with the previous block, the new block is skipped). For every block, and for all
+channels at once:
+
+- noise: the rolling (exponentially weighted over blocks) variance of the noise, estimated from the median absolute
+  deviation of the differences between consecutive samples, so that the few large steps of a press do not count.
+  An alert is raised when its standard deviation exceeds max_noise.
+- saturation: the fraction of samples at or above saturation_level. An alert is raised when it exceeds
+  saturation_fraction, which is how a stuck or shorted pad reads.
+- flat line: a pad whose values do not vary by more than flat_range for flat_time seconds, which is how a
+  disconnected pad reads.
+- spectrum: the block is decimated (averaged over groups of decimation samples), and its power spectrum is computed
+  with one FFT. Above noise_cutoff (a fraction of the Nyquist frequency of the decimated block), the strongest
+  frequency is compared with the median of that band. White sensor noise spreads its power evenly, and its strongest
+  frequency stays within about 25 times the median, while interference at one frequency, for example when the motors
+  couple into a channel, stands out far more. An alert is raised when the ratio exceeds noise_peak_ratio. The FFT
+  needs evenly spaced samples, so a block in which the pads were read at more than one rate (at the idle and at the
+  normal frequency, see PressurePads) keeps the spectrum of the previous block.
+
+Disabled pressure pads always read 0, so they are not monitored.
+
+The analysis thread is started with start().
+
+Alerts are logged as warnings when they are raised and as information when they clear, and are part of the metrics.
+"""
+import time
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger("chipmunk.monitor")
+
+NOISE = "noise"
+SATURATION = "saturation"
+FLAT_LINE = "flat line"
+SPECTRAL_NOISE = "spectral noise"
+
+
+class SignalMonitor:
+    def __init__(self, channel_names, block_size=1024, decimation=4, smoothing=0.2, max_noise=None,
+                 saturation_level=65000, saturation_fraction=0.5, flat_range=0.0, flat_time=300.0,
+                 noise_cutoff=0.25, noise_peak_ratio=30.0, disabled_channels=()):
+        # The samples hold the values of all channels, but only the ones that are not disabled are kept
+        channel_names = list(channel_names)
+        self.channels = np.array([i for i, name in enumerate(channel_names) if name not in disabled_channels],
+                                 dtype=int)
+        self.names = [channel_names[i] for i in self.channels]
+        nb_channels = len(self.names)
+        self.block_size = block_size - block_size % decimation
+        self.decimation = decimation
+        self.smoothing = smoothing  # The weight of the newest block in the rolling noise variance
+        self.max_noise = max_noise
+        self.saturation_level = saturation_level
+        self.saturation_fraction = saturation_fraction
+        self.flat_range = flat_range
+        self.flat_time = flat_time
+        self.noise_cutoff = noise_cutoff
+        self.noise_peak_ratio = noise_peak_ratio
+
+        # Two blocks: one is filled by the sampling loop, while the other is analysed
+        self.times = [np.zeros(self.block_size), np.zeros(self.block_size)]
+        self.values = [np.zeros((self.block_size, nb_channels)), np.zeros((self.block_size, nb_channels))]
+        self.filling = 0
+        self.count = 0
+        self.ready = threading.Event()  # Set when the other block is ready to be analysed
+        self.busy = False
+        self.skipped_blocks = 0
+        self.mixed_rate_blocks = 0  # Blocks without a spectrum, see analyse
+        self.thread = threading.Thread(target=self.run, name="signal monitor", daemon=True)
+        self.closed = False
+
+        # The results, per channel
+        self.blocks = 0
+        self.noise_variance = np.zeros(nb_channels)
+        self.saturation = np.zeros(nb_channels)
+        self.flat_since = np.full(nb_channels, np.nan)
+        self.peak_ratio = np.zeros(nb_channels)
+        self.dominant_frequency = np.zeros(nb_channels)
+        self.sample_rate = 0.0
+        self.alerts = {name: set() for name in self.names}
+
+    def add(self, sample_time, values):
+        # Called for every sample
+        self.times[self.filling][self.count] = sample_time
+        np.take(values, self.channels, out=self.values[self.filling][self.count], mode='clip')  # Not buffered
+        self.count += 1
+        if self.count == self.block_size:
+            self.count = 0
+            if self.busy:
+                self.skipped_blocks += 1
+                return
+            self.busy = True
+            self.filling = 1 - self.filling
+            self.ready.set()
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            if self.closed:
+                return
+            block = 1 - self.filling
+            try:
+                self.analyse(self.times[block], self.values[block])
+            except Exception:
+                logger.exception("Analysing the pressure pad signals failed")
+            self.busy = False
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def analyse(self, times, values):
+        duration = times[-1] - times[0]
+        self.sample_rate = (len(times) - 1) / duration if duration > 0 else 0.0
+
+        # Noise: for normally distributed noise, the standard deviation is 1.4826 times the median absolute deviation,
+        # and the variance of the differences is twice the variance of the noise
+        differences = np.diff(values, axis=0)
+        deviations = np.abs(differences - np.median(differences, axis=0))
+        noise_variance = (1.4826 * np.median(deviations, axis=0)) ** 2 / 2
+        if self.blocks == 0:
+            self.noise_variance[:] = noise_variance
+        else:
+            self.noise_variance += self.smoothing * (noise_variance - self.noise_variance)
+
+        self.saturation[:] = np.mean(values >= self.saturation_level, axis=0)
+
+        flat = np.ptp(values, axis=0) <= self.flat_range
+        self.flat_since[~flat] = np.nan
+        self.flat_since[flat & np.isnan(self.flat_since)] = times[0]
+
+        # The spectrum is only computed for evenly spaced samples. Single late samples do not count, but a change
+        # between the idle and the normal sampling rate does.
+        low, high = np.percentile(np.diff(times), [10, 90])
+        if high > 1.5 * low:
+            self.mixed_rate_blocks += 1
+        else:
+            self.analyse_spectrum(values)
+
+        now = times[-1]
+        for i, name in enumerate(self.names):
+            self.update_alert(name, NOISE, self.max_noise is not None and
+                              np.sqrt(self.noise_variance[i]) > self.max_noise,
+                              "noise %.1f", np.sqrt(self.noise_variance[i]))
+            self.update_alert(name, SATURATION, self.saturation[i] > self.saturation_fraction,
+                              "%.0f%% of the samples saturated", self.saturation[i] * 100)
+            self.update_alert(name, FLAT_LINE, now - self.flat_since[i] >= self.flat_time,
+                              "flat for %.0f seconds", now - self.flat_since[i])
+            self.update_alert(name, SPECTRAL_NOISE, self.peak_ratio[i] > self.noise_peak_ratio,
+                              "%.1f Hz at %.0f times the noise floor", self.dominant_frequency[i], self.peak_ratio[i])
+        self.blocks += 1  # Last, so that the results of a block are complete once it is counted
+
+    def analyse_spectrum(self, values):
+        # Spectrum of the decimated block, without its mean
+        decimated = values.reshape(-1, self.decimation, values.shape[1]).mean(axis=1)
+        decimated -= decimated.mean(axis=0)
+        power = np.abs(np.fft.rfft(decimated, axis=0)) ** 2
+        cutoff = max(1, int(np.ceil(self.noise_cutoff * (len(power) - 1))))
+        band = power[cutoff:]
+        peaks = cutoff + np.argmax(band, axis=0)
+        columns = np.arange(power.shape[1])
+        peak_power = power[peaks, columns]
+        floor = np.median(band, axis=0)
+        np.divide(peak_power, floor, out=self.peak_ratio, where=floor > 0)
+        self.peak_ratio[floor <= 0] = np.where(peak_power[floor <= 0] > 0, np.inf, 0.0)
+        # A strongest frequency at the lower edge of the band is the tail of slower changes, such as presses
+        self.peak_ratio[peak_power <= power[peaks - 1, columns]] = 0.0
+        frequencies = np.fft.rfftfreq(len(decimated), d=self.decimation / self.sample_rate if self.sample_rate else 1.0)
+        self.dominant_frequency[:] = frequencies[peaks]
+
+    def update_alert(self, name, alert, active, message, *args):
+        alerts = self.alerts[name]
+        if active and alert not in alerts:
+            alerts.add(alert)
+            logger.warning("%s pressure pad: %s (" + message + ")", name, alert, *args)
+        elif not active and alert in alerts:
+            alerts.discard(alert)
+            logger.info("%s pressure pad: %s cleared", name, alert)
+
+    def metrics(self):
+        now = time.monotonic()
+        return {"blocks": self.blocks,
+                "skipped_blocks": self.skipped_blocks,
+                "mixed_rate_blocks": self.mixed_rate_blocks,
+                "sample_rate": self.sample_rate,
+                "channels": {name: {"noise": float(np.sqrt(self.noise_variance[i])),
+                                    "saturation": float(self.saturation[i]),
+                                    "flat_time": 0.0 if np.isnan(self.flat_since[i]) else now - self.flat_since[i],
+                                    "peak_ratio": float(self.peak_ratio[i]),
+                                    "dominant_frequency": float(self.dominant_frequency[i]),
+                                    "alerts": sorted(self.alerts[name])}
+                             for i, name in enumerate(self.names)}}
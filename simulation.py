@@ -0,0 +1,369 @@
+"""
+Simulated animals, for evaluating training schedules before using them with real animals.
+
+A simulation runs the normal Experiment, but with simulated pressure pads, LEDs and conveyors, and on a virtual clock:
+waiting for a press or for the end of an inter-trial interval advances the clock instead of sleeping, so a session of
+hours takes a fraction of a second. LED cues are not played, as the animal policies do not react to them. The presses
+come from an animal policy:
+
+- Animal chooses a pad at random, with preferences that it learns from the rewards (a simple reinforcement-learning
+  model with a learning rate, a side bias and an exploration temperature), with random response times and press
+  durations, and sometimes does not respond at all.
+- ScriptedAnimal presses the pads in a fixed order, which is useful for testing schedules and the experiment itself.
+
+Many independent sessions of every schedule are run on a process pool, and summarized by how quickly the last test of
+the schedule is learned.
+
+Usage: python simulation.py config_middle_left_pad.toml [config_any_pad.toml ...] [--sessions 1000] [--workers 8]
+"""
+import os
+import math
+import time
+import logging
+import argparse
+import multiprocessing
+import numpy as np
+import toml
+import chipmunk as cm
+
+logger = logging.getLogger("chipmunk.simulation")
+
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+
+
+class Animal:
+    def __init__(self, channel_names, rng, learning_rate=0.1, punishment_rate=0.05, trace_decay=0.5, temperature=0.3,
+                 side_bias=None, response_time=3.0, response_time_spread=0.5, press_duration=0.8,
+                 press_duration_spread=0.5, engagement=0.95):
+        self.channel_names = channel_names
+        self.rng = rng
+        self.learning_rate = learning_rate  # How much a reward strengthens the presses that led to it
+        self.punishment_rate = punishment_rate  # How much a press without reward weakens it
+        # A reward strengthens earlier presses less: every press before the last one by this factor
+        self.trace_decay = trace_decay
+        self.temperature = temperature  # Higher values make the choices more random
+        # A constant preference per pad, added to the learned preference
+        self.bias = np.array([(side_bias or {}).get(name, 0.0) for name in channel_names])
+        # Response times and press durations are lognormal, with the given median (seconds) and spread
+        self.response_time = response_time
+        self.response_time_spread = response_time_spread
+        self.press_duration = press_duration
+        self.press_duration_spread = press_duration_spread
+        self.engagement = engagement  # The probability of responding in a trial at all
+
+        # The learned value of every pad, given the previous press since the last reward (the context)
+        self.values = {}
+        self.context = None
+        self.chain = []  # The (context, choice) of the presses since the last reward
+
+    def respond(self):
+        # Returns the pad to press (or None to not respond), the time until the press and the duration of the press.
+        # The random numbers of a response are drawn at once, as numpy calls cost more than the arithmetic.
+        normals = self.rng.standard_normal(2)
+        uniforms = self.rng.random(2)
+        latency = self.response_time * math.exp(self.response_time_spread * normals[0])
+        duration = self.press_duration * math.exp(self.press_duration_spread * normals[1])
+        if uniforms[0] >= self.engagement:
+            return None, latency, duration
+        values = self.values.get(self.context)
+        if values is None:
+            values = self.values[self.context] = np.zeros(len(self.channel_names))
+        preferences = (values + self.bias) / self.temperature
+        cumulative = np.cumsum(np.exp(preferences - preferences.max()))
+        choice = int(np.searchsorted(cumulative, uniforms[1] * cumulative[-1], side='right'))
+        return self.channel_names[min(choice, len(self.channel_names) - 1)], latency, duration
+
+    def pressed(self, choice):
+        if self.chain:
+            # The previous press was not rewarded
+            context, previous = self.chain[-1]
+            values = self.values[context]
+            values[previous] -= self.punishment_rate * (1 + values[previous])
+        choice = self.channel_names.index(choice)
+        self.chain.append((self.context, choice))
+        self.context = choice
+
+    def rewarded(self):
+        rate = self.learning_rate
+        for context, choice in reversed(self.chain):
+            values = self.values[context]
+            values[choice] += rate * (1 - values[choice])
+            rate *= self.trace_decay
+        self.chain = []
+        self.context = None
+
+    def timed_out(self):
+        self.context = None
+
+
+class ScriptedAnimal:
+    def __init__(self, presses, response_time=1.0, press_duration=0.5):
+        # The presses are repeated in order; None does not respond in that trial
+        self.presses = presses
+        self.index = 0
+        self.response_time = response_time
+        self.press_duration = press_duration
+
+    def respond(self):
+        choice = self.presses[self.index % len(self.presses)]
+        self.index += 1
+        return choice, self.response_time, self.press_duration
+
+    def pressed(self, choice):
+        pass
+
+    def rewarded(self):
+        pass
+
+    def timed_out(self):
+        pass
+
+
+class SimulatedPressurePads:
+    """Offers the interface of PressurePads, for presses made by a simulated animal on a virtual clock."""
+
+    def __init__(self, animal, clock):
+        self.animal = animal
+        self.clock = clock
+        self.push = None
+        self.interrupted = False
+        self.waveforms = None
+        self.release_time = 0.0
+        self.verbose = False
+        self.deadline_misses = 0
+        self.max_lateness = 0.0
+
+    def metrics(self):
+        return {}
+
+    def wait_release(self, deadline=None):
+        if deadline is not None and self.release_time > deadline:
+            self.clock.now = max(self.clock.now, deadline)
+            return False
+        self.clock.now = max(self.clock.now, self.release_time)
+        self.push = None
+        return True
+
+    def push_wait(self, deadline=None):
+        if not self.wait_release(deadline):
+            return None
+        while True:
+            choice, latency, duration = self.animal.respond()
+            if deadline is not None and (choice is None or self.clock.now + latency > deadline):
+                self.clock.now = max(self.clock.now, deadline)
+                self.animal.timed_out()
+                return None
+            self.clock.sleep(latency)
+            if choice is not None:
+                break
+            # Without a response window, the animal that did not respond comes back after a while
+        self.push = choice
+        self.release_time = self.clock.now + duration
+        self.animal.pressed(choice)
+        return choice
+
+    def sample_during(self, function):
+        return function()
+
+    def interrupt(self):
+        self.interrupted = True
+
+    def close(self):
+        pass
+
+
+class SimulatedConveyor:
+    def __init__(self, name, animal, feed_time=1.0, clock=None):
+        self.name = name
+        self.animal = animal
+        self.feed_time = feed_time
+        self.clock = clock
+        self.times_fed = 0
+
+    def feed(self):
+        self.times_fed += 1
+        self.animal.rewarded()
+        if self.clock is not None:
+            self.clock.sleep(self.feed_time)
+
+
+class SimulatedLeds:
+    def __init__(self, channel_names=cm.DEFAULT_CHANNELS):
+        self.id_to_pin = {name: pin for pin, name in enumerate(channel_names)}
+        self.lit = set()
+
+    def turn_on(self, led_id):
+        self.lit.add(led_id)
+
+    def turn_off(self, led_id):
+        self.lit.discard(led_id)
+
+    def turn_all_on(self):
+        pass
+
+    def turn_all_off(self):
+        pass
+
+    def setup(self):
+        pass
+
+    def cleanup(self):
+        pass
+
+
+class SimulatedParameters(cm.Parameters):
+    def __init__(self, tests):
+        super().__init__(config_file=None)
+        self.tests = tests
+
+
+def run_session(tests, channel_names, seed, animal_settings=None, animal=None, max_trials=2000, max_hours=24.0,
+                criterion=0.8, criterion_window=50):
+    """Runs one simulated session, and returns a dict with how quickly the last test of the schedule was learned.
+
+    The last test is learned when the accuracy over the last criterion_window completed trials of it reaches the
+    criterion. Trials are counted from the start of the session; times are in virtual hours."""
+    clock = VirtualClock()
+    if animal is None:
+        animal = Animal(channel_names, np.random.default_rng(seed), **(animal_settings or {}))
+    pads = SimulatedPressurePads(animal, clock)
+    conveyors = {name: SimulatedConveyor(name.lower(), animal, clock=clock) for name in channel_names}
+    experiment = cm.Experiment(SimulatedParameters(tests), pads, conveyors, SimulatedLeds(channel_names),
+                               progression_file=None,
+                               results_file=None,
+                               scheduler=cm.DeadlineScheduler(clock.monotonic, clock.sleep))
+    window = cm.RollingWindow(criterion_window)
+    last_test = len(tests) - 1
+    trials = 0
+    learned_trials = None
+    learned_hours = None
+    reached_last_test = None
+    with experiment:
+        while experiment.running and trials < max_trials and clock.now < max_hours * 3600:
+            curr_test = experiment.curr_test
+            rewards = experiment.rew_cnt
+            result = experiment.testing_phase()
+            if result is None:
+                break
+            completed = experiment.rew_cnt > rewards or result != cm.CORRECT
+            if not completed:
+                continue
+            trials += 1
+            if curr_test == last_test:
+                if reached_last_test is None:
+                    reached_last_test = trials
+                window.add(experiment.rew_cnt > rewards)
+                if window.full and window.accuracy >= criterion:
+                    learned_trials = trials
+                    learned_hours = clock.now / 3600
+                    break
+    return {"learned": learned_trials is not None,
+            "trials_to_criterion": learned_trials,
+            "hours_to_criterion": learned_hours,
+            "trials_to_last_test": reached_last_test,
+            "trials": trials,
+            "rewards": experiment.rew_cnt,
+            "hours": clock.now / 3600}
+
+
+def run_sessions(task):
+    # Runs a batch of sessions in a worker process
+    tests, channel_names, seeds, session_settings = task
+    logging.getLogger("chipmunk").setLevel(logging.WARNING)
+    return [run_session(tests, channel_names, seed, **session_settings) for seed in seeds]
+
+
+def summarize(results):
+    learned = [result for result in results if result["learned"]]
+    trials = np.array([result["trials_to_criterion"] for result in learned])
+    hours = np.array([result["hours_to_criterion"] for result in learned])
+    summary = {"sessions": len(results), "learned_fraction": len(learned) / len(results)}
+    if learned:
+        summary.update(trials_median=float(np.median(trials)),
+                       trials_p90=float(np.percentile(trials, 90)),
+                       hours_median=float(np.median(hours)),
+                       hours_p90=float(np.percentile(hours, 90)))
+    return summary
+
+
+def simulate_schedule(tests, channel_names, sessions, seed=0, workers=None, batch_size=50, **session_settings):
+    seeds = list(range(seed, seed + sessions))
+    tasks = [(tests, channel_names, seeds[i:i + batch_size], session_settings)
+             for i in range(0, len(seeds), batch_size)]
+    with multiprocessing.Pool(workers) as pool:
+        results = [result for batch in pool.imap(run_sessions, tasks) for result in batch]
+    return results
+
+
+def parse_side_bias(values):
+    side_bias = {}
+    for value in values:
+        name, bias = value.split('=')
+        side_bias[name] = float(bias)
+    return side_bias
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('configurations', metavar='C', type=str, nargs='+',
+                        help='The configuration files (training schedules) to simulate')
+    parser.add_argument('--sessions', type=int, default=1000, help='Number of sessions per schedule')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-trials', type=int, default=2000, help='Maximum number of trials per session')
+    parser.add_argument('--criterion', type=float, default=0.8,
+                        help='The accuracy over the last --criterion-window trials of the last test, at which the '
+                             'schedule is learned')
+    parser.add_argument('--criterion-window', type=int, default=50)
+    parser.add_argument('--learning-rate', type=float, default=0.1)
+    parser.add_argument('--punishment-rate', type=float, default=0.05)
+    parser.add_argument('--trace-decay', type=float, default=0.5)
+    parser.add_argument('--temperature', type=float, default=0.3)
+    parser.add_argument('--side-bias', type=str, nargs='*', default=[], metavar='PAD=BIAS',
+                        help='A constant preference for pads, for example Left=0.5')
+    parser.add_argument('--engagement', type=float, default=0.95)
+    args = parser.parse_args()
+    log_listener = cm.setup_logging(log_file=None)
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), cm.DEVICE_CONFIGURATION_FILE)) as fh:
+        device_configuration = toml.load(fh)
+    channel_names = [channel.name for channel in cm.read_channel_table(device_configuration)]
+    animal_settings = dict(learning_rate=args.learning_rate,
+                           punishment_rate=args.punishment_rate,
+                           trace_decay=args.trace_decay,
+                           temperature=args.temperature,
+                           side_bias=parse_side_bias(args.side_bias),
+                           engagement=args.engagement)
+
+    print(f"{'schedule':<32}{'sessions':>9}{'learned':>9}{'trials (median)':>17}{'trials (p90)':>14}"
+          f"{'hours (median)':>16}{'sessions/min':>14}")
+    for configuration in args.configurations:
+        parameters = cm.Parameters(configuration)
+        parameters.read_from_file()
+        start = time.monotonic()
+        results = simulate_schedule(parameters.get_tests(), channel_names, args.sessions,
+                                    seed=args.seed,
+                                    workers=args.workers,
+                                    animal_settings=animal_settings,
+                                    max_trials=args.max_trials,
+                                    criterion=args.criterion,
+                                    criterion_window=args.criterion_window)
+        rate = len(results) / (time.monotonic() - start) * 60
+        summary = summarize(results)
+        print(f"{os.path.basename(configuration):<32}{summary['sessions']:>9}{summary['learned_fraction']:>9.0%}"
+              f"{summary.get('trials_median', float('nan')):>17.0f}{summary.get('trials_p90', float('nan')):>14.0f}"
+              f"{summary.get('hours_median', float('nan')):>16.2f}{rate:>14.0f}")
+    cm.stop_logging(log_listener)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures how work in the experiment process delays reading the pressure pads, with and without the acquisition
+process.
+
+In both modes the main thread keeps doing pure Python work (formatting, bookkeeping and garbage, like writing
+results and logging do), which holds the GIL. In the "thread" mode the pads are read by PressurePads in a thread of
+the same process, so every sample has to wait for the GIL. In the "process" mode they are read by the acquisition
+process (chipmunk.py --acquisition-process), and the lateness of every sample is read back from the shared sample ring.
+
+Usage: python tests/benchmarks/acquisition_benchmark.py [--seconds 30]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import chipmunk as cm  # noqa: E402
+import acquisition  # noqa: E402
+
+
+def pad_settings(device_configuration):
+    return dict(
+        read_frequency=device_configuration["pressure_pad_read_frequency"],
+        read_window=device_configuration["pressure_pad_read_window"],
+        detector=device_configuration.get("pressure_pad_detector", cm.MOVING_AVERAGE),
+        detector_options=cm.detector_options(device_configuration),
+        deadline_tolerance=device_configuration.get("pressure_pad_deadline_tolerance", 0.002))
+
+
+def busy_work(seconds):
+    garbage = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        garbage.append(" ".join(str(i * i) for i in range(200)))
+        if len(garbage) > 1000:
+            garbage = []
+
+
+def measure_thread(channels, settings, seconds):
+    pads = cm.PressurePads(channels, test_mode=True, **settings)
+    lateness = []
+    stop = threading.Event()
+
+    def sample():
+        pads.push_init()
+        while not stop.is_set():
+            pads.push_poll()
+            lateness.append(pads.lateness)
+
+    thread = threading.Thread(target=sample)
+    thread.start()
+    busy_work(seconds)
+    stop.set()
+    thread.join()
+    return np.array(lateness[1:]) * 1000, pads.metrics()
+
+
+def measure_process(channels, settings, seconds):
+    pads = acquisition.RemotePressurePads(channels, settings, test_mode=True)
+    try:
+        pads.read_samples()
+        busy_work(seconds)
+        samples = pads.read_samples()
+        time.sleep(2 * acquisition.METRICS_INTERVAL)
+        metrics = pads.metrics()
+    finally:
+        pads.close()
+    return samples[1:, acquisition.SAMPLE_LATENESS] * 1000, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=30)
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", cm.DEVICE_CONFIGURATION_FILE)) as fh:
+        device_configuration = toml.load(fh)
+    channels = cm.read_channel_table(device_configuration)
+    settings = pad_settings(device_configuration)
+
+    results = {"thread": measure_thread(channels, settings, args.seconds),
+               "process": measure_process(channels, settings, args.seconds)}
+
+    print(f"{'mode':<10}{'samples':>9}{'mean (ms)':>11}{'p99 (ms)':>10}{'max (ms)':>10}{'misses':>8}{'rate (Hz)':>11}")
+    for mode, (lateness, metrics) in results.items():
+        print(f"{mode:<10}{len(lateness):>9}{lateness.mean():>11.3f}{np.percentile(lateness, 99):>10.3f}"
+              f"{lateness.max():>10.3f}{metrics['deadline_misses']:>8.0f}{metrics['achieved_rate']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compares fixed-rate and adaptive sampling of the pressure pads, using the fake analog inputs.
+
+For each mode, the pads are first left idle to measure the CPU time used per second of wall time. Presses are then
+simulated from a background thread at random moments, to measure the time from the start of a press until the pads
+report it. Finally the achieved sampling rates reported by PressurePads.metrics are printed.
+
+Usage: python tests/benchmarks/adaptive_sampling_benchmark.py [--idle-seconds 20] [--presses 50] [--idle-frequency 25]
+"""
+import os
+import sys
+import time
+import threading
+import argparse
+import numpy as np
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import chipmunk as cm  # noqa: E402
+from tests.fake.fake_analog_in import ANALOG_CHANNELS  # noqa: E402
+
+
+def create_pads(device_configuration, idle_frequency):
+    return cm.PressurePads(
+        cm.read_channel_table(device_configuration),
+        read_frequency=device_configuration["pressure_pad_read_frequency"],
+        read_window=device_configuration["pressure_pad_read_window"],
+        test_mode=True,
+        detector=device_configuration.get("pressure_pad_detector", cm.MOVING_AVERAGE),
+        detector_options=cm.detector_options(device_configuration),
+        idle_frequency=idle_frequency,
+        idle_margin=device_configuration.get("pressure_pad_idle_margin", 0.5),
+        baseline_rise_time=device_configuration.get("pressure_pad_baseline_rise_time"),
+        baseline_fall_time=device_configuration.get("pressure_pad_baseline_fall_time"))
+
+
+def measure_idle(pads, seconds):
+    pads.reset_metrics()
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    while time.monotonic() - wall_start < seconds:
+        pads.push_poll()
+    return (time.process_time() - cpu_start) / (time.monotonic() - wall_start)
+
+
+def measure_latency(pads, pin, presses, rng):
+    latencies = []
+    for _ in range(presses):
+        pads.wait_release()
+        # Let the pads settle into the idle rate before pressing at a random moment
+        press_time = []
+
+        def press():
+            ANALOG_CHANNELS[pin].set_value(10000)
+            press_time.append(time.monotonic())
+
+        timer = threading.Timer(rng.uniform(0.5, 1.0), press)
+        timer.start()
+        while pads.push_poll():
+            pass
+        latencies.append(time.monotonic() - press_time[0])
+        timer.join()
+        ANALOG_CHANNELS[pin].set_value(0)
+    return np.array(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--idle-seconds', type=float, default=20)
+    parser.add_argument('--presses', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--idle-frequency', type=float, default=25,
+                        help="used when the device configuration does not set pressure_pad_idle_frequency")
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", cm.DEVICE_CONFIGURATION_FILE)) as fh:
+        device_configuration = toml.load(fh)
+    read_frequency = device_configuration["pressure_pad_read_frequency"]
+    idle_frequency = device_configuration.get("pressure_pad_idle_frequency", args.idle_frequency)
+    pin = cm.read_channel_table(device_configuration)[0].pressure_pad_pin
+
+    rng = np.random.default_rng(args.seed)
+    for name, frequency in [("fixed", read_frequency), ("adaptive", idle_frequency)]:
+        pads = create_pads(device_configuration, frequency)
+        cpu = measure_idle(pads, args.idle_seconds)
+        idle_metrics = pads.metrics()
+        pads.reset_metrics()
+        latencies = measure_latency(pads, pin, args.presses, rng) * 1000
+        press_metrics = pads.metrics()
+        print(f"{name} sampling ({read_frequency} Hz, idle {frequency} Hz)")
+        print(f"  idle CPU use: {cpu * 100:.2f}% of one core, "
+              f"achieved idle rate {idle_metrics['achieved_rate']:.1f} Hz")
+        print(f"  press detection latency: mean {latencies.mean():.1f} ms, "
+              f"p95 {np.percentile(latencies, 95):.1f} ms, max {latencies.max():.1f} ms")
+        print(f"  achieved rates while pressing: burst {press_metrics['burst_rate']:.1f} Hz, "
+              f"idle {press_metrics['idle_rate']:.1f} Hz, deadline misses {press_metrics['deadline_misses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares the onset latency and false positives of the pressure pad detectors.
+
+By default the detectors are run on synthetic recordings of noisy pads, based on the pressure-pad calibration in the
+device configuration. A recording made with tests/hardware_tests/read_analog_test.py (values.csv) can be passed with
+--recording. Such a recording has no known presses, so every detection in it counts as a false positive.
+
+Usage: python tests/benchmarks/detector_benchmark.py [--recording values.csv] [--seconds 600] [--seed 0]
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import chipmunk as cm  # noqa: E402
+
+PADS = ["left", "middle", "right"]
+# Values measured with weights on the pads, and the standard deviation of the noise (see device_configuration.toml)
+PRESS_LEVEL = {"left": 128, "middle": 41, "right": 327}
+NOISE = {"left": 14, "middle": 5, "right": 39}
+
+
+def synthetic_recording(pad, seconds, frequency, rng):
+    n = int(seconds * frequency)
+    values = rng.normal(0, NOISE[pad], n)
+    # Occasional spikes, for example caused by the motors
+    spikes = rng.random(n) < 0.002
+    values[spikes] += rng.normal(0, 3 * PRESS_LEVEL[pad], spikes.sum())
+    onsets = []
+    t = int(rng.uniform(2, 10) * frequency)
+    while t < n - 3 * frequency:
+        duration = int(rng.uniform(0.3, 2.0) * frequency)
+        ramp = min(duration, int(rng.integers(1, 6)))
+        level = PRESS_LEVEL[pad] * rng.uniform(0.9, 1.5)
+        values[t:t + ramp] += np.linspace(level / ramp, level, ramp)
+        values[t + ramp:t + duration] += level
+        onsets.append((t, t + duration))
+        t += duration + int(rng.uniform(2, 10) * frequency)
+    return np.clip(values, 0, None), onsets
+
+
+def run_detector(detector, recordings):
+    # Feed the recordings of all pads to the detector at once, one sample at a time, like PressurePads does
+    length = min(len(values) for values, _ in recordings)
+    samples = np.stack([values[:length] for values, _ in recordings], axis=1)
+    states = np.zeros(samples.shape, dtype=bool)
+    for i, sample in enumerate(samples):
+        pressed = detector.update(sample)
+        if pressed is not None:
+            states[i] = pressed
+    return states
+
+
+def evaluate(states, presses, frequency):
+    detections = np.flatnonzero(states[1:] & ~states[:-1]) + 1
+    latencies = []
+    false_positives = 0
+    matched = set()
+    for detection in detections:
+        for i, (start, end) in enumerate(presses):
+            if start <= detection < end + frequency // 10 and i not in matched:
+                latencies.append((detection - start) / frequency)
+                matched.add(i)
+                break
+        else:
+            false_positives += 1
+    return latencies, false_positives, len(presses) - len(matched)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recording', type=str, default=None,
+                        help='A csv file with left,middle,right values recorded without presses')
+    parser.add_argument('--seconds', type=float, default=600, help='Length of the synthetic recordings')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", cm.DEVICE_CONFIGURATION_FILE)) as fh:
+        device_configuration = toml.load(fh)
+    frequency = device_configuration["pressure_pad_read_frequency"]
+    read_window = device_configuration["pressure_pad_read_window"]
+    options = cm.detector_options(device_configuration)
+
+    rng = np.random.default_rng(args.seed)
+    if args.recording is not None:
+        recorded = np.loadtxt(args.recording, delimiter=',', ndmin=2)
+        recordings = {pad: (recorded[:, i], []) for i, pad in enumerate(PADS)}
+    else:
+        recordings = {pad: synthetic_recording(pad, args.seconds, frequency, rng) for pad in PADS}
+
+    print(f"{'detector':<16}{'pad':<8}{'presses':>8}{'missed':>8}{'false pos.':>12}"
+          f"{'mean onset (ms)':>17}{'p95 onset (ms)':>16}")
+    thresholds = [device_configuration[f"{pad}_pressure_pad_threshold"] for pad in PADS]
+    for detector_name in cm.DETECTORS:
+        detector = cm.create_detector(detector_name, thresholds, read_window, **options)
+        states = run_detector(detector, [recordings[pad] for pad in PADS])
+        for i, pad in enumerate(PADS):
+            presses = recordings[pad][1]
+            latencies, false_positives, missed = evaluate(states[:, i], presses, frequency)
+            mean = np.mean(latencies) * 1000 if latencies else float('nan')
+            p95 = np.percentile(latencies, 95) * 1000 if latencies else float('nan')
+            print(f"{detector_name:<16}{pad:<8}{len(presses):>8}{missed:>8}{false_positives:>12}"
+                  f"{mean:>17.1f}{p95:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
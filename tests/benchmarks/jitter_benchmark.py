@@ -0,0 +1,132 @@
+"""
+Measures the timing jitter of reading the pressure pads, with and without real-time mode.
+
+The pads are read with the fake analog inputs while the machine is loaded the way a busy rig is: a number of
+processes keep the other cores busy, and the sampling loop itself creates garbage while a large heap of long-lived
+objects (like a long session) makes full garbage collections slow. For each mode, the lateness of every sample
+(the time between when it was due and when it was read) is summarized.
+
+Real-time mode is applied the same way as chipmunk.py --realtime. SCHED_FIFO needs root (or CAP_SYS_NICE); without
+it the benchmark shows the effect of CPU pinning and the garbage collector control alone.
+
+With --verbose, the pads log their values like chipmunk.py --verbose does (to jitter_benchmark.log), to check that
+verbose logging does not change the timing.
+
+With --emulate-hardware, reading the fake analog inputs takes as long as reading the MCP3008 (see
+tests/fake/emulator.py), optionally with the latency models of a TOML file.
+
+Usage: python tests/benchmarks/jitter_benchmark.py [--seconds 30] [--load-processes 4] [--verbose]
+       [--emulate-hardware [FILE]]
+"""
+import os
+import sys
+import gc
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import toml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import chipmunk as cm  # noqa: E402
+from tests.fake import emulator  # noqa: E402
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def create_pads(device_configuration, verbose):
+    return cm.PressurePads(
+        cm.read_channel_table(device_configuration),
+        read_frequency=device_configuration["pressure_pad_read_frequency"],
+        read_window=device_configuration["pressure_pad_read_window"],
+        test_mode=True,
+        verbose=verbose,
+        detector=device_configuration.get("pressure_pad_detector", cm.MOVING_AVERAGE),
+        detector_options=cm.detector_options(device_configuration),
+        deadline_tolerance=device_configuration.get("pressure_pad_deadline_tolerance", 0.002),
+        log_rate=device_configuration.get("verbose_log_rate"))
+
+
+def measure(pads, seconds, trial_seconds, realtime):
+    lateness = []
+    garbage = []
+    start = time.monotonic()
+    trial_start = start
+    pads.push_init()
+    while time.monotonic() - start < seconds:
+        pads.push_poll()
+        lateness.append(pads.lateness)
+        # Cyclic garbage, like the formatting and bookkeeping done by the rest of the program
+        for _ in range(50):
+            node = {}
+            node["self"] = node
+            garbage.append(node)
+        if len(garbage) > 1000:
+            garbage = []
+        if time.monotonic() - trial_start > trial_seconds:
+            # A trial boundary
+            if realtime:
+                gc.collect()
+            trial_start = time.monotonic()
+            pads.push_init()
+    return np.array(lateness[1:]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--trial-seconds', type=float, default=5)
+    parser.add_argument('--load-processes', type=int, default=os.cpu_count())
+    parser.add_argument('--heap-objects', type=int, default=2000000,
+                        help='Number of long-lived objects, which make full garbage collections slow')
+    parser.add_argument('--verbose', action='store_true', default=False)
+    parser.add_argument('--emulate-hardware', type=str, nargs='?', const='', default=None, dest='emulate_hardware',
+                        metavar='FILE')
+    args = parser.parse_args()
+    if args.verbose:
+        cm.setup_logging(verbose=True, log_file="jitter_benchmark.log", terminal=False)
+    if args.emulate_hardware is not None:
+        if args.emulate_hardware:
+            emulator.install(emulator.HardwareEmulator.from_file(args.emulate_hardware, seed=0))
+        else:
+            emulator.install(emulator.HardwareEmulator(seed=0))
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "..", cm.DEVICE_CONFIGURATION_FILE)) as fh:
+        device_configuration = toml.load(fh)
+    heap = [[i] for i in range(args.heap_objects)]  # noqa: F841
+
+    stop = multiprocessing.Event()
+    load = [multiprocessing.Process(target=busy_loop, args=(stop,), daemon=True) for _ in range(args.load_processes)]
+    for process in load:
+        process.start()
+
+    try:
+        results = {}
+        for mode in ["default", "realtime"]:
+            pads = create_pads(device_configuration, args.verbose)
+            if mode == "realtime":
+                cm.enable_realtime(cpu=device_configuration.get("realtime_cpu"),
+                                   priority=device_configuration.get("realtime_priority", 50),
+                                   niceness=device_configuration.get("realtime_niceness", -10))
+                cm.freeze_garbage_collector()
+            results[mode] = (measure(pads, args.seconds, args.trial_seconds, mode == "realtime"), pads.metrics())
+    finally:
+        stop.set()
+        for process in load:
+            process.join()
+
+    print(f"{'mode':<10}{'samples':>9}{'mean (ms)':>11}{'p99 (ms)':>10}{'max (ms)':>10}{'misses':>8}{'rate (Hz)':>11}")
+    for mode, (lateness, metrics) in results.items():
+        print(f"{mode:<10}{len(lateness):>9}{lateness.mean():>11.3f}{np.percentile(lateness, 99):>10.3f}"
+              f"{lateness.max():>10.3f}{metrics['deadline_misses']:>8}{metrics['achieved_rate']:>11.1f}")
+    if emulator.current() is not None:
+        adc_reads = emulator.current().metrics()[emulator.ADC_READ]
+        print(f"Emulated ADC reads: {adc_reads['count']}, mean {adc_reads['mean_time'] * 1e6:.1f} us, "
+              f"max {adc_reads['max_time'] * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
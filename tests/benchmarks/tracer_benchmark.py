@@ -0,0 +1,54 @@
+"""
+Measures the cost of tracing a span and an instant event, with the Tracer of chipmunk.py --trace and with the
+NullTracer used without it. The trace files are written to a temporary folder.
+
+Usage: python tests/benchmarks/tracer_benchmark.py [--events 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+import chipmunk as cm  # noqa: E402
+
+
+def measure(tracer, events):
+    start = time.perf_counter()
+    for _ in range(events):
+        with tracer.span("span"):
+            pass
+        tracer.end_trial()
+    span_time = (time.perf_counter() - start) / events
+
+    start = time.perf_counter()
+    for _ in range(events):
+        tracer.instant("instant", cm.LEFT)
+        tracer.end_trial()
+    instant_time = (time.perf_counter() - start) / events
+    return span_time, instant_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # The time of the loop itself, to subtract from the measurements
+    start = time.perf_counter()
+    for _ in range(args.events):
+        pass
+    loop_time = (time.perf_counter() - start) / args.events
+
+    with tempfile.TemporaryDirectory() as folder:
+        tracers = {"disabled": cm.NullTracer(), "enabled": cm.Tracer(os.path.join(folder, cm.TRACE_FILE))}
+        print(f"{'tracer':<10}{'span (us)':>11}{'instant (us)':>14}")
+        for name, tracer in tracers.items():
+            span_time, instant_time = measure(tracer, args.events)
+            tracer.close()
+            print(f"{name:<10}{(span_time - loop_time) * 1e6:>11.3f}{(instant_time - loop_time) * 1e6:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
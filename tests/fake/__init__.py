@@ -1,2 +1,3 @@
 from .fake_analog_in import FakeAnalogIn
 from .fake_motorkit import FakeMotorKit
+from .fake_rfid import FakeRfidReader
@@ -0,0 +1,169 @@
+"""
+Emulating the timing of the rig hardware, so that the throughput and latency of the program can be measured on a
+machine without it.
+
+Without an emulator, the fake devices answer instantly. Once an emulator is installed, every operation of a fake
+device takes as long as a latency model draws:
+
+- adc_read: reading a channel of the MCP3008 over SPI (FakeAnalogIn.value)
+- step: one step of a stepper of a motor kit, which writes the PWM channels of its PCA9685 over I2C
+  (FakeStepper.onestep)
+- gpio_write: switching a GPIO pin, such as an LED (fake_gpio.output)
+
+Devices that share a bus wait for each other: an operation holds the lock of its bus for its whole duration, so a
+conveyor stepping on one motor kit delays stepping on the other one, and the time spent waiting for the bus is
+counted as contention. Short operations spin (like a driver polling the SPI controller), longer ones sleep (like a
+blocking I2C transfer).
+
+The default models are typical for a Raspberry Pi 4 with the Adafruit CircuitPython libraries. To emulate another rig,
+measure the operations there (for example with tests/hardware_tests) and override the models in a TOML file:
+
+    [step]
+    mean = 0.0025  # seconds
+    jitter = 0.0004  # standard deviation, in seconds
+    distribution = "lognormal"  # "lognormal", "normal" or "constant"
+    bus = "i2c"
+    spin = false
+
+In quiet mode (the default) the fake devices do not log anything, so that logging does not change the timing.
+
+Usage:
+    from tests.fake import emulator
+    emulator.install(emulator.HardwareEmulator(seed=0))
+or: python chipmunk.py -t --emulate-hardware [FILE]
+"""
+import math
+import time
+import random
+import threading
+import toml
+
+ADC_READ = "adc_read"
+STEP = "step"
+GPIO_WRITE = "gpio_write"
+SPI = "spi"
+I2C = "i2c"
+LOGNORMAL = "lognormal"
+NORMAL = "normal"
+CONSTANT = "constant"
+
+DEFAULT_MODELS = {
+    ADC_READ: dict(mean=60e-6, jitter=15e-6, distribution=LOGNORMAL, bus=SPI, spin=True),
+    STEP: dict(mean=2.0e-3, jitter=0.3e-3, distribution=LOGNORMAL, bus=I2C, spin=False),
+    GPIO_WRITE: dict(mean=2e-6, jitter=1e-6, distribution=LOGNORMAL, bus=None, spin=True),
+}
+
+_current = None
+
+
+class LatencyModel:
+    def __init__(self, mean, jitter=0.0, distribution=LOGNORMAL, bus=None, spin=False, minimum=0.0):
+        self.mean = mean
+        self.jitter = jitter  # The standard deviation
+        self.distribution = distribution if jitter > 0 else CONSTANT
+        self.bus = bus
+        self.spin = spin
+        self.minimum = minimum
+        if self.distribution == LOGNORMAL:
+            # The parameters of the underlying normal distribution, for the given mean and standard deviation
+            self.sigma = math.sqrt(math.log(1 + (jitter / mean) ** 2))
+            self.mu = math.log(mean) - self.sigma ** 2 / 2
+
+    def sample(self, rng):
+        if self.distribution == LOGNORMAL:
+            duration = rng.lognormvariate(self.mu, self.sigma)
+        elif self.distribution == NORMAL:
+            duration = rng.gauss(self.mean, self.jitter)
+        else:
+            duration = self.mean
+        return max(self.minimum, duration)
+
+
+class OperationStatistics:
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.contended = 0  # The number of operations that had to wait for the bus
+        self.contention_time = 0.0
+
+    def to_dict(self):
+        return {"count": self.count,
+                "mean_time": self.total_time / self.count if self.count else 0.0,
+                "max_time": self.max_time,
+                "contended": self.contended,
+                "contention_time": self.contention_time}
+
+
+class HardwareEmulator:
+    def __init__(self, models=None, quiet=True, seed=None):
+        settings = {operation: dict(model) for operation, model in DEFAULT_MODELS.items()}
+        for operation, model in (models or {}).items():
+            settings.setdefault(operation, {}).update(model)
+        self.models = {operation: LatencyModel(**model) for operation, model in settings.items()}
+        self.buses = {model.bus: threading.Lock() for model in self.models.values() if model.bus is not None}
+        self.quiet = quiet
+        self.rng = random.Random(seed)
+        self.statistics = {operation: OperationStatistics() for operation in self.models}
+        self.statistics_lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as fh:
+            return cls(toml.load(fh), **kwargs)
+
+    def run(self, operation):
+        model = self.models[operation]
+        duration = model.sample(self.rng)
+        bus = self.buses.get(model.bus)
+        contention = 0.0
+        if bus is not None and not bus.acquire(blocking=False):
+            start = time.perf_counter()
+            bus.acquire()
+            contention = time.perf_counter() - start
+        try:
+            if model.spin:
+                end = time.perf_counter() + duration
+                while time.perf_counter() < end:
+                    pass
+            else:
+                time.sleep(duration)
+        finally:
+            if bus is not None:
+                bus.release()
+        with self.statistics_lock:
+            statistics = self.statistics[operation]
+            statistics.count += 1
+            statistics.total_time += duration
+            statistics.max_time = max(statistics.max_time, duration)
+            if contention > 0:
+                statistics.contended += 1
+                statistics.contention_time += contention
+
+    def metrics(self):
+        with self.statistics_lock:
+            return {operation: statistics.to_dict() for operation, statistics in self.statistics.items()}
+
+
+def install(emulator):
+    global _current
+    _current = emulator
+
+
+def uninstall():
+    global _current
+    _current = None
+
+
+def current():
+    return _current
+
+
+def emulate(operation):
+    # Called by the fake devices
+    if _current is not None:
+        _current.run(operation)
+
+
+def quiet():
+    return _current is not None and _current.quiet
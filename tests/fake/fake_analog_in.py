@@ -1,4 +1,5 @@
 from typing import Optional, Callable
+from . import emulator
 
 ANALOG_CHANNELS = {}
 ON_VALUE_CALLBACK: Optional[Callable] = None
@@ -25,6 +26,7 @@ class FakeAnalogIn:
     def value(self):
         if ON_VALUE_CALLBACK is not None:
             ON_VALUE_CALLBACK()
+        emulator.emulate(emulator.ADC_READ)
         return self._value
 
     def set_value(self, value):
@@ -2,6 +2,12 @@
 # import pygame
 import os
 import json
+import time
+import logging
+import collections
+from . import emulator
+
+logger = logging.getLogger("chipmunk.fake_gpio")
 
 # Publicly available constants from the GPIO package
 BCM = 0
@@ -11,6 +17,9 @@ PUD_UP = 0
 FALLING = 0
 RISING = 1
 
+# The recent outputs, as (time.monotonic(), pin, value), so that tests can check when pins were switched
+history = collections.deque(maxlen=10000)
+
 # Private constants specifically for the phony GPIO package
 # _RISING_CALLBACKS = {}
 # _FALLING_CALLBACKS = {}
@@ -57,7 +66,10 @@ def setup(index, value, pull_up_down=None):
 
         
 def output(pin, value):
-    print("pin:", pin, value)
+    emulator.emulate(emulator.GPIO_WRITE)
+    history.append((time.monotonic(), pin, value))
+    if not emulator.quiet():
+        logger.debug("pin: %s %s", pin, value)
     # global wait_time
     # print(f"{_REVERSE_PIN_DICT[pin]}={value}")
     # if pin == _PIN_DICT["left_conveyor_turn_counterclockwise"]:
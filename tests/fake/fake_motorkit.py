@@ -1,10 +1,24 @@
+from adafruit_motor import stepper
+from . import emulator
+
+
 class FakeStepper:
-    def __init__(self, address, stepper_id):
+    def __init__(self, address, stepper_id, microsteps=16):
         self.address = address
         self.id = stepper_id
+        self.microsteps = microsteps
+        self.position = 0  # In microsteps, like the current step that the real stepper returns
 
-    def onestep(self):
-        pass
+    def onestep(self, direction=stepper.FORWARD, style=stepper.SINGLE):
+        emulator.emulate(emulator.STEP)
+        if style == stepper.MICROSTEP:
+            step_size = 1
+        elif style == stepper.INTERLEAVE:
+            step_size = self.microsteps // 2
+        else:
+            step_size = self.microsteps
+        self.position += step_size if direction == stepper.FORWARD else -step_size
+        return self.position
 
 
 class FakeMotorKit:
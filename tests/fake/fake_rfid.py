@@ -0,0 +1,18 @@
+# A stand-in for an RFID reader. In test mode with --fake-animal-ids, pressing a number key identifies an animal
+# (see tests/utilities.py).
+ANIMAL_ID_FORMAT = "ANIMAL{:04d}"
+TAG = None
+
+
+def set_tag(tag):
+    global TAG
+    TAG = tag
+
+
+class FakeRfidReader:
+    def read(self):
+        # Returns every tag once, like a reader reporting the tags it reads
+        global TAG
+        tag = TAG
+        TAG = None
+        return tag
@@ -0,0 +1,47 @@
+import time
+import threading
+import unittest
+import acquisition
+from tests.software_tests.test_pressure_pads import DEVICE_CONFIGURATION
+import chipmunk as cm
+
+
+class AcquisitionTestCase(unittest.TestCase):
+    def test_remote_pressure_pads(self):
+        channels = cm.read_channel_table(DEVICE_CONFIGURATION)
+        pads = acquisition.RemotePressurePads(channels, dict(read_frequency=1000, read_window=3), test_mode=True)
+        try:
+            # The fake analog inputs of the acquisition process read 0, so no pads are pressed
+            self.assertTrue(pads.push_poll())
+            with self.assertRaises(TimeoutError):
+                pads.next_event(timeout=0.1)
+            self.assertIsNone(pads.push_wait(time.monotonic() + 0.1))
+
+            # An event wakes up a waiting reader
+            def publish():
+                written = int(pads.ring.header[acquisition.EVENTS_WRITTEN])
+                pads.ring.events[written % pads.ring.event_capacity] = (0.0, 0, 1)
+                pads.ring.header[acquisition.EVENTS_WRITTEN] = written + 1
+                pads.event_semaphore.release()
+
+            threading.Timer(0.05, publish).start()
+            start = time.monotonic()
+            self.assertEqual(pads.next_event(timeout=2.0), pads.names[1])
+            self.assertLess(time.monotonic() - start, 0.5)
+            time.sleep(2 * acquisition.METRICS_INTERVAL)
+            samples = pads.read_samples()
+            self.assertGreater(len(samples), 0)
+            self.assertEqual(samples.shape[1], acquisition.SAMPLE_COLUMNS + len(channels))
+            self.assertTrue((samples[:, acquisition.SAMPLE_PUSH] == -1).all())
+            self.assertTrue((samples[:, acquisition.SAMPLE_COLUMNS:] == 0).all())
+            metrics = pads.metrics()
+            self.assertGreater(metrics["samples"], 0)
+            self.assertEqual(metrics["event_overruns"], 0)
+            self.assertEqual(set(metrics["baselines"]), set(cm.DEFAULT_CHANNELS))
+        finally:
+            pads.close()
+        self.assertFalse(pads.process.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
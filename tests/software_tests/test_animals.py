@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+import chipmunk as cm
+import simulation as sim
+from tests.utilities import create_experiment
+
+
+class ScriptedReader:
+    def __init__(self, tags):
+        self.tags = tags
+
+    def read(self):
+        return self.tags.pop(0) if self.tags else None
+
+
+class AnimalStateStoreTestCase(unittest.TestCase):
+    def test_write_through(self):
+        tests = [cm.Test(cm.LEFT, promotion_accuracy=0.5, promotion_window=4, promotion_streak=3)]
+        with tempfile.TemporaryDirectory() as folder:
+            store = cm.AnimalStateStore(folder, tests)
+            state = store.get("ANIMAL0001")
+            state.curr_test = 1
+            state.nb_correct_answers = 7
+            for correct in [True, False, True, True, True]:
+                state.statistics[0].add(correct)
+            store.save(state)
+            self.assertTrue(os.path.exists(os.path.join(folder, "ANIMAL0001.json")))
+
+            loaded = cm.AnimalStateStore(folder, tests).get("ANIMAL0001")
+            self.assertEqual(loaded.curr_test, 1)
+            self.assertEqual(loaded.nb_correct_answers, 7)
+            window = loaded.statistics[0].promotion_window
+            self.assertEqual(window.count, 4)
+            self.assertAlmostEqual(window.accuracy, 0.75)
+            self.assertEqual(loaded.statistics[0].streak, 3)
+            # The oldest outcome is replaced next
+            window.add(False)
+            self.assertAlmostEqual(window.accuracy, 0.75)
+
+    def test_least_recently_used(self):
+        store = cm.AnimalStateStore(None, [cm.Test(cm.LEFT)], cache_size=2)
+        first = store.get("A")
+        store.get("B")
+        self.assertIs(store.get("A"), first)
+        store.get("C")
+        self.assertEqual(list(store.cache), ["A", "C"])
+
+    def test_path(self):
+        store = cm.AnimalStateStore(None, [])
+        store.folder = "animals"
+        self.assertEqual(store.path("../x y"), os.path.join("animals", "___x_y.json"))
+
+
+class ExperimentAnimalsTestCase(unittest.TestCase):
+    def test_switch_animals(self):
+        animal = sim.ScriptedAnimal([cm.LEFT, cm.LEFT, cm.RIGHT, cm.LEFT])
+        tests = [cm.Test(cm.LEFT, repeat=2), cm.Test(cm.RIGHT)]
+        # Read at the start of every trial, and after every press
+        reader = ScriptedReader(["ANIMAL0001", None, None, None, "ANIMAL0002", None, "ANIMAL0001"])
+        experiment = create_experiment(tests, animal, animal_reader=reader)
+        # ANIMAL0001 completes the first test
+        experiment.testing_phase()
+        experiment.testing_phase()
+        self.assertEqual(experiment.curr_test, 1)
+        # ANIMAL0002 starts from the first test
+        self.assertEqual(experiment.testing_phase(), cm.INCORRECT)
+        self.assertEqual(experiment.animal.animal_id, "ANIMAL0002")
+        self.assertEqual(experiment.curr_test, 0)
+        # ANIMAL0001 continues with the second test
+        self.assertEqual(experiment.testing_phase(), cm.INCORRECT)
+        self.assertEqual(experiment.animal.animal_id, "ANIMAL0001")
+        self.assertEqual(experiment.curr_test, 1)
+        self.assertEqual(experiment.rew_cnt, 2)
+        self.assertEqual(experiment.nb_incorrect_answers, 1)
+
+    def test_finished_animal(self):
+        animal = sim.ScriptedAnimal([cm.LEFT, cm.LEFT, cm.RIGHT, cm.LEFT])
+        # Read at the start of every trial, and after every press of an animal that is still training
+        reader = ScriptedReader(["ANIMAL0001", None, "ANIMAL0001", None, "ANIMAL0002", None, None])
+        experiment = create_experiment([cm.Test(cm.LEFT, repeat=1)], animal, animal_reader=reader)
+        # ANIMAL0001 completes all tests, which does not end the session
+        self.assertEqual(experiment.testing_phase(), cm.CORRECT)
+        self.assertTrue(experiment.running)
+        # Its next press is ignored
+        self.assertIsNone(experiment.testing_phase())
+        self.assertTrue(experiment.running)
+        self.assertEqual(experiment.rew_cnt, 1)
+        # ANIMAL0002 keeps training
+        self.assertEqual(experiment.testing_phase(), cm.INCORRECT)
+        self.assertEqual(experiment.animal.animal_id, "ANIMAL0002")
+        self.assertEqual(experiment.testing_phase(), cm.CORRECT)
+        self.assertTrue(experiment.running)
+        self.assertEqual(experiment.animals.get("ANIMAL0001").curr_test, 1)
+
+    def test_press_after_finished_animal(self):
+        animal = sim.ScriptedAnimal([cm.LEFT, cm.LEFT])
+        # ANIMAL0002 is only identified after its press, while ANIMAL0001, which completed all tests, is current
+        reader = ScriptedReader(["ANIMAL0001", None, None, "ANIMAL0002"])
+        experiment = create_experiment([cm.Test(cm.LEFT, repeat=1)], animal, animal_reader=reader)
+        self.assertEqual(experiment.testing_phase(), cm.CORRECT)
+        # The press counts for ANIMAL0002
+        self.assertEqual(experiment.testing_phase(), cm.CORRECT)
+        self.assertEqual(experiment.animal.animal_id, "ANIMAL0002")
+        self.assertEqual(experiment.conveyors[cm.LEFT].times_fed, 2)
+        self.assertEqual(experiment.animals.get("ANIMAL0002").curr_test, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
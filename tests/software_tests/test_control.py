@@ -0,0 +1,102 @@
+import os
+import time
+import socket
+import tempfile
+import threading
+import unittest
+import chipmunk as cm
+import control
+import simulation as sim
+from tests.fake import FakeMotorKit
+from tests.software_tests.test_pressure_pads import create_pads
+from tests.utilities import create_experiment, wait_for
+
+
+class ControlServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.folder.name, "control.sock")
+        kit = FakeMotorKit(96)
+        conveyors = {name: cm.Conveyor(kit.stepper1, 3, name.lower()) for name in cm.DEFAULT_CHANNELS}
+        self.experiment = create_experiment([cm.Test(cm.LEFT)], sim.ScriptedAnimal([cm.LEFT]), conveyors=conveyors)
+        self.server = control.ControlServer(self.experiment, self.socket_path)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.close()
+        self.folder.cleanup()
+
+    def test_status(self):
+        self.experiment.testing_phase()
+        status = control.send_command("status", self.socket_path)
+        self.assertEqual(status["test"], 0)
+        self.assertEqual(status["test_repeat"], 1)
+        self.assertEqual(status["rewards"], 1)
+        self.assertEqual(status["reward_counts"][cm.LEFT], 1)
+        self.assertIn("error", control.send_command("jump", self.socket_path))
+
+    def test_feed(self):
+        self.assertEqual(control.send_command("feed middle", self.socket_path), {"ok": "feed"})
+        conveyor = self.experiment.conveyors[cm.MIDDLE]
+        self.assertTrue(wait_for(lambda: conveyor.manual_feeds == 1))
+        self.assertEqual(conveyor.times_fed, 0)
+        self.assertIn("error", control.send_command("feed nowhere", self.socket_path))
+        self.assertIn("error", control.send_command("led left soon", self.socket_path))
+
+    def test_led(self):
+        self.assertEqual(control.send_command("led left 0.2", self.socket_path), {"ok": "led"})
+        self.assertTrue(wait_for(lambda: self.experiment.leds.lit == {cm.LEFT}))
+        self.assertTrue(wait_for(lambda: not self.experiment.leds.lit))
+        for duration in ["-1", "nan", "inf"]:
+            self.assertIn("error", control.send_command(f"led left {duration}", self.socket_path))
+
+    def test_pause_and_stop(self):
+        control.send_command("pause", self.socket_path)
+        self.assertTrue(self.experiment.paused)
+        thread = threading.Thread(target=self.experiment.testing_phase)
+        thread.start()
+        time.sleep(0.05)
+        self.assertEqual(self.experiment.rew_cnt, 0)
+        control.send_command("resume", self.socket_path)
+        thread.join(timeout=2)
+        self.assertEqual(self.experiment.rew_cnt, 1)
+
+        control.send_command("stop", self.socket_path)
+        self.assertFalse(self.experiment.running)
+        self.assertIsNone(self.experiment.testing_phase())
+
+    def test_socket_in_use(self):
+        with self.assertRaises(RuntimeError):
+            control.ControlServer(self.experiment, self.socket_path)
+        self.assertEqual(control.send_command("status", self.socket_path)["test"], 0)
+
+    def test_stale_socket(self):
+        stale_path = os.path.join(self.folder.name, "stale.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(stale_path)  # Closed without removing it, like after a crash
+        server = control.ControlServer(self.experiment, stale_path)
+        server.start()
+        try:
+            self.assertEqual(control.send_command("status", stale_path)["test"], 0)
+        finally:
+            server.close()
+
+        with open(stale_path, 'w'):
+            pass
+        with self.assertRaises(RuntimeError):
+            control.ControlServer(self.experiment, stale_path)
+
+
+class InterruptTestCase(unittest.TestCase):
+    def test_interrupt_push_wait(self):
+        pads = create_pads()
+        timer = threading.Timer(0.05, pads.interrupt)
+        timer.start()
+        start = time.monotonic()
+        self.assertIsNone(pads.push_wait(start + 5))
+        self.assertLess(time.monotonic() - start, 1)
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
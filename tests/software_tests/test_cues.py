@@ -0,0 +1,64 @@
+import os
+import unittest
+import toml
+import chipmunk as cm
+import tests.fake.fake_gpio as fake_gpio
+from tests.utilities import wait_for
+
+DEVICE_CONFIGURATION = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                                    cm.DEVICE_CONFIGURATION_FILE)
+
+
+def create_leds():
+    with open(DEVICE_CONFIGURATION) as fh:
+        channels = cm.read_channel_table(toml.load(fh))
+    return cm.Leds(channels, test_mode=True)
+
+
+class CueTestCase(unittest.TestCase):
+    def test_edges(self):
+        cue = cm.Cue(cm.LEFT, duration=0.1, start=0.5, count=2, period=0.3)
+        self.assertEqual([(round(time, 6), value) for time, value in cue.edges()],
+                         [(0.5, 1), (0.6, 0), (0.8, 1), (0.9, 0)])
+
+    def test_test_configuration(self):
+        test = cm.Test(cm.LEFT, trial_cue=[{"led": cm.ANSWER_LED, "duration": 0.1, "count": 3}])
+        self.assertEqual(test.trial_cue[0].period, 0.2)
+        self.assertIsNone(test.reward_cue)
+        loaded = cm.Test(**toml.loads(toml.dumps({"test1": test.to_dict()}))["test1"])
+        self.assertEqual(loaded.trial_cue[0].to_dict(), test.trial_cue[0].to_dict())
+
+
+class CueEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.leds = create_leds()
+        self.engine = cm.CueEngine(self.leds)
+        fake_gpio.history.clear()
+
+    def tearDown(self):
+        self.engine.close()
+
+    def test_play(self):
+        pin = self.leds.id_to_pin[cm.MIDDLE]
+        origin = self.engine.play([cm.Cue(cm.ANSWER_LED, duration=0.05, start=0.02, count=2)], answer=cm.MIDDLE)
+        self.assertTrue(wait_for(lambda: self.engine.edges == 4))
+        history = [entry for entry in fake_gpio.history if entry[1] == pin]
+        self.assertEqual([value for _, _, value in history], [1, 0, 1, 0])
+        for (actual, _, _), expected in zip(history, [0.02, 0.07, 0.12, 0.17]):
+            self.assertGreaterEqual(actual - origin, expected)
+            self.assertLess(actual - origin, expected + 0.02)
+        self.assertLess(self.engine.metrics()["max_deviation"], 0.02)
+
+    def test_cancel(self):
+        self.engine.play([cm.Cue(cm.ALL_LEDS, duration=10.0)])
+        self.assertTrue(wait_for(lambda: len(self.engine.lit) == len(self.leds.id_to_pin)))
+        self.engine.cancel()
+        self.assertEqual(self.engine.lit, set())
+        self.assertEqual(self.engine.heap, [])
+        # Every LED was turned off again
+        values = {pin: value for _, pin, value in fake_gpio.history}
+        self.assertEqual(set(values.values()), {0})
+
+
+if __name__ == '__main__':
+    unittest.main()
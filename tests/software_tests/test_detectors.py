@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import chipmunk as cm
+
+
+def run(detector, values):
+    # Every value is fed to a detector for two pads, where the second pad always reads 0
+    states = []
+    for value in values:
+        pressed = detector.update(np.array([value, 0]))
+        if pressed is None:
+            states.append(None)
+        else:
+            states.append(bool(pressed[0]))
+            assert not pressed[1]
+    return states
+
+
+class DetectorTestCase(unittest.TestCase):
+    def test_moving_average(self):
+        detector = cm.MovingAverageDetector(thresholds=[100, 100], window=4)
+        states = run(detector, [0, 0, 0, 0, 300, 300, 0, 0, 0])
+        self.assertEqual(states, [None, None, None, False, False, True, True, True, False])
+
+    def test_hysteresis(self):
+        detector = cm.HysteresisDetector(onset_thresholds=[100, 100], offset_thresholds=[50, 50], debounce_samples=2)
+        states = run(detector, [0, 150, 0, 150, 150, 80, 40, 60, 40, 40, 150])
+        self.assertEqual(states, [False, False, False, False, True, True, True, True, True, False, False])
+
+    def test_cusum(self):
+        detector = cm.CusumDetector(thresholds=[100, 100], drift=0, decision=100, max_step=60)
+        # A strong press is detected after two values, a weak one takes a few more
+        self.assertEqual(run(detector, [0, 10000, 10000, 0, 0]), [False, False, True, True, False])
+        detector.reset()
+        self.assertEqual(run(detector, [140, 140, 140, 140]), [False, False, True, True])
+        # Single noise spikes are ignored
+        detector.reset()
+        self.assertEqual(run(detector, [5000, 0, 5000, 0, 5000, 0]), [False] * 6)
+
+    def test_vectorized(self):
+        detector = cm.MovingAverageDetector(thresholds=[100, 35, 200], window=1)
+        pressed = detector.update(np.array([150, 30, 250]))
+        np.testing.assert_array_equal(pressed, [True, False, True])
+
+    def test_create_detector(self):
+        detector = cm.create_detector(cm.HYSTERESIS, [100, 200], 10, release_fraction=0.25)
+        np.testing.assert_array_equal(detector.offset_thresholds, [25, 50])
+        detector = cm.create_detector(cm.CUSUM, [100], 10)
+        np.testing.assert_array_equal(detector.decision, [100])
+        np.testing.assert_array_equal(detector.max_step, [60])
+        with self.assertRaises(ValueError):
+            cm.create_detector("unknown", [100], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import time
+import threading
+import unittest
+from adafruit_motor import stepper
+from tests.fake import emulator, FakeAnalogIn, FakeMotorKit
+
+
+class LatencyModelTestCase(unittest.TestCase):
+    def test_lognormal(self):
+        model = emulator.LatencyModel(mean=2e-3, jitter=0.5e-3)
+        rng = emulator.random.Random(0)
+        samples = [model.sample(rng) for _ in range(20000)]
+        mean = sum(samples) / len(samples)
+        deviation = (sum((sample - mean) ** 2 for sample in samples) / len(samples)) ** 0.5
+        self.assertAlmostEqual(mean, 2e-3, delta=0.05e-3)
+        self.assertAlmostEqual(deviation, 0.5e-3, delta=0.05e-3)
+        self.assertGreater(min(samples), 0)
+
+    def test_constant(self):
+        model = emulator.LatencyModel(mean=1e-3, distribution=emulator.NORMAL)
+        self.assertEqual(model.sample(emulator.random.Random(0)), 1e-3)
+
+
+class HardwareEmulatorTestCase(unittest.TestCase):
+    def tearDown(self):
+        emulator.uninstall()
+
+    def test_fake_devices(self):
+        hardware = emulator.HardwareEmulator({emulator.ADC_READ: {"mean": 1e-3, "jitter": 0.0}}, seed=0)
+        emulator.install(hardware)
+        analog_in = FakeAnalogIn(None, 7)
+        start = time.perf_counter()
+        for _ in range(10):
+            _ = analog_in.value
+        self.assertGreaterEqual(time.perf_counter() - start, 10e-3)
+        self.assertEqual(hardware.metrics()[emulator.ADC_READ]["count"], 10)
+
+        # Without an emulator, the fake devices answer instantly
+        emulator.uninstall()
+        start = time.perf_counter()
+        for _ in range(10):
+            _ = analog_in.value
+        self.assertLess(time.perf_counter() - start, 5e-3)
+
+    def test_bus_contention(self):
+        hardware = emulator.HardwareEmulator({emulator.STEP: {"mean": 2e-3, "jitter": 0.0}}, seed=0)
+        emulator.install(hardware)
+        kits = [FakeMotorKit(0x60), FakeMotorKit(0x61)]
+
+        def feed(kit):
+            for _ in range(20):
+                kit.stepper1.onestep(direction=stepper.BACKWARD, style=stepper.DOUBLE)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=feed, args=(kit,)) for kit in kits]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Both motor kits share the I2C bus, so their steps do not overlap
+        self.assertGreaterEqual(time.perf_counter() - start, 80e-3)
+        self.assertGreater(hardware.metrics()[emulator.STEP]["contended"], 0)
+
+    def test_stepper_position(self):
+        motor = FakeMotorKit(0x60).stepper1
+        motor.onestep(direction=stepper.FORWARD, style=stepper.SINGLE)
+        motor.onestep(direction=stepper.FORWARD, style=stepper.INTERLEAVE)
+        self.assertEqual(motor.onestep(direction=stepper.BACKWARD, style=stepper.MICROSTEP), 16 + 8 - 1)
+
+    def test_quiet(self):
+        emulator.install(emulator.HardwareEmulator())
+        self.assertTrue(emulator.quiet())
+        emulator.install(emulator.HardwareEmulator(quiet=False))
+        self.assertFalse(emulator.quiet())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import queue
+import logging
+import numpy as np
+import chipmunk as cm
+
+
+class LoggingTestCase(unittest.TestCase):
+    def test_rate_limiter(self):
+        limiter = cm.RateLimiter(rate=1)
+        self.assertTrue(limiter.allow())
+        self.assertFalse(limiter.allow())
+        self.assertEqual(limiter.suppressed, 1)
+        unlimited = cm.RateLimiter()
+        self.assertTrue(all(unlimited.allow() for _ in range(100)))
+
+    def test_dropping_queue_handler(self):
+        log_queue = queue.Queue(2)
+        handler = cm.DroppingQueueHandler(log_queue)
+        test_logger = logging.getLogger("chipmunk.test_dropping_queue_handler")
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        values = np.array([1.0, 2.0])
+        for _ in range(3):
+            test_logger.warning("values; %s", cm.ChannelValues(["Left", "Right"], values))
+        values[0] = 10
+        self.assertEqual(handler.dropped, 1)
+        # The message is formatted when it is written, using the values at the time it was logged
+        record = log_queue.get_nowait()
+        self.assertEqual(record.getMessage(), "values; Left: 1.0, Right: 2.0")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import time
+import threading
+import unittest
+import chipmunk as cm
+from tests.fake.fake_analog_in import ANALOG_CHANNELS
+
+
+DEVICE_CONFIGURATION = {
+    "left_pressure_pad_pin": 1, "left_pressure_pad_threshold": 100,
+    "middle_pressure_pad_pin": 2, "middle_pressure_pad_threshold": 35,
+    "right_pressure_pad_pin": 3, "right_pressure_pad_threshold": 200,
+    "motor_kit_1_address": 96, "motor_kit_2_address": 97,
+}
+for _name in cm.DEFAULT_CHANNELS:
+    DEVICE_CONFIGURATION.update({cm.channel_key(_name, "led_pin"): 0,
+                                 cm.channel_key(_name, "conveyor_kit"): 1,
+                                 cm.channel_key(_name, "conveyor_stepper"): "stepper1"})
+
+
+def create_pads(device_configuration=None, **kwargs):
+    if device_configuration is None:
+        device_configuration = DEVICE_CONFIGURATION
+    return cm.PressurePads(cm.read_channel_table(device_configuration),
+                           read_frequency=1000,
+                           read_window=3,
+                           test_mode=True,
+                           **kwargs)
+
+
+class PressurePadsTestCase(unittest.TestCase):
+    def tearDown(self):
+        for channel in ANALOG_CHANNELS.values():
+            channel.set_value(0)
+
+    def test_push_priority(self):
+        pads = create_pads()
+        pads.wait_release()
+        ANALOG_CHANNELS[1].set_value(10000)
+        ANALOG_CHANNELS[3].set_value(10000)
+        while pads.push_poll():
+            pass
+        self.assertEqual(pads.push, cm.RIGHT)
+
+    def test_push_wait_deadline(self):
+        pads = create_pads()
+        start = time.monotonic()
+        self.assertIsNone(pads.push_wait(start + 0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+        # Pressed while waiting
+        timer = threading.Timer(0.02, ANALOG_CHANNELS[2].set_value, args=(10000,))
+        timer.start()
+        self.assertEqual(pads.push_wait(time.monotonic() + 1), cm.MIDDLE)
+        timer.join()
+        # Not released before the deadline
+        self.assertFalse(pads.wait_release(time.monotonic() + 0.05))
+
+    def test_adaptive_sampling(self):
+        pads = create_pads(idle_frequency=500, idle_margin=0.5)
+        for _ in range(5):
+            pads.push_poll()
+        self.assertTrue(pads.idle)
+        self.assertAlmostEqual(pads.sample_period, 1 / 500)
+
+        # Rising above the idle level, but not above the threshold, switches to the full rate immediately
+        ANALOG_CHANNELS[2].set_value(20)
+        self.assertTrue(pads.push_poll())
+        self.assertFalse(pads.idle)
+        self.assertAlmostEqual(pads.sample_period, 1 / 1000)
+
+        ANALOG_CHANNELS[2].set_value(10000)
+        while pads.push_poll():
+            pass
+        self.assertEqual(pads.push, cm.MIDDLE)
+        self.assertEqual(pads.metrics()["samples"], pads.samples)
+
+    def test_baseline_tracking(self):
+        pads = create_pads(baseline_rise_time=0.01, baseline_fall_time=0.002)
+        ANALOG_CHANNELS[1].set_value(40)
+        for _ in range(100):
+            pads.push_poll()
+        self.assertIsNone(pads.push)
+        self.assertAlmostEqual(pads.baselines[0], 40, places=1)
+        self.assertEqual(pads.metrics()["baselines"][cm.LEFT], pads.baselines[0])
+
+        # Presses are detected relative to the baseline, which does not change during a press
+        ANALOG_CHANNELS[1].set_value(130)
+        for _ in range(5):
+            pads.push_poll()
+        self.assertIsNone(pads.push)
+        ANALOG_CHANNELS[1].set_value(160)
+        while pads.push_poll():
+            pass
+        self.assertEqual(pads.push, cm.LEFT)
+        baseline = pads.baselines[0]
+        for _ in range(10):
+            pads.push_poll()
+        self.assertEqual(pads.baselines[0], baseline)
+
+        # Values below the baseline are followed quickly
+        ANALOG_CHANNELS[1].set_value(0)
+        for _ in range(20):
+            pads.push_poll()
+        self.assertLess(pads.baselines[0], 1)
+
+    def test_channel_table(self):
+        channels = cm.read_channel_table(DEVICE_CONFIGURATION)
+        self.assertEqual([channel.name for channel in channels], cm.DEFAULT_CHANNELS)
+        self.assertEqual(cm.log_entries(cm.DEFAULT_CHANNELS)[-5:],
+                         ["Left reward count", "Middle reward count", "Right reward count", "Total reward count",
+                          "Waveform"])
+
+        device_configuration = dict(DEVICE_CONFIGURATION, channels=["Left", "Far right"])
+        device_configuration.update({"far_right_pressure_pad_pin": 7, "far_right_pressure_pad_threshold": 50,
+                                     "far_right_led_pin": 5, "far_right_conveyor_kit": 2,
+                                     "far_right_conveyor_stepper": "stepper2"})
+        pads = create_pads(device_configuration)
+        pads.wait_release()
+        ANALOG_CHANNELS[7].set_value(10000)
+        while pads.push_poll():
+            pass
+        self.assertEqual(pads.push, "Far right")
+
+        with self.assertRaises(ValueError):
+            cm.read_channel_table(dict(DEVICE_CONFIGURATION, channels=[str(i) for i in range(9)]))
+        # The motor kit must have an address, and the stepper must exist
+        for key, value in [("far_right_conveyor_kit", 3), ("far_right_conveyor_kit", "2"),
+                           ("far_right_conveyor_stepper", "stepper3")]:
+            with self.assertRaises(ValueError):
+                cm.read_channel_table(dict(device_configuration, **{key: value}))
+        device_configuration["motor_kit_3_address"] = 98
+        self.assertEqual(cm.read_channel_table(dict(device_configuration, far_right_conveyor_kit=3))[1].conveyor_kit, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import signal
+import tempfile
+import threading
+import unittest
+import chipmunk as cm
+from tests.software_tests.test_pressure_pads import create_pads
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def test_toggle(self):
+        with tempfile.TemporaryDirectory() as folder:
+            profiler = cm.Profiler(folder)
+            profiler.toggle()
+            sum(i * i for i in range(1000))
+            profiler.toggle()
+            files = sorted(os.listdir(folder))
+            self.assertEqual([os.path.splitext(file)[1] for file in files], [".prof", ".txt"])
+            with open(os.path.join(folder, files[1])) as fh:
+                self.assertIn("genexpr", fh.read())
+            # Stopping when not profiling does nothing
+            profiler.stop()
+            self.assertEqual(len(os.listdir(folder)), 2)
+
+    def test_memory(self):
+        with tempfile.TemporaryDirectory() as folder:
+            profiler = cm.Profiler(folder)
+            try:
+                profiler.dump_memory()
+                self.assertEqual(os.listdir(folder), [])
+                leak = [bytearray(1000) for _ in range(1000)]  # noqa: F841
+                profiler.dump_memory()
+            finally:
+                cm.tracemalloc.stop()
+            files = os.listdir(folder)
+            self.assertEqual(len(files), 1)
+            with open(os.path.join(folder, files[0])) as fh:
+                self.assertIn("test_profiling.py", fh.read())
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR1"), "requires SIGUSR1")
+    def test_signals(self):
+        handlers = signal.getsignal(signal.SIGUSR1), signal.getsignal(signal.SIGUSR2)
+        with tempfile.TemporaryDirectory() as folder:
+            profiler = cm.Profiler(folder)
+            try:
+                profiler.install_signal_handlers()
+                os.kill(os.getpid(), signal.SIGUSR1)
+                # The handler only sets a flag, which the experiment loop handles
+                self.assertIsNone(profiler.profile)
+                profiler.handle_requests()
+                self.assertIsNotNone(profiler.profile)
+                os.kill(os.getpid(), signal.SIGUSR1)
+                os.kill(os.getpid(), signal.SIGUSR2)
+                self.assertEqual(os.listdir(folder), [])
+                profiler.handle_requests()
+                self.assertIsNone(profiler.profile)
+                self.assertTrue(cm.tracemalloc.is_tracing())
+            finally:
+                cm.tracemalloc.stop()
+                signal.signal(signal.SIGUSR1, handlers[0])
+                signal.signal(signal.SIGUSR2, handlers[1])
+            self.assertEqual(len(os.listdir(folder)), 2)
+
+
+    @unittest.skipUnless(hasattr(signal, "SIGUSR1"), "requires SIGUSR1")
+    def test_signal_while_waiting(self):
+        handler = signal.getsignal(signal.SIGUSR1)
+        with tempfile.TemporaryDirectory() as folder:
+            profiler = cm.Profiler(folder)
+            pads = create_pads()
+            pads.profiler = profiler
+            started = []
+
+            def check():
+                started.append(profiler.profile is not None)
+                pads.interrupt()
+
+            try:
+                profiler.install_signal_handlers()
+                threading.Timer(0.05, os.kill, args=(os.getpid(), signal.SIGUSR1)).start()
+                timer = threading.Timer(0.3, check)
+                timer.start()
+                # Without a deadline, only the interruption ends the wait, after checking the profiler
+                self.assertIsNone(pads.push_wait())
+                timer.join()
+                self.assertEqual(started, [True])
+            finally:
+                profiler.stop()
+                signal.signal(signal.SIGUSR1, handler)
+            self.assertEqual(len(os.listdir(folder)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
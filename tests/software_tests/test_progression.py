@@ -0,0 +1,59 @@
+import unittest
+import chipmunk as cm
+
+
+class RollingWindowTestCase(unittest.TestCase):
+    def test_rolling_window(self):
+        window = cm.RollingWindow(3)
+        for correct in [True, False, True]:
+            window.add(correct)
+        self.assertTrue(window.full)
+        self.assertAlmostEqual(window.accuracy, 2 / 3)
+        # The oldest outcome drops out of the window
+        window.add(True)
+        self.assertEqual(window.count, 3)
+        self.assertAlmostEqual(window.accuracy, 2 / 3)
+        window.add(True)
+        self.assertAlmostEqual(window.accuracy, 1)
+        window.reset()
+        self.assertFalse(window.full)
+        self.assertEqual(window.accuracy, 0)
+
+
+class ProgressionEngineTestCase(unittest.TestCase):
+    def test_repeat(self):
+        engine = cm.ProgressionEngine([cm.Test(cm.LEFT, repeat=2), cm.Test(cm.RIGHT)], progression_file=None)
+        self.assertEqual(engine.record(0, True, 1), 0)
+        self.assertEqual(engine.record(0, True, 2), 1)
+
+    def test_accuracy(self):
+        tests = [cm.Test(cm.LEFT),
+                 cm.Test(cm.RIGHT, promotion_accuracy=0.75, promotion_window=4, demotion_accuracy=0.5,
+                         demotion_window=4)]
+        engine = cm.ProgressionEngine(tests, progression_file=None)
+        # Not promoted before the window is full
+        for correct in [True, True, True]:
+            self.assertEqual(engine.record(1, correct, 0), 1)
+        self.assertEqual(engine.record(1, False, 0), 2)
+
+        engine.statistics[1].reset()
+        for correct in [False, True, False]:
+            self.assertEqual(engine.record(1, correct, 0), 1)
+        self.assertEqual(engine.record(1, False, 0), 0)
+
+    def test_streak(self):
+        tests = [cm.Test(cm.LEFT, promotion_streak=3), cm.Test(cm.RIGHT)]
+        engine = cm.ProgressionEngine(tests, progression_file=None)
+        for correct in [True, True, False, True, True]:
+            self.assertEqual(engine.record(0, correct, 0), 0)
+        self.assertEqual(engine.record(0, True, 0), 1)
+
+    def test_first_test_is_not_demoted(self):
+        tests = [cm.Test(cm.LEFT, demotion_accuracy=0.5, demotion_window=2)]
+        engine = cm.ProgressionEngine(tests, progression_file=None)
+        self.assertEqual(engine.record(0, False, 0), 0)
+        self.assertEqual(engine.record(0, False, 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import unittest
+import chipmunk as cm
+
+
+class DeadlineSchedulerTestCase(unittest.TestCase):
+    def test_order(self):
+        scheduler = cm.DeadlineScheduler()
+        self.assertIsNone(scheduler.next())
+        scheduler.schedule("late", 10)
+        early = scheduler.schedule("early", 5)
+        self.assertEqual(scheduler.next(), (early, "early"))
+        self.assertEqual(scheduler.pop_expired(early + 1), ["early"])
+        self.assertEqual(scheduler.pop_expired(early + 1), [])
+        self.assertEqual(scheduler.next()[1], "late")
+
+    def test_cancel_and_reschedule(self):
+        scheduler = cm.DeadlineScheduler()
+        scheduler.schedule("a", 1)
+        scheduler.schedule("b", 2)
+        scheduler.cancel("a")
+        self.assertIsNone(scheduler.deadline("a"))
+        self.assertEqual(scheduler.next()[1], "b")
+        # Rescheduling replaces the earlier deadline
+        deadline = scheduler.schedule("b", 3)
+        self.assertEqual(scheduler.next(), (deadline, "b"))
+        self.assertEqual(scheduler.pop_expired(deadline), ["b"])
+        self.assertIsNone(scheduler.next())
+
+    def test_sleep_until(self):
+        scheduler = cm.DeadlineScheduler()
+        deadline = scheduler.schedule(cm.NEXT_TRIAL, 0.05)
+        scheduler.sleep_until(cm.NEXT_TRIAL)
+        self.assertGreaterEqual(time.monotonic(), deadline)
+        self.assertIsNone(scheduler.deadline(cm.NEXT_TRIAL))
+        # Nothing scheduled, so this returns immediately
+        scheduler.sleep_until(cm.NEXT_TRIAL)
+
+    def test_bounded(self):
+        # Like the trials of a session, which never pop from the heap
+        scheduler = cm.DeadlineScheduler(sleep=lambda seconds: None)
+        for _ in range(2000):
+            scheduler.schedule(cm.RESPONSE_TIMEOUT, 10)
+            scheduler.cancel(cm.RESPONSE_TIMEOUT)
+            scheduler.schedule(cm.NEXT_TRIAL, 1)
+            scheduler.sleep_until(cm.NEXT_TRIAL)
+        self.assertLessEqual(len(scheduler.heap), 2)
+        late = scheduler.schedule("late", 10)
+        early = scheduler.schedule("early", 5)
+        self.assertEqual(scheduler.next(), (early, "early"))
+        self.assertEqual(scheduler.pop_expired(late), ["early", "late"])
+
+
+if __name__ == '__main__':
+    unittest.main()
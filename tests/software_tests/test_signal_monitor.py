@@ -0,0 +1,105 @@
+import unittest
+import numpy as np
+import signal_monitor as sm
+from tests.software_tests.test_pressure_pads import create_pads
+from tests.utilities import wait_for
+
+
+class SignalMonitorTestCase(unittest.TestCase):
+    def feed(self, monitor, signals, rate=100.0, start=0.0):
+        for i, values in enumerate(signals):
+            monitor.add(start + i / rate, values)
+            if monitor.busy:
+                self.assertTrue(wait_for(lambda: not monitor.busy))
+
+    def test_faults(self):
+        rng = np.random.default_rng(0)
+        n = 256
+        t = np.arange(n) / 100.0
+        signals = np.column_stack([
+            1000 + 20 * rng.standard_normal(n),  # Healthy, with a press in the middle
+            np.zeros(n),  # Disconnected
+            np.full(n, 65472.0),  # Stuck
+            1000 + 2000 * np.sin(2 * np.pi * 40 * t),  # Motor noise at 40 Hz
+        ])
+        signals[100:150, 0] += 20000
+        monitor = sm.SignalMonitor(["A", "B", "C", "D"], block_size=128, decimation=1, flat_time=1.0, max_noise=100)
+        monitor.start()
+        self.feed(monitor, signals)
+        self.assertTrue(wait_for(lambda: monitor.blocks == 2))
+        monitor.close()
+
+        metrics = monitor.metrics()["channels"]
+        self.assertEqual(metrics["A"]["alerts"], [])
+        self.assertEqual(metrics["B"]["alerts"], [sm.FLAT_LINE])
+        self.assertEqual(metrics["C"]["alerts"], [sm.FLAT_LINE, sm.SATURATION])
+        self.assertIn(sm.SPECTRAL_NOISE, metrics["D"]["alerts"])
+        self.assertIn(sm.NOISE, metrics["D"]["alerts"])
+        self.assertAlmostEqual(metrics["D"]["dominant_frequency"], 40, delta=1)
+        self.assertAlmostEqual(metrics["A"]["noise"], 20, delta=5)
+        self.assertAlmostEqual(monitor.sample_rate, 100.0)
+
+    def test_white_noise(self):
+        # Healthy pads, with the default settings
+        monitor = sm.SignalMonitor(["A", "B", "C"])
+        monitor.start()
+        rng = np.random.default_rng(0)
+        blocks = 30
+        self.feed(monitor, 1000 + 20 * rng.standard_normal((blocks * monitor.block_size, 3)))
+        self.assertTrue(wait_for(lambda: monitor.blocks == blocks))
+        monitor.close()
+        self.assertEqual(monitor.alerts, {"A": set(), "B": set(), "C": set()})
+
+    def test_alert_clears(self):
+        monitor = sm.SignalMonitor(["A"], block_size=64, decimation=2, flat_time=0.0)
+        monitor.start()
+        self.feed(monitor, np.zeros((64, 1)))
+        self.assertTrue(wait_for(lambda: monitor.blocks == 1))
+        self.assertEqual(monitor.alerts["A"], {sm.FLAT_LINE})
+        self.feed(monitor, 100 * np.sin(np.linspace(0, np.pi, 64))[:, np.newaxis], start=1.0)
+        self.assertTrue(wait_for(lambda: monitor.blocks == 2))
+        self.assertEqual(monitor.alerts["A"], set())
+        monitor.close()
+
+    def test_mixed_rates(self):
+        # The second block starts at the idle rate and ends at the normal rate, with interference that would show in
+        # the spectrum of evenly spaced samples
+        monitor = sm.SignalMonitor(["A"], block_size=128, decimation=1)
+        monitor.start()
+        rng = np.random.default_rng(0)
+        self.feed(monitor, 1000 + 20 * rng.standard_normal((128, 1)))
+        self.assertTrue(wait_for(lambda: monitor.blocks == 1))
+        peak_ratio = monitor.peak_ratio[0]
+        times = 1.28 + np.concatenate([np.arange(64) / 25.0, 64 / 25.0 + np.arange(64) / 100.0])
+        for i, sample_time in enumerate(times):
+            monitor.add(sample_time, [1000 + 2000 * np.sin(np.pi * i / 2)])
+        self.assertTrue(wait_for(lambda: monitor.blocks == 2))
+        monitor.close()
+        self.assertEqual(monitor.mixed_rate_blocks, 1)
+        self.assertEqual(monitor.peak_ratio[0], peak_ratio)
+        self.assertNotIn(sm.SPECTRAL_NOISE, monitor.alerts["A"])
+
+    def test_disabled_channels(self):
+        monitor = sm.SignalMonitor(["A", "B"], block_size=64, flat_time=0.0, disabled_channels=["B"])
+        monitor.start()
+        rng = np.random.default_rng(0)
+        self.feed(monitor, np.column_stack([1000 + 20 * rng.standard_normal(64), np.zeros(64)]))
+        self.assertTrue(wait_for(lambda: monitor.blocks == 1))
+        monitor.close()
+        self.assertEqual(monitor.alerts, {"A": set()})
+        self.assertEqual(list(monitor.metrics()["channels"]), ["A"])
+
+    def test_pressure_pads(self):
+        pads = create_pads()
+        pads.monitor = sm.SignalMonitor(pads.names, block_size=16, flat_time=0.0)
+        pads.monitor.start()
+        for _ in range(16):
+            pads.push_poll()
+        self.assertTrue(wait_for(lambda: pads.monitor.blocks == 1))
+        quality = pads.metrics()["signal_quality"]
+        self.assertEqual(quality["channels"][pads.names[0]]["alerts"], [sm.FLAT_LINE])
+        pads.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
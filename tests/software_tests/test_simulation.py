@@ -0,0 +1,47 @@
+import threading
+import unittest
+import numpy as np
+import chipmunk as cm
+import simulation as sim
+
+
+class SimulationTestCase(unittest.TestCase):
+    def test_scripted_session(self):
+        # Right is incorrect, and None times out after 10 virtual seconds
+        tests = [cm.Test(cm.LEFT, response_timeout=10, inter_trial_interval=5, promotion_streak=2),
+                 cm.Test([cm.MIDDLE, cm.LEFT], response_timeout=10)]
+        animal = sim.ScriptedAnimal([cm.RIGHT, None, cm.LEFT, cm.LEFT] + [cm.MIDDLE, cm.LEFT] * 3)
+        result = sim.run_session(tests, cm.DEFAULT_CHANNELS, seed=0, animal=animal, criterion=1.0,
+                                 criterion_window=3)
+        self.assertTrue(result["learned"])
+        self.assertEqual(result["trials_to_last_test"], 5)
+        self.assertEqual(result["trials_to_criterion"], 7)
+        self.assertEqual(result["rewards"], 2 + 3)
+        # The time-out and the inter-trial intervals are not slept, but advance the virtual clock
+        self.assertGreater(result["hours"] * 3600, 10 + 6 * 5)
+
+    def test_cues(self):
+        # Tests with cues can be simulated, but the cues are not played, so no cue thread is started
+        threads = threading.active_count()
+        cue = {"led": cm.ANSWER_LED, "duration": 0.1, "count": 3}
+        tests = [cm.Test(cm.LEFT, response_timeout=10, trial_cue=[cue], reward_cue=[dict(cue, led=cm.ALL_LEDS)])]
+        animal = sim.ScriptedAnimal([cm.RIGHT, cm.LEFT, cm.LEFT])
+        result = sim.run_session(tests, cm.DEFAULT_CHANNELS, seed=0, animal=animal, criterion=1.0,
+                                 criterion_window=2)
+        self.assertTrue(result["learned"])
+        self.assertEqual(result["rewards"], 2)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_animal_learns(self):
+        tests = [cm.Test(cm.RIGHT)]
+        results = [sim.run_session(tests, cm.DEFAULT_CHANNELS, seed) for seed in range(5)]
+        self.assertEqual(sim.summarize(results)["learned_fraction"], 1.0)
+
+    def test_side_bias(self):
+        animal = sim.Animal(cm.DEFAULT_CHANNELS, np.random.default_rng(0), side_bias={cm.LEFT: 2.0}, engagement=1.0)
+        choices = [animal.respond()[0] for _ in range(200)]
+        self.assertGreater(choices.count(cm.LEFT), 150)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import json
+import tempfile
+import unittest
+import chipmunk as cm
+import simulation as sim
+from tests.utilities import create_experiment
+
+
+class SessionSummaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.summary_file = os.path.join(self.folder.name, "summary.json")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_experiment(self):
+        clock = sim.VirtualClock()
+        animal = sim.ScriptedAnimal([cm.LEFT, cm.RIGHT, None, cm.LEFT, cm.LEFT, cm.MIDDLE, cm.LEFT])
+        conveyors = {name: sim.SimulatedConveyor(name.lower(), animal) for name in cm.DEFAULT_CHANNELS}
+        summary = cm.SessionSummary(conveyors, self.summary_file, clock=clock.monotonic)
+        tests = [cm.Test(cm.LEFT, repeat=3, response_timeout=10), cm.Test([cm.MIDDLE, cm.LEFT])]
+        experiment = create_experiment(tests, animal, clock=clock, conveyors=conveyors, summary=summary)
+        for _ in range(7):
+            experiment.testing_phase()
+        summary.close()
+
+        with open(self.summary_file) as fh:
+            data = json.load(fh)
+        self.assertEqual(data["results"], 7)
+        self.assertEqual((data["correct"], data["incorrect"], data["timeouts"]), (5, 1, 1))
+        self.assertAlmostEqual(data["accuracy"], 5 / 7)
+        self.assertEqual(data["tests"]["0"], {"results": 5, "correct": 3, "accuracy": 0.6})
+        self.assertEqual(data["tests"]["1"]["results"], 2)
+        self.assertEqual(data["streak"], 4)
+        self.assertEqual(data["longest_streak"], 4)
+        self.assertEqual(sum(data["rewards"].values()), 4)
+        self.assertGreater(data["results_per_hour"], 0)
+        self.assertFalse(os.path.exists(self.summary_file + ".tmp"))
+
+    def test_periodic_write(self):
+        summary = cm.SessionSummary({}, self.summary_file, interval=0.01)
+        summary.start_writing()
+        summary.record(cm.CORRECT, 0, True)
+        try:
+            for _ in range(200):
+                if os.path.exists(self.summary_file):
+                    with open(self.summary_file) as fh:
+                        if json.load(fh)["results"] == 1:
+                            break
+                summary.stop_event.wait(0.01)
+            with open(self.summary_file) as fh:
+                self.assertEqual(json.load(fh)["results"], 1)
+        finally:
+            summary.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
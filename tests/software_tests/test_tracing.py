@@ -0,0 +1,66 @@
+import os
+import json
+import tempfile
+import unittest
+import chipmunk as cm
+import simulation as sim
+from tests.utilities import create_experiment
+
+
+class TracerTestCase(unittest.TestCase):
+    def test_trace_file(self):
+        with tempfile.TemporaryDirectory() as folder:
+            tracer = cm.Tracer(os.path.join(folder, "trace.json"), buffer_size=4, max_files=2)
+            with tracer.span("outer"):
+                with tracer.span("inner", cm.LEFT):
+                    pass
+                tracer.instant("detection", cm.LEFT)
+            tracer.close()
+            with open(os.path.join(folder, f"trace_{tracer.session}_0000.json")) as fh:
+                events = json.load(fh)["traceEvents"]
+            self.assertEqual([(event["name"], event["ph"]) for event in events],
+                             [("process_name", "M"), ("inner", "X"), ("detection", "i"), ("outer", "X")])
+            self.assertEqual(events[1]["args"], {"value": cm.LEFT})
+            self.assertGreaterEqual(events[1]["ts"], events[3]["ts"])
+            self.assertLessEqual(events[1]["dur"], events[3]["dur"])
+
+    def test_fixed_buffer_and_rotation(self):
+        with tempfile.TemporaryDirectory() as folder:
+            tracer = cm.Tracer(os.path.join(folder, "trace.json"), buffer_size=4, max_files=2)
+            for _ in range(6):
+                tracer.instant("event")
+            self.assertEqual(tracer.count, 4)
+            self.assertEqual(tracer.dropped, 2)
+            for _ in range(3):
+                tracer.end_trial()
+                for _ in range(3):
+                    tracer.instant("event")
+            tracer.close()
+            self.assertEqual(sorted(os.listdir(folder)),
+                             [f"trace_{tracer.session}_0002.json", f"trace_{tracer.session}_0003.json"])
+
+            # The files of the next session are kept next to them
+            tracer = cm.Tracer(os.path.join(folder, "trace.json"), buffer_size=4, max_files=2)
+            tracer.session = "next"
+            tracer.instant("event")
+            tracer.close()
+            self.assertEqual(len(os.listdir(folder)), 3)
+
+    def test_experiment(self):
+        tracer = cm.Tracer(buffer_size=100)
+        experiment = create_experiment([cm.Test(cm.LEFT)], sim.ScriptedAnimal([cm.LEFT]), tracer=tracer)
+        experiment.testing_phase()
+        names = tracer.names[:tracer.count]
+        for name in ["wait for press", "detection", "feed", "wait release", "log result", "trial"]:
+            self.assertIn(name, names)
+        self.assertEqual(names[-1], "trial")
+
+    def test_null_tracer(self):
+        tracer = cm.NullTracer()
+        with tracer.span("trial"):
+            tracer.instant("detection")
+        tracer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import glob
+import json
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from collector import Collector
+from uploader import ResultUploader, PENDING_FILE, REJECTED_FOLDER, MALFORMED_FILE
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class UploaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.spool_folder = os.path.join(self.folder.name, "spool")
+        self.collected_folder = os.path.join(self.folder.name, "collected")
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}/results"
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def start_collector(self):
+        collector = Collector(("127.0.0.1", self.port), self.collected_folder)
+        threading.Thread(target=collector.serve_forever, daemon=True).start()
+        self.addCleanup(collector.server_close)
+        self.addCleanup(collector.shutdown)
+        return collector
+
+    def uploader(self):
+        return ResultUploader(self.url, self.spool_folder, rig_id="rig01", batch_size=2, interval=0.1, timeout=2.0,
+                              min_backoff=0.05, max_backoff=0.1)
+
+    def collected_rows(self):
+        path = os.path.join(self.collected_folder, "rig01", "results.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_upload(self):
+        self.start_collector()
+        uploader = self.uploader()
+        uploader.start()
+        uploader.add_session({"configuration": "config.toml"})
+        for trial in range(5):
+            uploader.add_result({"Result": "Correct", "Test": trial})
+        uploader.close()
+        self.assertEqual([row["Test"] for row in self.collected_rows()], list(range(5)))
+        self.assertEqual(glob.glob(os.path.join(self.spool_folder, "batch_*")), [])
+
+    def test_offline_spool(self):
+        # Without a collector, the batches stay on disk
+        uploader = self.uploader()
+        uploader.start()
+        for trial in range(3):
+            uploader.add_result({"Test": trial})
+        uploader.close()
+        self.assertGreater(len(glob.glob(os.path.join(self.spool_folder, "batch_*.json.gz"))), 0)
+
+        # and are uploaded by the next run
+        self.start_collector()
+        uploader = self.uploader()
+        uploader.start()
+        uploader.add_result({"Test": 3})
+        uploader.close()
+        self.assertEqual(sorted(row["Test"] for row in self.collected_rows()), [0, 1, 2, 3])
+        self.assertEqual(glob.glob(os.path.join(self.spool_folder, "batch_*")), [])
+
+    def test_partial_line(self):
+        # A run that stopped while spooling a record
+        os.makedirs(self.spool_folder)
+        with open(os.path.join(self.spool_folder, PENDING_FILE), 'w') as fh:
+            fh.write(json.dumps({"type": "result", "time": "", "data": {"Test": 0}}) + "\n")
+            fh.write('{"type": "result", "ti')
+        self.start_collector()
+        uploader = self.uploader()
+        with self.assertLogs("chipmunk.uploader", "WARNING"):
+            uploader.start()
+            uploader.add_result({"Test": 1})
+            uploader.close()
+        self.assertEqual(sorted(row["Test"] for row in self.collected_rows()), [0, 1])
+        with open(os.path.join(self.spool_folder, REJECTED_FOLDER, MALFORMED_FILE)) as fh:
+            self.assertEqual(fh.read(), '{"type": "result", "ti\n')
+
+    def test_error(self):
+        # The thread carries on after an error, and the records are spooled later
+        self.start_collector()
+        uploader = self.uploader()
+        spool = uploader.spool
+        failed = threading.Event()
+
+        def failing_spool(record):
+            uploader.spool = spool
+            uploader.unspooled.append(record)
+            failed.set()
+            raise OSError("No space left on device")
+
+        uploader.spool = failing_spool
+        uploader.add_result({"Test": 0})
+        with self.assertLogs("chipmunk.uploader", "ERROR"):
+            uploader.start()
+            self.assertTrue(failed.wait(2.0))
+            uploader.add_result({"Test": 1})
+            uploader.close()
+        self.assertEqual(sorted(row["Test"] for row in self.collected_rows()), [0, 1])
+
+    def test_duplicate_batch(self):
+        collector = self.start_collector()
+        batch = {"rig": "rig01", "batch": "b1", "records": [{"type": "result", "data": {"Test": 0}}]}
+        self.assertTrue(collector.store("rig01", "b1", batch))
+        self.assertFalse(collector.store("rig01", "b1", batch))
+        self.assertEqual(len(self.collected_rows()), 1)
+
+    def test_invalid_batch(self):
+        self.start_collector()
+        # The second result is not an object, so the first one is not stored either
+        batch = {"rig": "rig01", "batch": "b1", "records": [{"type": "result", "data": {"Test": 0}},
+                                                             {"type": "result", "data": "Test"}]}
+        request = urllib.request.Request(self.url, json.dumps(batch).encode('utf-8'))
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request, timeout=2.0)
+        self.assertEqual(context.exception.code, 400)
+        self.assertFalse(os.path.exists(os.path.join(self.collected_folder, "rig01")))
+
+    def test_add_does_not_block(self):
+        uploader = ResultUploader(self.url, self.spool_folder, queue_size=2)
+        for trial in range(3):
+            uploader.add_result({"Test": trial})  # Not started, so nothing takes from the queue
+        self.assertEqual(uploader.dropped, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import time
+import tempfile
+import threading
+import tracemalloc
+import unittest
+import numpy as np
+import chipmunk as cm
+import acquisition
+from waveforms import WaveformRecorder, load_waveforms
+from tests.fake.fake_analog_in import ANALOG_CHANNELS
+from tests.software_tests.test_pressure_pads import create_pads
+
+
+class WaveformRecorderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_snippets(self):
+        recorder = WaveformRecorder(["A", "B"], self.folder.name, pre_samples=3, post_samples=2)
+        for i in range(5):
+            recorder.add(float(i), [i, -i])
+        recorder.trigger()  # The onset is sample 4
+        recorder.add(5.0, [5, -5])
+        self.assertEqual(recorder.finish(), f"{recorder.path.split('/')[-1]}:0")
+        self.assertEqual(recorder.finish(), "")  # Written once
+
+        # A press early in the session, released before the end of the snippet
+        recorder.add(6.0, [6, -6])
+        recorder.trigger()
+        recorder.finish()
+        for i in range(7, 12):
+            recorder.add(float(i), [i, -i])  # Not recorded, as the snippet was written
+        recorder.close()
+
+        waveforms, header = load_waveforms(recorder.path)
+        self.assertEqual(header["channels"], ["A", "B"])
+        self.assertEqual(waveforms["values"].shape, (2, 5, 2))
+        np.testing.assert_array_equal(waveforms["values"][0, :, 0], [2, 3, 4, 5, np.nan])
+        np.testing.assert_array_equal(waveforms["time"][0], [-2, -1, 0, 1, np.nan])
+        np.testing.assert_array_equal(waveforms["values"][1, :, 1], [-4, -5, -6, np.nan, np.nan])
+
+    def test_pressure_pads(self):
+        pads = create_pads()
+        pads.waveforms = WaveformRecorder(pads.names, self.folder.name, pre_samples=4, post_samples=4)
+        try:
+            timer = threading.Timer(0.02, ANALOG_CHANNELS[2].set_value, args=(10000,))
+            timer.start()
+            self.assertEqual(pads.push_wait(time.monotonic() + 1), cm.MIDDLE)
+            timer.join()
+            for _ in range(4):
+                pads.push_poll()
+            pads.waveforms.finish()
+        finally:
+            ANALOG_CHANNELS[2].set_value(0)
+        pads.close()
+        waveforms, _ = load_waveforms(pads.waveforms.path)
+        middle = waveforms["values"][0, :, pads.names.index(cm.MIDDLE)]
+        self.assertEqual(middle[0], 0)
+        self.assertTrue(np.all(middle[3:] == 10000))
+        self.assertTrue(np.all(np.diff(waveforms["time"][0]) > 0))
+
+    def test_sample_during_feed(self):
+        pads = create_pads()
+        pads.waveforms = WaveformRecorder(pads.names, self.folder.name, pre_samples=4, post_samples=8)
+        try:
+            timer = threading.Timer(0.02, ANALOG_CHANNELS[2].set_value, args=(10000,))
+            timer.start()
+            self.assertEqual(pads.push_wait(time.monotonic() + 1), cm.MIDDLE)
+            timer.join()
+            # The feed comes before waiting for the release
+            pads.sample_during(lambda: time.sleep(0.2))
+            self.assertFalse(pads.waveforms.capturing)
+            pads.waveforms.finish()
+        finally:
+            ANALOG_CHANNELS[2].set_value(0)
+        pads.close()
+        waveforms, _ = load_waveforms(pads.waveforms.path)
+        middle = waveforms["values"][0, :, pads.names.index(cm.MIDDLE)]
+        self.assertTrue(np.all(middle[3:] == 10000))
+
+    def test_acquisition_ring(self):
+        ring = acquisition.AcquisitionRing(2, sample_capacity=16, event_capacity=4)
+        try:
+            recorder = WaveformRecorder(["A", "B"], self.folder.name, pre_samples=3, post_samples=2)
+            waveforms = acquisition.RingWaveforms(ring, recorder)
+            for i in range(20):  # The first 4 samples are overwritten
+                ring.samples[i % 16, acquisition.SAMPLE_TIME] = i
+                ring.samples[i % 16, acquisition.SAMPLE_COLUMNS:] = [i, -i]
+            ring.header[acquisition.SAMPLES_WRITTEN] = 20
+            waveforms.trigger(10)
+            self.assertEqual(waveforms.finish(), f"{recorder.path.split('/')[-1]}:0")
+            waveforms.trigger(18)  # The last sample after the press was not written yet
+            waveforms.finish()
+            waveforms.trigger(5)  # The first sample before the press was overwritten
+            waveforms.finish()
+            self.assertEqual(waveforms.finish(), "")
+            waveforms.close()
+        finally:
+            ring.close()
+        waveforms, _ = load_waveforms(recorder.path)
+        np.testing.assert_array_equal(waveforms["values"][0, :, 0], [8, 9, 10, 11, 12])
+        np.testing.assert_array_equal(waveforms["time"][0], [-2, -1, 0, 1, 2])
+        np.testing.assert_array_equal(waveforms["values"][1, :, 1], [-16, -17, -18, -19, np.nan])
+        np.testing.assert_array_equal(waveforms["values"][2, :, 0], [np.nan, 4, 5, 6, 7])
+
+    def test_no_allocation(self):
+        recorder = WaveformRecorder(["A", "B", "C"], self.folder.name, pre_samples=20, post_samples=40)
+        values = np.ones(3)
+        for i in range(100):
+            recorder.add(float(i), values)
+        tracemalloc.start()
+        try:
+            for trial in range(20):
+                recorder.trigger()
+                for i in range(60):
+                    recorder.add(float(i), values)
+                recorder.finish()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        # Only small, temporary objects: nothing that grows with the number of samples or presses
+        self.assertLess(sum(stat.size for stat in snapshot.statistics('filename')), 10000)
+        recorder.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,19 @@
+import time
 import pygame
-import os
-import toml
 from tests.fake.fake_analog_in import ANALOG_CHANNELS, set_on_value_callback
+from tests.fake import fake_rfid
 
 RISING_CALLBACKS = {}
 FALLING_CALLBACKS = {}
 PIN_DICT = {}
 REVERSE_PIN_DICT = {}
 PIN_VALUES = {}
-KEY_TO_INPUT_MAP = {
-    pygame.K_a: "left_pressure_pad_pin",
-    pygame.K_s: "middle_pressure_pad_pin",
-    pygame.K_d: "right_pressure_pad_pin",
-}
+KEY_TO_INPUT_MAP = {}
+# The keys used to activate the pressure pads, in the order of the channel table
+PRESSURE_PAD_KEYS = [pygame.K_a, pygame.K_s, pygame.K_d, pygame.K_f, pygame.K_g, pygame.K_h, pygame.K_j, pygame.K_k]
+# The keys used to identify an animal with the fake RFID reader
+ANIMAL_KEYS = [pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4, pygame.K_5, pygame.K_6, pygame.K_7, pygame.K_8,
+               pygame.K_9]
 
 
 class RACExitRequest(Exception):
@@ -20,7 +21,7 @@ class RACExitRequest(Exception):
         super().__init__("exit request")
 
 
-def init(configuration_file):
+def init(channels, animal_keys=False):
     global PIN_DICT
     global REVERSE_PIN_DICT
     global PIN_VALUES
@@ -28,13 +29,19 @@ def init(configuration_file):
     pygame.mixer.init()
     pygame.display.init()
     pygame.display.set_mode((1280, 768))
-    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), configuration_file)) as fh:
-        PIN_DICT = toml.load(fh)
+    PIN_DICT = {}
+    for key, channel in zip(PRESSURE_PAD_KEYS, channels):
+        name = f"{channel.name.lower()}_pressure_pad_pin"
+        PIN_DICT[name] = channel.pressure_pad_pin
+        KEY_TO_INPUT_MAP[key] = name
     REVERSE_PIN_DICT = {v: k for k, v in PIN_DICT.items()}
     PIN_VALUES = {k: 0 for k in REVERSE_PIN_DICT}
     print("TEST_MODE: Running in test mode!")
     for k, v in KEY_TO_INPUT_MAP.items():
         print(f"TEST_MODE: Press {pygame.key.name(k)} to activate {v}")
+    if animal_keys:
+        print(f"TEST_MODE: Press 1-9 to identify animal {fake_rfid.ANIMAL_ID_FORMAT.format(1)}-"
+              f"{fake_rfid.ANIMAL_ID_FORMAT.format(9)}")
     set_on_value_callback(process_events)
 
 
@@ -47,6 +54,10 @@ def process_events():
                 pin = PIN_DICT[activate_input]
                 if pin in ANALOG_CHANNELS:
                     ANALOG_CHANNELS[pin].set_value(10000)
+            elif event.key in ANIMAL_KEYS:
+                tag = fake_rfid.ANIMAL_ID_FORMAT.format(ANIMAL_KEYS.index(event.key) + 1)
+                print(f"TEST_MODE: Identifying {tag}", flush=True)
+                fake_rfid.set_tag(tag)
             elif event.key == pygame.K_ESCAPE:
                 raise RACExitRequest()
         elif event.type == pygame.KEYUP:
@@ -56,3 +67,29 @@ def process_events():
                 pin = PIN_DICT[activate_input]
                 if pin in ANALOG_CHANNELS:
                     ANALOG_CHANNELS[pin].set_value(0)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def create_experiment(tests, animal, clock=None, conveyors=None, **kwargs):
+    # A simulated experiment on a virtual clock, which does not write any files. Imported here, because chipmunk.py
+    # imports this module in test mode.
+    import chipmunk as cm
+    import simulation as sim
+    if clock is None:
+        clock = sim.VirtualClock()
+    if conveyors is None:
+        conveyors = {name: sim.SimulatedConveyor(name.lower(), animal) for name in cm.DEFAULT_CHANNELS}
+    return cm.Experiment(sim.SimulatedParameters(tests),
+                         sim.SimulatedPressurePads(animal, clock),
+                         conveyors,
+                         sim.SimulatedLeds(),
+                         progression_file=None,
+                         results_file=None,
+                         scheduler=cm.DeadlineScheduler(clock.monotonic, clock.sleep),
+                         **kwargs)
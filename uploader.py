@@ -0,0 +1,214 @@
+"""
+Shipping results from a rig to a collector service (such as collector.py).
+
+The experiment hands every result row to ResultUploader.add_result, which only puts it on a queue and never waits.
+A background thread appends the queued records to a spool file on the local disk, and regularly seals the spool into
+a compressed batch file. The batch files are posted to the collector, oldest first, and only removed once the
+collector accepted them. When the network or the collector is down, the batches stay on disk (also across restarts)
+and are retried with an exponential backoff. A batch that the collector rejects (an HTTP 4xx response) is retried at
+most max_attempts times, and then moved to the rejected folder of the spool.
+
+Errors of the background thread, such as a full disk, are logged and the thread carries on; records that could not be
+spooled stay in memory and are spooled with the next ones. Lines of the spool file that cannot be read (the last line
+is cut short if the program stopped while writing it) are not uploaded, but kept in rejected/malformed.jsonl.
+
+A batch is a gzip-compressed JSON object: {"rig": ..., "batch": ..., "records": [{"type": ..., "time": ..., "data":
+...}, ...]}, where the type is "session" (metadata about a session) or "result" (a row of the results file).
+"""
+import os
+import glob
+import gzip
+import json
+import time
+import queue
+import random
+import socket
+import logging
+import datetime
+import threading
+import urllib.error
+import urllib.request
+
+logger = logging.getLogger("chipmunk.uploader")
+
+SPOOL_FOLDER = "upload_spool"
+PENDING_FILE = "pending.jsonl"
+REJECTED_FOLDER = "rejected"
+MALFORMED_FILE = "malformed.jsonl"  # In the rejected folder
+SESSION = "session"
+RESULT = "result"
+
+
+class ResultUploader:
+    def __init__(self, url, spool_folder=SPOOL_FOLDER, rig_id=None, batch_size=100, interval=60.0, timeout=10.0,
+                 min_backoff=1.0, max_backoff=600.0, max_attempts=10, queue_size=10000):
+        self.url = url
+        self.spool_folder = spool_folder
+        self.rig_id = rig_id if rig_id is not None else socket.gethostname()
+        self.batch_size = batch_size  # A batch is sealed once it has this many records,
+        self.interval = interval  # or once its first record is this many seconds old
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0  # Records that did not fit on the queue
+        self.unspooled = []  # Records taken from the queue, but not yet written to the spool file
+        self.pending_path = os.path.join(spool_folder, PENDING_FILE)
+        self.pending_count = 0
+        self.pending_since = None
+        self.batch_count = 0
+        self.backoff = 0.0
+        self.next_attempt = 0.0
+        self.attempts = {}  # The number of rejections of every batch
+        os.makedirs(os.path.join(spool_folder, REJECTED_FOLDER), exist_ok=True)
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="uploader", daemon=True)
+
+    # Called by the experiment
+    def start(self):
+        self.thread.start()
+        logger.info("Uploading results to %s", self.url)
+
+    def add_session(self, metadata):
+        self.add(SESSION, metadata)
+
+    def add_result(self, row):
+        self.add(RESULT, row)
+
+    def add(self, record_type, data):
+        try:
+            self.queue.put_nowait({"type": record_type, "time": datetime.datetime.now().isoformat(), "data": data})
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5.0):
+        # Spools the remaining records, seals them into a batch and tries to upload once more
+        self.stop_event.set()
+        self.thread.join(timeout)
+        if self.dropped:
+            logger.warning("%s records were not uploaded, because the upload queue was full", self.dropped)
+
+    # The background thread
+    def run(self):
+        try:
+            if os.path.exists(self.pending_path):
+                self.seal()  # Left behind by a previous run
+        except Exception:
+            logger.exception("Sealing the records of a previous run failed")
+        while not self.stop_event.is_set():
+            try:
+                self.step()
+            except Exception:
+                logger.exception("Spooling or uploading results failed")
+                self.stop_event.wait(1.0)
+        try:
+            self.spool(None)
+            self.seal()
+            self.upload_batches()
+        except Exception:
+            logger.exception("Spooling or uploading the last results failed")
+
+    def step(self):
+        try:
+            record = self.queue.get(timeout=1.0)
+        except queue.Empty:
+            record = None
+        self.spool(record)
+        if self.pending_count >= self.batch_size or \
+                (self.pending_count and time.monotonic() - self.pending_since >= self.interval):
+            self.seal()
+        if time.monotonic() >= self.next_attempt:
+            self.upload_batches()
+
+    def spool(self, record):
+        # Appends the record, and all others on the queue, to the spool file
+        if record is not None:
+            self.unspooled.append(record)
+        while True:
+            try:
+                self.unspooled.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not self.unspooled:
+            return
+        with open(self.pending_path, 'a') as fh:
+            for record in self.unspooled:
+                fh.write(json.dumps(record, default=str) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        if self.pending_count == 0:
+            self.pending_since = time.monotonic()
+        self.pending_count += len(self.unspooled)
+        self.unspooled = []
+
+    def seal(self):
+        if not os.path.exists(self.pending_path):
+            return
+        records = []
+        malformed = []
+        with open(self.pending_path) as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    malformed.append(line.rstrip("\n") + "\n")
+        if malformed:
+            malformed_path = os.path.join(self.spool_folder, REJECTED_FOLDER, MALFORMED_FILE)
+            logger.warning("Skipping %s malformed records of %s, keeping them in %s", len(malformed),
+                           self.pending_path, malformed_path)
+            with open(malformed_path, 'a') as fh:
+                fh.writelines(malformed)
+        if records:
+            timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            batch_id = f"{self.rig_id}_{timestamp}_{self.batch_count:06d}"
+            self.batch_count += 1
+            path = os.path.join(self.spool_folder, f"batch_{timestamp}_{self.batch_count:06d}.json.gz")
+            with gzip.open(path + ".tmp", 'wt') as fh:
+                json.dump({"rig": self.rig_id, "batch": batch_id, "records": records}, fh)
+            os.replace(path + ".tmp", path)
+        os.remove(self.pending_path)
+        self.pending_count = 0
+
+    def upload_batches(self):
+        for path in sorted(glob.glob(os.path.join(self.spool_folder, "batch_*.json.gz"))):
+            if self.stop_event.is_set() and self.backoff > 0:
+                return  # Do not keep retrying while closing
+            if not self.upload(path):
+                self.backoff = min(self.max_backoff, max(self.min_backoff, self.backoff * 2))
+                self.next_attempt = time.monotonic() + self.backoff * random.uniform(0.5, 1.0)
+                return
+            self.backoff = 0.0
+
+    def upload(self, path):
+        # Returns False if the batch should be retried later
+        with open(path, 'rb') as fh:
+            body = fh.read()
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as err:
+            if 400 <= err.code < 500:
+                attempts = self.attempts.get(path, 0) + 1
+                self.attempts[path] = attempts
+                if attempts >= self.max_attempts:
+                    logger.error("The collector rejected %s %s times (%s), moving it to %s", path, attempts, err,
+                                 REJECTED_FOLDER)
+                    os.replace(path, os.path.join(self.spool_folder, REJECTED_FOLDER, os.path.basename(path)))
+                    del self.attempts[path]
+                    return True
+            logger.warning("Uploading %s failed: %s", path, err)
+            return False
+        except (urllib.error.URLError, OSError) as err:
+            if self.backoff == 0:
+                logger.warning("Uploading results failed, retrying later: %s", err)
+            return False
+        os.remove(path)
+        self.attempts.pop(path, None)
+        return True
@@ -0,0 +1,145 @@
+"""
+Capturing the pressure curve of every press.
+
+PressurePads keeps the last pre_samples samples of all channels in a preallocated ring. When a press is detected, the
+ring is copied to a snippet, which is then filled with the post_samples samples that follow. The pads keep being read
+while feeding until the snippet is complete (see PressurePads.sample_during). The snippet is written when the result of
+the trial is logged; samples that were not read by then are NaN. Every sample is stored with its time relative to the
+onset of the press (the sample in which the press was detected, the last of the pre-trigger samples), because the pads
+are read at the idle frequency before a press.
+
+With an acquisition process, the snippets are copied from its sample ring instead (see acquisition.RingWaveforms),
+which holds every sample.
+
+The snippets of a session are written as fixed-size records to waveforms_<start time>.bin, with the channels and
+sizes in waveforms_<start time>.json. The Waveform column of the results (the last one) holds <file>:<record>.
+Nothing is allocated while sampling or writing the snippets.
+
+To analyse the snippets of a session:
+
+    waveforms, header = load_waveforms("waveforms/waveforms_20260101_120000.bin")
+    waveforms["values"]  # Shape (presses, samples, channels), in the order of header["channels"]
+    waveforms["time"]  # Shape (presses, samples), in seconds relative to the onset
+"""
+import os
+import json
+import datetime
+import numpy as np
+
+WAVEFORM_FOLDER = "waveforms"
+NO_WAVEFORM = ""
+
+
+def waveform_dtype(nb_channels, nb_samples):
+    return np.dtype([("time", np.float32, (nb_samples,)), ("values", np.float32, (nb_samples, nb_channels))])
+
+
+class WaveformRecorder:
+    def __init__(self, channel_names, folder=WAVEFORM_FOLDER, pre_samples=20, post_samples=40):
+        self.channel_names = list(channel_names)
+        self.folder = folder
+        self.pre_samples = pre_samples
+        self.post_samples = post_samples
+        nb_channels = len(self.channel_names)
+
+        # The pre-trigger ring, written at position ring_index
+        self.ring_times = np.zeros(pre_samples)
+        self.ring_values = np.zeros((pre_samples, nb_channels))
+        self.ring_index = 0
+        self.ring_count = 0
+
+        # The snippet, as one record that is written to the file as it is
+        self.record = np.zeros(1, dtype=waveform_dtype(nb_channels, pre_samples + post_samples))
+        self.times = self.record["time"][0]
+        self.values = self.record["values"][0]
+        self.onset = 0.0
+        self.filled = 0  # The number of samples in the snippet
+        self.capturing = False  # Whether the snippet is being filled
+        self.triggered = False  # Whether the snippet has not been written yet
+
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.path = os.path.join(folder, f"waveforms_{timestamp}.bin")
+        self.file = None
+        self.records = 0
+
+    def add(self, sample_time, values):
+        # Called for every sample
+        if self.capturing:
+            self.times[self.filled] = sample_time - self.onset
+            self.values[self.filled] = values
+            self.filled += 1
+            self.capturing = self.filled < len(self.times)
+        self.ring_times[self.ring_index] = sample_time
+        self.ring_values[self.ring_index] = values
+        self.ring_index = (self.ring_index + 1) % self.pre_samples
+        self.ring_count = min(self.ring_count + 1, self.pre_samples)
+
+    def trigger(self):
+        # Called when a press is detected, after adding the sample in which it was detected
+        self.onset = self.ring_times[self.ring_index - 1]
+        self.times.fill(np.nan)
+        self.values.fill(np.nan)
+        # Copy the ring in chronological order, aligned to the end of the pre-trigger window
+        start = self.pre_samples - self.ring_count
+        older = self.pre_samples - self.ring_index  # The samples from ring_index to the end of the ring come first
+        if self.ring_count == self.pre_samples:
+            np.subtract(self.ring_times[self.ring_index:], self.onset, out=self.times[:older])
+            np.subtract(self.ring_times[:self.ring_index], self.onset, out=self.times[older:self.pre_samples])
+            self.values[:older] = self.ring_values[self.ring_index:]
+            self.values[older:self.pre_samples] = self.ring_values[:self.ring_index]
+        else:
+            np.subtract(self.ring_times[:self.ring_count], self.onset, out=self.times[start:self.pre_samples])
+            self.values[start:self.pre_samples] = self.ring_values[:self.ring_count]
+        self.filled = self.pre_samples
+        self.capturing = self.post_samples > 0
+        self.triggered = True
+
+    def capture(self, times, values, onset):
+        # Sets the snippet to samples that were read elsewhere, where values[onset] is the sample in which the press was
+        # detected and onset < pre_samples
+        self.onset = times[onset]
+        self.times.fill(np.nan)
+        self.values.fill(np.nan)
+        start = self.pre_samples - 1 - onset
+        count = min(len(times), len(self.times) - start)
+        np.subtract(times[:count], self.onset, out=self.times[start:start + count])
+        self.values[start:start + count] = values[:count]
+        self.filled = start + count
+        self.capturing = False
+        self.triggered = True
+
+    def finish(self):
+        # Writes the snippet of the last press, if it was not written yet, and returns its key for the results
+        if not self.triggered:
+            return NO_WAVEFORM
+        if self.file is None:
+            self.open()
+        self.file.write(self.record.data)
+        self.file.flush()
+        self.triggered = False
+        self.capturing = False
+        self.records += 1
+        return f"{os.path.basename(self.path)}:{self.records - 1}"
+
+    def open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        header = {"channels": self.channel_names,
+                  "pre_samples": self.pre_samples,
+                  "post_samples": self.post_samples,
+                  "dtype": "float32"}
+        with open(os.path.splitext(self.path)[0] + ".json", 'w') as fh:
+            json.dump(header, fh)
+        self.file = open(self.path, 'ab')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def load_waveforms(path):
+    # Returns the snippets of a session as one structured array (see the module documentation), and the header
+    with open(os.path.splitext(path)[0] + ".json") as fh:
+        header = json.load(fh)
+    dtype = waveform_dtype(len(header["channels"]), header["pre_samples"] + header["post_samples"])
+    return np.fromfile(path, dtype=dtype), header